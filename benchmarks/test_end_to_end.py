@@ -0,0 +1,74 @@
+"""
+Round trips through the snowflake connector, the api and a local postgresql container (requires docker)
+"""
+
+from pytest import fixture, mark
+from snowflake import connector
+
+from yellowbox_snowglobe.result_cache import ResultCache
+from yellowbox_snowglobe.service import SnowGlobeService
+
+
+@fixture(scope="module")
+def snowglobe(docker_client) -> SnowGlobeService:
+    with SnowGlobeService.run(docker_client) as service:
+        yield service
+
+
+@fixture(scope="module", params=["json", "arrow"])
+def connection(snowglobe, request):
+    with connector.connect(
+        **snowglobe.local_connection_kwargs(),
+        database=f"bench_{request.param}",
+        session_parameters={"PYTHON_CONNECTOR_QUERY_RESULT_FORMAT": request.param},
+    ) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("create or replace table bar (x int, y text, z timestamp)")
+            cursor.execute(
+                "insert into bar select i, 'value ' || i, '2020-01-01'::timestamp + i * interval '1 second'"
+                " from generate_series(1, 100000) as i"
+            )
+        conn.commit()
+        yield conn
+
+
+@mark.benchmark(group="end-to-end")
+def test_trivial_query(benchmark, connection):
+    benchmark(lambda: connection.cursor().execute("select 1").fetchall())
+
+
+@mark.benchmark(group="end-to-end")
+def test_transpiled_query(benchmark, connection):
+    query = "select iff(x > 5, y, null) as a, x::string as b, current_timestamp() as c from bar where x < 10"
+    benchmark(lambda: connection.cursor().execute(query).fetchall())
+
+
+@mark.benchmark(group="end-to-end-size")
+@mark.parametrize("n_rows", [100, 10_000, 100_000])
+def test_fetch_rows(benchmark, connection, n_rows):
+    benchmark(lambda: connection.cursor().execute(f"select x, y, z from bar where x <= {n_rows}").fetchall())
+
+
+@mark.benchmark(group="end-to-end-size")
+@mark.parametrize("n_rows", [100, 10_000])
+def test_fetch_cached_rows(benchmark, snowglobe, connection, monkeypatch, n_rows):
+    monkeypatch.setattr(snowglobe.api, "result_cache", ResultCache())
+    benchmark(lambda: connection.cursor().execute(f"select x, y, z from bar where x <= {n_rows}").fetchall())
+
+
+@mark.benchmark(group="end-to-end")
+def test_bound_inserts(benchmark, connection):
+    connection.cursor().execute("create or replace table baz (x int, y text)")
+    rows = [(i, str(i)) for i in range(1000)]
+    benchmark(lambda: connection.cursor().executemany("insert into baz values (%s, %s)", rows))
+
+
+@mark.benchmark(group="end-to-end")
+def test_async_query(benchmark, connection):
+    def run():
+        cursor = connection.cursor()
+        cursor.execute_async("select x, y from bar where x <= 1000")
+        cursor.get_results_from_sfqid(cursor.sfqid)
+        cursor.fetchall()
+
+    benchmark(run)
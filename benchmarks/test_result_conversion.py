@@ -0,0 +1,65 @@
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+
+from pytest import mark
+
+from yellowbox_snowglobe.result_chunks import ChunkDestination
+from yellowbox_snowglobe.session import QueryResult
+
+
+def column(name, type_code):
+    return (name, type_code, None, None, None, None, None)
+
+
+# for each type, a postgresql type code and a function that builds a value from the row index
+COLUMN_TYPES = {
+    "int": (20, lambda i: i),
+    "numeric": (1700, lambda i: Decimal(i) / 100),
+    "float": (701, lambda i: i / 3),
+    "text": (25, lambda i: f"value {i}"),
+    "bool": (16, lambda i: i % 2 == 0),
+    "date": (1082, lambda i: date(2020, 1, 1) + timedelta(days=i % 1000)),
+    "time": (1083, lambda i: time(i % 24, i % 60, i % 60, i)),
+    "timestamp": (1114, lambda i: datetime(2020, 1, 1) + timedelta(seconds=i, microseconds=i)),
+    "timestamptz": (1184, lambda i: datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=i)),
+    "bytea": (17, lambda i: memoryview(i.to_bytes(4, "big"))),
+    "json": (3802, lambda i: {"i": i, "tags": ["a", "b"]}),
+    "array": (1007, lambda i: [i, i + 1]),
+}
+
+
+def make_result(column_type: str, n_rows: int) -> QueryResult:
+    type_code, value = COLUMN_TYPES[column_type]
+    return QueryResult(
+        (column("k", 20), column("v", type_code)),
+        [(i, value(i) if i % 10 else None) for i in range(n_rows)],
+    )
+
+
+@mark.benchmark(group="conversion")
+@mark.parametrize("result_format", ["json", "arrow"])
+@mark.parametrize("column_type", list(COLUMN_TYPES))
+def test_convert_types(benchmark, api, column_type, result_format):
+    result = make_result(column_type, 10_000)
+    benchmark(api.sql_alchemy_result_to_snowglobe_result, result, (), result_format)
+
+
+@mark.benchmark(group="conversion-size")
+@mark.parametrize("result_format", ["json", "arrow"])
+@mark.parametrize("n_rows", [10, 1000, 100_000])
+def test_convert_sizes(benchmark, api, n_rows, result_format):
+    result = make_result("text", n_rows)
+    benchmark(api.sql_alchemy_result_to_snowglobe_result, result, (), result_format)
+
+
+@mark.benchmark(group="conversion-chunked")
+@mark.parametrize("result_format", ["json", "arrow"])
+def test_convert_chunked(benchmark, api, result_format):
+    result = make_result("text", 100_000)
+    destination = ChunkDestination("owner", "query", "/")
+
+    def convert():
+        api.sql_alchemy_result_to_snowglobe_result(result, (), result_format, destination)
+        api.result_chunks.discard_owner(destination.owner)
+
+    benchmark(convert)
@@ -0,0 +1,110 @@
+from typing import Sequence
+
+from pytest import fixture, mark
+
+from yellowbox_snowglobe.snow_to_post import (
+    RULES,
+    Rule,
+    repl_part,
+    replace_array_construct,
+    snow_to_post,
+    split_sql_to_statements,
+    tokenize,
+)
+
+
+def legacy_repl_part(part: str, rules: Sequence[Rule]) -> str:
+    # the rule engine as it was before rules were compiled into a single pattern, searches every rule on every iteration
+    part = replace_array_construct(part)
+    ret_parts = []
+    while part:
+        best_match = None
+        best_match_key = (float("inf"), 0)
+        for rule in rules:
+            match = rule.pattern.search(part)
+            if match:
+                match_key = (match.start(), -len(match.group()))
+                if match_key < best_match_key:
+                    best_match = (rule, match)
+                    best_match_key = match_key
+        if best_match:
+            rule, match = best_match
+            ret_parts.append(part[: match.start()])
+            part = match.expand(rule.replacement) + part[match.end() :]
+        else:
+            ret_parts.append(part)
+            break
+    return "".join(ret_parts)
+
+
+def large_query(n_columns: int) -> str:
+    columns = ",\n    ".join(
+        f"t.data:field_{i}::string as s_{i}, cast(t.x_{i} as int) as x_{i}, t.data:num_{i}::int as n_{i}"
+        for i in range(n_columns)
+    )
+    return (
+        f"select current_timestamp() as now,\n    {columns}\n"
+        "from db..events t join db..users u on t.user_id = u.id, lateral flatten(t.tags) as tag\n"
+        "where t.kind in (select kind from db..kinds) sample (100 rows)"
+    )
+
+
+def nested_query(depth: int) -> str:
+    # deeply nested parentheses and subqueries
+    query = "select 1 as x"
+    for i in range(depth):
+        query = f"select iff(x > {i}, (x + {i}) * 2, nvl(x, 0)) as x from ({query}) as t_{i}"
+    return query
+
+
+def literal_heavy_query(n_literals: int) -> str:
+    # many strings, quoted identifiers and comments, which all the rules must skip over
+    values = ",\n".join(
+        f"('it''s {i} -- not a comment', \"Col {i}\", $$body {i} /* nor this */$$) -- row {i}"
+        for i in range(n_literals)
+    )
+    return f"/* header */ insert into bar values\n{values}"
+
+
+def many_statements(n_statements: int) -> str:
+    return ";\n".join(f"insert into bar values ({i}, 'a;b') -- ;" for i in range(n_statements))
+
+
+QUERIES = {
+    "1kb": lambda: large_query(10),
+    "10kb": lambda: large_query(100),
+    "nested": lambda: nested_query(30),
+    "literals": lambda: literal_heavy_query(200),
+    "statements": lambda: many_statements(500),
+}
+
+
+@fixture(params=list(QUERIES))
+def query(request):
+    return QUERIES[request.param]()
+
+
+@mark.benchmark(group="rule-engine")
+def test_rule_engine(benchmark, query):
+    benchmark(repl_part, query, RULES)
+
+
+@mark.benchmark(group="rule-engine")
+def test_legacy_rule_engine(benchmark, query):
+    assert legacy_repl_part(query, RULES) == repl_part(query, RULES)
+    benchmark(legacy_repl_part, query, RULES)
+
+
+@mark.benchmark(group="snow_to_post")
+def test_snow_to_post(benchmark, query):
+    benchmark(snow_to_post, query)
+
+
+@mark.benchmark(group="lexer")
+def test_tokenize(benchmark, query):
+    benchmark(lambda: list(tokenize(query)))
+
+
+@mark.benchmark(group="lexer")
+def test_split_statements(benchmark, query):
+    benchmark(lambda: list(split_sql_to_statements(query)))
@@ -0,0 +1,16 @@
+from typing import Iterator
+
+from pytest import fixture
+
+from yellowbox_snowglobe.api import SnowGlobeAPI
+from yellowbox_snowglobe.case_mode import IgnoreAll
+
+
+@fixture
+def api() -> Iterator[SnowGlobeAPI]:
+    # an api without a postgresql service, for tests that don't run any sql
+    api = SnowGlobeAPI(sql_service=None, metadata_table_name="__snowglobe_md", case_mode=IgnoreAll())
+    yield api
+    api.sql_executor.shutdown()
+    api.result_chunks.close()
+    api.stage.close()
@@ -0,0 +1,6 @@
+#!/bin/sh
+set -e
+# run the benchmarks, results are saved under .benchmarks so they can be compared between versions, for example, to
+# fail on a regression from the last saved run: sh scripts/benchmark.sh --benchmark-compare --benchmark-compare-fail=mean:10%
+# the end-to-end benchmarks require docker, they can be skipped with: --ignore benchmarks/test_end_to_end.py
+python -m pytest benchmarks --benchmark-autosave "$@"
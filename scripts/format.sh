@@ -2,6 +2,6 @@
 # run various linters
 set -e
 echo "formatting..."
-python -m ruff format yellowbox_snowglobe tests
+python -m ruff format yellowbox_snowglobe tests benchmarks
 echo "sorting imports with ruff..."
-python -m ruff check yellowbox_snowglobe tests --select I,F401 --fix --show-fixes
\ No newline at end of file
+python -m ruff check yellowbox_snowglobe tests benchmarks --select I,F401 --fix --show-fixes
\ No newline at end of file
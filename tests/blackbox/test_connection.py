@@ -21,3 +21,87 @@ def test_rollback(snowglobe, db):
     with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
         conn.cursor().execute("insert into recs values ('7'), ('8');")
         assert conn.cursor().execute("select * from recs").fetchall() == [("3",), ("4",), ("7",), ("8",)]
+
+
+def test_sessions_share_engine(snowglobe, db):
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        conn.cursor().execute("create table recs(t text);")
+
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn1:
+        with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn2:
+            conn1.cursor().execute("insert into recs values ('1');")
+            conn1.commit()
+            assert conn2.cursor().execute("select * from recs").fetchall() == [("1",)]
+
+            session1 = snowglobe.api.sessions[conn1.rest.token]
+            session2 = snowglobe.api.sessions[conn2.rest.token]
+            assert session1.engine is session2.engine is snowglobe.api.engines.engine(db)
+
+
+def test_pooled_connection_state_is_reset(snowglobe, db):
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        conn.cursor().execute("create schema other")
+        conn.cursor().execute("use schema other")
+        conn.cursor().execute("set application_name = 'leaked'")
+        conn.commit()
+
+    # the connection was returned to the pool, the next session checks it out
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        assert conn.cursor().execute("select current_schema()").fetchall() == [("public",)]
+        assert conn.cursor().execute("select current_setting('application_name')").fetchall() != [("leaked",)]
+
+
+def test_use_database_reuses_engine(snowglobe, db):
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        session = snowglobe.api.sessions[conn.rest.token]
+        conn.cursor().execute("select 1")
+        engine = session.engine
+        conn.cursor().execute(f"use database {db}_other")
+        conn.cursor().execute("select 1")
+        assert session.engine is snowglobe.api.engines.engine(f"{db}_other")
+        conn.cursor().execute(f"use database {db}")
+        conn.cursor().execute("select 1")
+        assert session.engine is engine
+
+
+def test_database_from_template(snowglobe, db):
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        assert conn.cursor().execute("select year(cast('2020-05-01' as date))").fetchall() == [(2020,)]
+        assert db in snowglobe.api.engines.templated_databases
+        assert (db, "public") in snowglobe.api.initialized_schemas
+
+
+def test_initialized_schema_rolled_back(snowglobe, db):
+    with raises(RuntimeError), connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        conn.cursor().execute("create schema s")
+        conn.cursor().execute("use schema s")
+        raise RuntimeError("rollback")
+    assert (db, "s") not in snowglobe.api.initialized_schemas
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        conn.cursor().execute("create schema s")
+        conn.cursor().execute("use schema s")
+        conn.cursor().execute("create table recs(t string)")
+    assert (db, "s") in snowglobe.api.initialized_schemas
+
+
+def test_lazy_connection(snowglobe, db):
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        session = snowglobe.api.sessions[conn.rest.token]
+        assert not session.connected
+        conn.cursor().execute("select 1")
+        assert session.connected
+
+
+def test_idle_sessions_reaped(snowglobe, db, monkeypatch):
+    monkeypatch.setattr(snowglobe.api, "session_idle_timeout", None)
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        conn.cursor().execute("select 1")
+        monkeypatch.setattr(snowglobe.api, "max_sessions", len(snowglobe.api.sessions))
+        with raises(connector.DatabaseError):
+            connector.connect(**snowglobe.local_connection_kwargs(), database=db)
+
+        # the idle session is closed to make room for the new one
+        monkeypatch.setattr(snowglobe.api, "session_idle_timeout", 0)
+        with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as other:
+            assert conn.rest.token not in snowglobe.api.sessions
+            assert other.cursor().execute("select 1").fetchall() == [(1,)]
@@ -1,5 +1,18 @@
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from threading import Thread
+from time import monotonic
+
+import requests
+from psycopg2 import extensions
+from pytest import mark, raises
 from snowflake import connector
-from snowflake.connector import DictCursor
+from snowflake.connector import DatabaseError, DictCursor
+from snowflake.connector.constants import QueryStatus
+from sqlalchemy import event
+
+from yellowbox_snowglobe.case_mode import AutoCase
+from yellowbox_snowglobe.result_cache import ResultCache
 
 
 def test_select_as(connection):
@@ -45,6 +58,52 @@ def test_async(connection):
         assert not cursor.fetchall()
 
 
+def test_async_retrieve_twice(connection):
+    with connection.cursor() as cursor:
+        cursor.execute_async("select 1 as x union all select 2")
+        query_id = cursor.sfqid
+        cursor.get_results_from_sfqid(query_id)
+        assert cursor.fetchall() == [(1,), (2,)]
+        cursor.get_results_from_sfqid(query_id)
+        assert cursor.fetchall() == [(1,), (2,)]
+
+
+def test_async_failure(connection):
+    with connection.cursor() as cursor:
+        cursor.execute_async("select x from no_such_table")
+        query_id = cursor.sfqid
+        with raises(DatabaseError):
+            cursor.get_results_from_sfqid(query_id)
+        assert connection.get_query_status(query_id) == QueryStatus.FAILED_WITH_ERROR
+
+
+def test_async_queries_overlap(snowglobe, db):
+    sleep_seconds = 1
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn1:
+        with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn2:
+            cursors = [conn1.cursor(), conn2.cursor()]
+            start = monotonic()
+            for cursor in cursors:
+                cursor.execute_async(f"select pg_sleep({sleep_seconds})")
+            assert conn1.get_query_status(cursors[0].sfqid) == QueryStatus.RUNNING
+            for cursor in cursors:
+                cursor.get_results_from_sfqid(cursor.sfqid)
+                cursor.fetchall()
+            assert monotonic() - start < sleep_seconds * len(cursors)
+
+
+def test_slow_query_does_not_block_other_sessions(snowglobe, db):
+    sleep_seconds = 2
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn1:
+        with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn2:
+            slow_query = Thread(target=conn1.cursor().execute, args=(f"select pg_sleep({sleep_seconds})",))
+            slow_query.start()
+            start = monotonic()
+            assert conn2.cursor().execute("select 1").fetchall() == [(1,)]
+            assert monotonic() - start < sleep_seconds
+            slow_query.join()
+
+
 def test_args(connection):
     with connection.cursor() as cursor:
         cursor.execute("create table bar (x int, y text)")
@@ -53,6 +112,43 @@ def test_args(connection):
         assert cursor.fetchall() == [(10, "ten")]
 
 
+@mark.parametrize(("paramstyle", "placeholders"), [("qmark", ("?", "?")), ("numeric", (":1", ":2"))])
+def test_server_side_bindings(snowglobe, db, paramstyle, placeholders):
+    rows = [(i, str(i)) for i in range(1000)]
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db, paramstyle=paramstyle) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("create table bar (x int, y text)")
+            cursor.executemany(f"insert into bar values ({placeholders[0]}, {placeholders[1]})", rows)
+            cursor.execute(f"select x, y from bar where x = {placeholders[0]}", (10,))
+            assert cursor.fetchall() == [(10, "10")]
+            cursor.execute("select count(*) from bar")
+            assert cursor.fetchall() == [(len(rows),)]
+
+
+def test_array_bindings_are_batched(snowglobe, db):
+    inserts = []
+
+    class CountingCursor(extensions.cursor):
+        def execute(self, query, params=None) -> None:
+            if "insert into bar" in (query.decode() if isinstance(query, bytes) else query):
+                inserts.append(query)
+            super().execute(query, params)
+
+    # the database's engine is created before the session connects to it, so all its connections use the cursor
+    engine = snowglobe.api.engines.engine(db)
+    event.listen(
+        engine, "connect", lambda dbapi_connection, _: setattr(dbapi_connection, "cursor_factory", CountingCursor)
+    )
+    rows = [(i, str(i)) for i in range(1000)]
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db, paramstyle="qmark") as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("create table bar (x int, y text)")
+            cursor.executemany("insert into bar values (?, ?)", rows)
+            cursor.execute("select count(*) from bar")
+            assert cursor.fetchall() == [(len(rows),)]
+    assert 0 < len(inserts) <= len(rows) // 100
+
+
 def test_create_and_switch_db(db, snowglobe):
     new_db_name = db + "_new"
     with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as connection:
@@ -77,3 +173,220 @@ def test_switch_to_same_db(db, snowglobe, connection):
         assert cursor.fetchall() == [(10, "ten")]
 
     assert snowglobe.sql_service.database_exists(db)
+
+
+def test_arrow_result_format(snowglobe, db):
+    with connector.connect(
+        **snowglobe.local_connection_kwargs(),
+        database=db,
+        session_parameters={"PYTHON_CONNECTOR_QUERY_RESULT_FORMAT": "arrow"},
+    ) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("create table bar (x int, y text, z boolean)")
+            cursor.execute("insert into bar values (1, 'one', true), (2, 'two', false), (3, null, null)")
+            cursor.execute("select x, y, z from bar order by x")
+            assert cursor.fetchall() == [(1, "one", True), (2, "two", False), (3, None, None)]
+            table = cursor.execute("select x, y from bar order by x").fetch_arrow_all()
+            assert table.to_pylist() == [{"x": 1, "y": "one"}, {"x": 2, "y": "two"}, {"x": 3, "y": None}]
+
+
+def test_alter_session_result_format(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("create table bar (x int)")
+        cursor.execute("insert into bar values (1), (2)")
+        cursor.execute("alter session set python_connector_query_result_format = 'arrow'")
+        assert cursor.execute("select x from bar order by x").fetch_arrow_all().to_pylist() == [{"x": 1}, {"x": 2}]
+        cursor.execute("alter session unset python_connector_query_result_format")
+        assert cursor.execute("select x from bar order by x").fetchall() == [(1,), (2,)]
+
+
+@mark.parametrize("result_format", ["json", "arrow"])
+@mark.parametrize("stream_results", [True, False])
+def test_chunked_result(snowglobe, db, monkeypatch, result_format, stream_results):
+    monkeypatch.setattr(snowglobe.api, "result_chunk_rows", 7)
+    monkeypatch.setattr(snowglobe.api, "stream_results", stream_results)
+    with connector.connect(
+        **snowglobe.local_connection_kwargs(),
+        database=db,
+        session_parameters={"PYTHON_CONNECTOR_QUERY_RESULT_FORMAT": result_format},
+    ) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("create table bar (x int, y text)")
+            cursor.execute("insert into bar select i, i::text from generate_series(1, 50) as i")
+            cursor.execute("select x, y from bar order by x")
+            assert cursor.fetchall() == [(i, str(i)) for i in range(1, 51)]
+    assert not len(snowglobe.api.result_chunks)
+
+
+@mark.parametrize("result_format", ["json", "arrow"])
+def test_result_types(snowglobe, db, result_format):
+    with connector.connect(
+        **snowglobe.local_connection_kwargs(),
+        database=db,
+        session_parameters={"PYTHON_CONNECTOR_QUERY_RESULT_FORMAT": result_format},
+    ) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "select cast('2020-01-02' as date), cast('01:02:03.000004' as time),"
+                " cast('1969-12-31 23:59:58.5' as timestamp), cast('2020-01-01 02:00:00.25+02' as timestamptz),"
+                " cast('\\x00ff' as bytea), cast('{\"a\": [1, 2]}' as jsonb), cast('{1,2}' as int[])"
+            )
+            assert [column.type_code for column in cursor.description] == [3, 12, 8, 7, 11, 5, 10]
+            assert cursor.fetchall() == [
+                (
+                    date(2020, 1, 2),
+                    time(1, 2, 3, 4),
+                    datetime(1969, 12, 31, 23, 59, 58, 500000),
+                    datetime(2020, 1, 1, 0, 0, 0, 250000, tzinfo=timezone.utc),
+                    b"\x00\xff",
+                    '{"a": [1, 2]}',
+                    "[1, 2]",
+                )
+            ]
+
+
+@mark.parametrize("result_format", ["json", "arrow"])
+def test_unconstrained_numeric(snowglobe, db, result_format):
+    with connector.connect(
+        **snowglobe.local_connection_kwargs(),
+        database=db,
+        session_parameters={"PYTHON_CONNECTOR_QUERY_RESULT_FORMAT": result_format},
+    ) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("select 1.5::numeric")
+            assert cursor.description[0].scale == 1
+            assert Decimal(cursor.fetchone()[0]) == Decimal("1.5")
+
+
+def test_compressed_response(snowglobe, connection, monkeypatch):
+    monkeypatch.setattr(snowglobe.api, "gzip_threshold", 0)
+    with connection.cursor() as cursor:
+        assert cursor.execute("select 'x' as y").fetchall() == [("x",)]
+
+
+def test_streamed_results_between_statements(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("create table bar (x int)")
+        cursor.execute("insert into bar select i from generate_series(1, 100) as i")
+        # the first select's stream must be closed before the second one runs
+        cursor.execute("select x from bar; select count(*) from bar where x > 50")
+        assert cursor.fetchall() == [(50,)]
+        cursor.execute("select x from bar order by x limit 3; commit")
+        assert cursor.execute("select count(*) from bar").fetchall() == [(100,)]
+
+
+def test_empty_result_description(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("create table bar (x int, y text, z boolean)")
+        cursor.execute("select x, y, z from bar")
+        assert cursor.fetchall() == []
+        assert [(d.name, d.type_code) for d in cursor.description] == [("x", 0), ("y", 2), ("z", 13)]
+
+
+def test_auto_case_shared_catalog(snowglobe, db, monkeypatch):
+    monkeypatch.setattr(snowglobe.api, "case_mode", AutoCase())
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        conn.cursor().execute("create table bar (x int)")
+        conn.cursor().execute("insert into bar values (1)")
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as conn:
+        res = conn.cursor(DictCursor).execute("select x, x as y from bar").fetchall()
+        assert res == [{"X": 1, "y": 1}]
+        conn.cursor().execute("drop table bar")
+        res = conn.cursor(DictCursor).execute("select 1 as x").fetchall()
+        assert res == [{"x": 1}]
+
+
+def test_metrics(snowglobe, connection):
+    connection.cursor().execute("select 1").fetchall()
+    response = requests.get(f"{snowglobe.api.local_url()}/metrics", timeout=10)
+    assert response.ok
+    assert 'snowglobe_statement_duration_seconds_count{handler="select"}' in response.text
+    assert 'snowglobe_pool_connections{database="' in response.text
+
+
+def test_query_history(snowglobe, connection, monkeypatch):
+    monkeypatch.setattr(snowglobe.api, "slow_query_threshold", 0)
+    with connection.cursor() as cursor:
+        cursor.execute("create table bar (x int)")
+        cursor.execute("insert into bar values (1), (2)")
+        cursor.execute("select x from bar")
+        query_id = cursor.sfqid
+    response = requests.get(f"{snowglobe.api.local_url()}/monitoring/queries/{query_id}", timeout=10).json()
+    (query,) = response["data"]["queries"]
+    assert query["handlers"] == ["select"]
+    assert query["rowCount"] == 2  # noqa: PLR2004
+    assert query["responseBytes"] > 0
+    assert "Seq Scan" in query["explain"]
+    slow = requests.get(f"{snowglobe.api.local_url()}/monitoring/queries?slow=true&limit=1", timeout=10).json()
+    assert [q["id"] for q in slow["data"]["queries"]] == [query_id]
+    # slow statements are only planned again, not executed
+    assert connection.cursor().execute("select count(*) from bar").fetchall() == [(2,)]
+
+
+def test_batched_statements(snowglobe, db, monkeypatch):
+    monkeypatch.setattr(snowglobe.api, "case_mode", AutoCase())
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "create table bar (x int); insert into bar values (1), (2); create table baz (y int);"
+                " insert into baz select x from bar; select y from baz order by y"
+            )
+            assert cursor.fetchall() == [(1,), (2,)]
+            # the known columns are updated after the batch
+            assert connection.cursor(DictCursor).execute("select y from baz order by y").fetchall() == [
+                {"Y": 1},
+                {"Y": 2},
+            ]
+
+
+def test_multi_statement_count(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "create table bar (x int); insert into bar values (1), (2); select x from bar order by x", num_statements=3
+        )
+        # the connector is already on the first statement's result
+        assert cursor.nextset()
+        assert cursor.nextset()
+        assert cursor.fetchall() == [(1,), (2,)]
+        assert cursor.nextset() is None
+        cursor.execute("select 1; select 2", num_statements=0)
+        assert cursor.fetchall() == [(1,)]
+        assert cursor.nextset()
+        assert cursor.fetchall() == [(2,)]
+        with raises(DatabaseError, match="did not match the desired statement count"):
+            cursor.execute("select 1; select 2", num_statements=1)
+
+
+def test_async_multi_statement(connection):
+    with connection.cursor() as cursor:
+        cursor.execute_async("select 1; select 2", num_statements=2)
+        cursor.get_results_from_sfqid(cursor.sfqid)
+        assert cursor.fetchall() == [(1,)]
+        assert cursor.nextset()
+        assert cursor.fetchall() == [(2,)]
+
+
+def test_result_cache(snowglobe, db, monkeypatch):
+    monkeypatch.setattr(snowglobe.api, "result_cache", ResultCache())
+    hits = snowglobe.api.metrics.result_cache_lookups
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as connection:
+        cursor = connection.cursor()
+        cursor.execute("create table bar (x int)")
+        cursor.execute("create view baz as select x * 2 as y from bar")
+        cursor.execute("insert into bar values (1)")
+        connection.commit()
+        assert cursor.execute("select x from bar").fetchall() == [(1,)]
+        assert cursor.execute("select y from baz").fetchall() == [(2,)]
+        before = hits.value("hit")
+        assert cursor.execute("select x from bar").fetchall() == [(1,)]
+        assert hits.value("hit") == before + 1
+
+        with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as other:
+            other.cursor().execute("insert into bar values (2)")
+            # uncommitted changes are only visible to their own session
+            assert other.cursor().execute("select x from bar order by x").fetchall() == [(1,), (2,)]
+            assert cursor.execute("select x from bar").fetchall() == [(1,)]
+            other.commit()
+        # the results of queries on the changed table (and on views of it) are discarded once it is committed
+        assert cursor.execute("select x from bar").fetchall() == [(1,), (2,)]
+        assert cursor.execute("select y from baz").fetchall() == [(2,), (4,)]
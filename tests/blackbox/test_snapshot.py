@@ -0,0 +1,31 @@
+from pytest import raises
+from snowflake import connector
+
+
+def test_snapshot_restore(snowglobe, db):
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as connection:
+        connection.cursor().execute("create table bar (x int)")
+        connection.cursor().execute("insert into bar values (1), (2)")
+    snowglobe.snapshot(db)
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as connection:
+        connection.cursor().execute("insert into bar values (3)")
+        connection.cursor().execute("create table baz (y int)")
+    snowglobe.restore(db)
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as connection:
+        assert connection.cursor().execute("select x from bar order by x").fetchall() == [(1,), (2,)]
+        with raises(connector.ProgrammingError):
+            connection.cursor().execute("select y from baz")
+    # a snapshot can be restored any number of times
+    snowglobe.restore(db)
+    snowglobe.drop_snapshot(db)
+
+
+def test_snapshot_while_connected(snowglobe, db):
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db) as connection:
+        connection.cursor().execute("select 1")
+        with raises(RuntimeError):
+            snowglobe.snapshot(db)
+    with connector.connect(**snowglobe.local_connection_kwargs(), database=db):
+        # sessions only connect to their database when they run a statement
+        snowglobe.snapshot(db)
+    snowglobe.drop_snapshot(db)
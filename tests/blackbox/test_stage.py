@@ -0,0 +1,101 @@
+import gzip
+
+from pytest import importorskip, raises
+from snowflake.connector import DatabaseError
+
+
+def test_put_and_copy_csv(connection, tmp_path):
+    data_file = tmp_path / "data.csv"
+    data_file.write_text("a,b\n1,one\n2,\n")
+    cursor = connection.cursor()
+    cursor.execute("create table recs(a int, b text)")
+    cursor.execute("create stage s")
+    put_result = cursor.execute(f"put 'file://{data_file}' @s/in auto_compress=false").fetchall()
+    assert [row[0] for row in put_result] == ["data.csv"]
+    assert [row[0] for row in cursor.execute("list @s").fetchall()] == ["in/data.csv"]
+
+    copy_result = cursor.execute("copy into recs from @s/in file_format=(type=csv skip_header=1) purge=true").fetchall()
+    assert [row[:4] for row in copy_result] == [("in/data.csv", "LOADED", 2, 2)]
+    assert cursor.execute("select * from recs order by a").fetchall() == [(1, "one"), (2, None)]
+    assert cursor.execute("list @s").fetchall() == []
+
+
+def test_copy_compressed_csv(connection, tmp_path):
+    for i in range(3):
+        (tmp_path / f"data_{i}.csv.gz").write_bytes(gzip.compress(f"x{i}|{i}\n".encode()))
+    cursor = connection.cursor()
+    cursor.execute("create table recs(a int, b text)")
+    cursor.execute(f"put 'file://{tmp_path}/*.csv.gz' @%recs")
+    cursor.execute(
+        "copy into recs (b, a) from @%recs files=('data_0.csv.gz', 'data_2.csv.gz')"
+        " file_format=(type=csv field_delimiter='|')"
+    )
+    assert cursor.execute("select * from recs order by a").fetchall() == [(0, "x0"), (2, "x2")]
+
+
+def test_copy_no_files(connection):
+    cursor = connection.cursor()
+    cursor.execute("create table recs(a int)")
+    cursor.execute("create temporary stage s")
+    assert cursor.execute("copy into recs from @s").fetchall() == [("Copy executed with 0 files processed.",)]
+
+
+def test_copy_parquet(connection, tmp_path):
+    pa = importorskip("pyarrow")
+    pq = importorskip("pyarrow.parquet")
+    pq.write_table(pa.table({"B": ["x", "y"], "A": [1, 2]}), tmp_path / "data.parquet")
+    cursor = connection.cursor()
+    cursor.execute("create table recs(a int, b text)")
+    cursor.execute(f"put file://{tmp_path}/data.parquet @~")
+    cursor.execute(
+        "copy into recs from @~ pattern='.*[.]parquet'"
+        " file_format=(type=parquet) match_by_column_name=case_insensitive purge=true"
+    )
+    assert cursor.execute("select * from recs order by a").fetchall() == [(1, "x"), (2, "y")]
+
+
+def test_unload_and_get(connection, tmp_path):
+    row_count = 500
+    cursor = connection.cursor()
+    cursor.execute("create table recs(a int, b text)")
+    cursor.execute("insert into recs select i, 'row ' || i from generate_series(1, 1000) as i")
+    cursor.execute("create stage s")
+    unload_result = cursor.execute(
+        f"copy into @s/out/ from (select * from recs where a <= {row_count} order by a) header=true max_file_size=1000"
+    ).fetchall()
+    assert unload_result[0][0] == row_count
+    files = [row[0] for row in cursor.execute("list @s/out").fetchall()]
+    assert len(files) > 1
+    assert all(name.startswith("out/data_0_0_") and name.endswith(".csv.gz") for name in files)
+
+    get_result = cursor.execute(f"get @s/out file://{tmp_path}").fetchall()
+    assert sorted(row[0] for row in get_result) == sorted(name.split("/")[-1] for name in files)
+    lines = []
+    for name in files:
+        with gzip.open(tmp_path / name.split("/")[-1], "rt") as f:
+            header, *rows = f.read().splitlines()
+        assert header == "a,b"
+        lines.extend(rows)
+    assert sorted(lines, key=lambda line: int(line.split(",")[0])) == [f"{i},row {i}" for i in range(1, row_count + 1)]
+
+
+def test_unload_single_table(connection, tmp_path):
+    cursor = connection.cursor()
+    cursor.execute("create table recs(a int, b text)")
+    cursor.execute("insert into recs values (1, 'one'), (2, null)")
+    cursor.execute("copy into @~/recs.csv from recs file_format=(type=csv compression=none) single=true overwrite=true")
+    cursor.execute(f"get @~/recs.csv file://{tmp_path}")
+    assert (tmp_path / "recs.csv").read_text().splitlines() == ["1,one", "2,"]
+    cursor.execute("remove @~/recs.csv")
+
+
+def test_unload_existing_files(connection):
+    cursor = connection.cursor()
+    cursor.execute("create table recs(a int)")
+    cursor.execute("insert into recs values (1)")
+    cursor.execute("create stage s")
+    cursor.execute("copy into @s from recs")
+    with raises(DatabaseError, match="already existing"):
+        cursor.execute("copy into @s from recs")
+    cursor.execute("copy into @s from recs overwrite=true")
+    assert len(cursor.execute("list @s").fetchall()) == 1
@@ -98,6 +98,14 @@ def test_numeric_results_are_serializable(connection):
     assert res == [("1.5",), ("2.5",)]
 
 
+def test_select_into(connection):
+    connection.cursor().execute("create table bar (x int)")
+    connection.cursor().execute("insert into bar values (1), (2)")
+    connection.cursor().execute("select x into baz from bar where x > 1")
+    res = connection.cursor().execute("select x from baz").fetchall()
+    assert res == [(2,)]
+
+
 def test_multiple_commits(connection):
     connection.cursor().execute("create table bar (x int)")
     connection.cursor().execute("commit")
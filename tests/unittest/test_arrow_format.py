@@ -0,0 +1,69 @@
+from base64 import b64decode
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+
+from pytest import importorskip
+
+from yellowbox_snowglobe.arrow_format import rows_to_arrow_base64
+
+pa = importorskip("pyarrow")
+
+
+def read_stream(encoded: str) -> pa.Table:
+    return pa.ipc.open_stream(b64decode(encoded)).read_all()
+
+
+def test_rows_to_arrow():
+    rows = [
+        [1, Decimal("1.25"), 1.5, "one", True, datetime(2020, 1, 2, 3, 4, 5, 6), {"a": 1}],
+        [None, None, None, None, None, None, None],
+    ]
+    table = read_stream(
+        rows_to_arrow_base64(
+            ["i", "d", "f", "t", "b", "ts", "o"],
+            ["NUMBER", "NUMBER", "FLOAT", "TEXT", "BOOLEAN", "TIMESTAMP_NTZ", "OBJECT"],
+            rows,
+        )
+    )
+    assert table.column_names == ["i", "d", "f", "t", "b", "ts", "o"]
+    assert table.to_pylist() == [
+        {"i": 1, "d": Decimal("1.25"), "f": 1.5, "t": "one", "b": True, "ts": 1577934245000006, "o": '{"a": 1}'},
+        {"i": None, "d": None, "f": None, "t": None, "b": None, "ts": None, "o": None},
+    ]
+    assert [f.metadata[b"logicalType"] for f in table.schema] == [
+        b"FIXED",
+        b"FIXED",
+        b"REAL",
+        b"TEXT",
+        b"BOOLEAN",
+        b"TIMESTAMP_NTZ",
+        b"OBJECT",
+    ]
+    assert table.schema.field("d").metadata[b"scale"] == b"2"
+    assert table.schema.field("ts").metadata[b"scale"] == b"6"
+
+
+def test_rows_to_arrow_empty():
+    table = read_stream(rows_to_arrow_base64(["x"], ["TEXT"], []))
+    assert table.num_rows == 0
+    assert table.column_names == ["x"]
+
+
+def test_rows_to_arrow_temporal():
+    plus_two = timezone(timedelta(hours=2))
+    rows = [
+        [date(2020, 1, 2), time(1, 2, 3, 4), datetime(1969, 12, 31, 23, 59, 58, 500000, plus_two), b"\x00\xff"],
+        [None, None, None, None],
+    ]
+    table = read_stream(rows_to_arrow_base64(["d", "t", "tz", "b"], ["DATE", "TIME", "TIMESTAMP_TZ", "BINARY"], rows))
+    assert table.to_pylist() == [
+        {
+            "d": date(2020, 1, 2),
+            "t": 3723000004,
+            # the epoch seconds of negative timestamps are rounded down, so that the fraction is positive
+            "tz": {"epoch": -7202, "fraction": 500000000, "timezone": 1560},
+            "b": b"\x00\xff",
+        },
+        {"d": None, "t": None, "tz": None, "b": None},
+    ]
+    assert [f.metadata[b"logicalType"] for f in table.schema] == [b"DATE", b"TIME", b"TIMESTAMP_TZ", b"BINARY"]
@@ -0,0 +1,60 @@
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+
+from pytest import mark
+
+from yellowbox_snowglobe.bindings import convert_bindings, qmark_to_numeric
+
+
+@mark.parametrize(
+    ("binding", "expected"),
+    [
+        ({"type": "FIXED", "value": "10"}, 10),
+        ({"type": "FIXED", "value": "1.50"}, Decimal("1.50")),
+        ({"type": "REAL", "value": "1.5"}, 1.5),
+        ({"type": "TEXT", "value": "a"}, "a"),
+        ({"type": "BOOLEAN", "value": "true"}, True),
+        ({"type": "BOOLEAN", "value": "false"}, False),
+        ({"type": "ANY", "value": None}, None),
+        ({"type": "DATE", "value": "1577923200000"}, date(2020, 1, 2)),
+        ({"type": "TIME", "value": "3723000000000"}, time(1, 2, 3)),
+        ({"type": "TIMESTAMP_NTZ", "value": "1577934245000006000"}, datetime(2020, 1, 2, 3, 4, 5, 6)),
+        (
+            {"type": "TIMESTAMP_LTZ", "value": "1577934245000006000"},
+            datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc),
+        ),
+        (
+            {"type": "TIMESTAMP_TZ", "value": "1577934245000006000 1560"},
+            datetime(2020, 1, 2, 5, 4, 5, 6, tzinfo=timezone(timedelta(hours=2))),
+        ),
+        ({"type": "BINARY", "value": "6162"}, b"ab"),
+    ],
+)
+def test_convert_binding(binding, expected):
+    assert convert_bindings({"1": binding}) == {"1": expected}
+
+
+def test_convert_no_bindings():
+    assert convert_bindings(None) is None
+    assert convert_bindings({}) is None
+
+
+def test_convert_array_bindings():
+    assert convert_bindings(
+        {
+            "1": {"type": "FIXED", "value": ["1", "2"]},
+            "2": {"type": "TEXT", "value": ["a", None]},
+        }
+    ) == [{"1": 1, "2": "a"}, {"1": 2, "2": None}]
+
+
+@mark.parametrize(
+    ("query", "expected"),
+    [
+        ("select 1", "select 1"),
+        ("insert into t values (?, ?)", "insert into t values (:1, :2)"),
+        ("select '?', \"?\" from t where x = ? -- ?", "select '?', \"?\" from t where x = :1 -- ?"),
+    ],
+)
+def test_qmark_to_numeric(query, expected):
+    assert qmark_to_numeric(query) == expected
@@ -0,0 +1,49 @@
+from pytest import mark
+
+from yellowbox_snowglobe.column_catalog import ColumnCatalog, ddl_table
+
+
+@mark.parametrize(
+    ("query", "expected"),
+    [
+        ("create table foo (x int)", ("create", ("public", "foo"))),
+        ("CREATE TABLE IF NOT EXISTS s.Foo (x int)", ("create", ("s", "foo"))),
+        ("create or replace view d.s.foo as select 1", ("create", ("s", "foo"))),
+        ("create temporary table foo (x int)", ("create", ("public", "foo"))),
+        ("alter table foo add column y int", ("alter", ("public", "foo"))),
+        ("drop table if exists foo", ("drop", ("public", "foo"))),
+        ("alter table foo rename to bar", None),
+        ("drop table foo cascade", None),
+        ('create table "Foo" (x int)', ("create", ("public", "Foo"))),
+        ('alter table S."a.""b" add column y int', ("alter", ("s", 'a."b'))),
+        ("create materialized view foo as select 1", ("create", ("public", "foo"))),
+        ('create table "Foo"x (x int)', None),
+        ("create schema foo", None),
+    ],
+)
+def test_ddl_table(query, expected):
+    assert ddl_table(query, "public") == expected
+
+
+@mark.parametrize(
+    "query",
+    [
+        "create schema foo",
+        "create unique index i on foo (x)",
+        "create sequence s",
+        "create or replace function f() returns int as $$select 1$$ language sql",
+    ],
+)
+def test_non_table_ddl_is_ignored(query):
+    catalog = ColumnCatalog()
+    # the statement doesn't affect any columns, so the catalog doesn't query the database
+    catalog.update_after_ddl(None, query, "public")
+    assert not catalog.loaded
+
+
+def test_empty_catalog():
+    catalog = ColumnCatalog()
+    assert not catalog.loaded
+    assert "x" not in catalog
+    catalog.drop_table(("public", "foo"))
+    assert "x" not in catalog
@@ -0,0 +1,33 @@
+import json
+
+from pytest import fixture, mark, skip
+
+from yellowbox_snowglobe import json_encoding
+from yellowbox_snowglobe.json_encoding import dumps, loads
+
+
+@fixture(params=[True, False], ids=["orjson", "json"])
+def with_orjson(request, monkeypatch):
+    # the encoding must give the same results with and without orjson (the "fast" extra)
+    if request.param:
+        if json_encoding.orjson is None:
+            skip("orjson is not installed")
+    else:
+        monkeypatch.setattr(json_encoding, "orjson", None)
+
+
+@mark.usefixtures("with_orjson")
+def test_round_trip():
+    value = {"a": [1, 2.5, "x", None, True], "b": {"c": "ü"}}
+    assert loads(dumps(value)) == value
+    assert json.loads(dumps(value)) == value
+
+
+@mark.usefixtures("with_orjson")
+def test_compact():
+    assert dumps({"a": [1, "x"]}) == b'{"a":[1,"x"]}'
+
+
+@mark.usefixtures("with_orjson")
+def test_big_integers():
+    assert loads(dumps([2**70])) == [2**70]
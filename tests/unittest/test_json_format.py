@@ -0,0 +1,75 @@
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+
+from pytest import fixture, mark
+
+from yellowbox_snowglobe import json_format
+from yellowbox_snowglobe.json_format import (
+    convert_binary,
+    convert_boolean,
+    convert_date,
+    convert_number,
+    convert_semi_structured,
+    convert_time,
+    convert_timestamp_ltz,
+    convert_timestamp_ntz,
+    convert_timestamp_tz,
+    rows_to_json_rowset,
+)
+
+
+@fixture(params=[True, False], ids=["pyarrow", "python"])
+def with_pyarrow(request, monkeypatch):
+    # the converters must give the same results with and without pyarrow
+    if not request.param:
+        monkeypatch.setattr(json_format, "pa", None)
+        monkeypatch.setattr(json_format, "pc", None)
+
+
+@mark.usefixtures("with_pyarrow")
+def test_convert_date():
+    assert convert_date([date(2020, 1, 2), date(1969, 12, 31), None]) == ["18263", "-1", None]
+
+
+@mark.usefixtures("with_pyarrow")
+def test_convert_time():
+    assert convert_time([time(1, 2, 3, 4), time(0), None]) == ["3723.000004", "0.000000", None]
+
+
+@mark.usefixtures("with_pyarrow")
+def test_convert_timestamp_ntz():
+    assert convert_timestamp_ntz(
+        [datetime(2020, 1, 1, 0, 0, 0, 123456), datetime(1969, 12, 31, 23, 59, 58, 500000), None]
+    ) == ["1577836800.123456", "-1.500000", None]
+
+
+@mark.usefixtures("with_pyarrow")
+def test_convert_timestamp_ltz():
+    plus_two = timezone(timedelta(hours=2))
+    assert convert_timestamp_ltz([datetime(2020, 1, 1, 2, tzinfo=plus_two), None]) == ["1577836800.000000", None]
+
+
+@mark.usefixtures("with_pyarrow")
+def test_convert_timestamp_tz():
+    plus_two = timezone(timedelta(hours=2))
+    minus_five = timezone(timedelta(hours=-5))
+    assert convert_timestamp_tz(
+        [
+            datetime(2020, 1, 1, 2, 0, 0, 5, tzinfo=plus_two),
+            datetime(1969, 12, 31, 18, 59, 59, 750000, minus_five),
+            None,
+        ]
+    ) == ["1577836800.000005 1560", "-0.250000 1140", None]
+
+
+def test_convert_scalars():
+    assert convert_number([Decimal("1.50"), 2, None]) == ["1.50", "2", None]
+    assert convert_boolean([True, False, None]) == ["1", "0", None]
+    assert convert_binary([memoryview(b"\x00\x01\xff"), b"", None]) == ["0001FF", "", None]
+    assert convert_semi_structured([{"a": [1, Decimal("1.5")]}, [], None]) == ['{"a": [1, "1.5"]}', "[]", None]
+
+
+def test_rows_to_json_rowset():
+    assert rows_to_json_rowset([None, convert_boolean], [(1, True), (2, None)]) == [[1, "1"], [2, None]]
+    assert rows_to_json_rowset([None, None], [(1, True)]) == [[1, True]]
+    assert rows_to_json_rowset([convert_boolean], []) == []
@@ -0,0 +1,57 @@
+from yellowbox_snowglobe.metrics import Counter, Gauge, Histogram, MetricsRegistry, SnowGlobeMetrics
+
+
+def test_counter():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("requests", "the requests", ["endpoint"]))
+    counter.inc("query")
+    counter.inc("query", amount=2)
+    counter.inc('a "b"')
+    assert registry.render().splitlines() == [
+        "# HELP requests the requests",
+        "# TYPE requests counter",
+        'requests_total{endpoint="query"} 3',
+        'requests_total{endpoint="a \\"b\\""} 1',
+    ]
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.register(Histogram("duration_seconds", "durations", ["phase"], buckets=(0.1, 1)))
+    histogram.observe(0.05, "execute")
+    histogram.observe(0.1, "execute")
+    histogram.observe(2, "execute")
+    assert histogram.count("execute") == 3  # noqa: PLR2004
+    assert registry.render().splitlines()[2:] == [
+        'duration_seconds_bucket{phase="execute",le="0.1"} 2',
+        'duration_seconds_bucket{phase="execute",le="1"} 2',
+        'duration_seconds_bucket{phase="execute",le="+Inf"} 3',
+        'duration_seconds_sum{phase="execute"} 2.15',
+        'duration_seconds_count{phase="execute"} 3',
+    ]
+
+
+def test_histogram_time():
+    histogram = Histogram("duration_seconds", "durations")
+    with histogram.time():
+        pass
+    assert histogram.count() == 1
+
+
+def test_gauge():
+    registry = MetricsRegistry()
+    values = {("db", "idle"): 2}
+    registry.register(Gauge("connections", "the connections", lambda: values, ["database", "state"]))
+    values[("db", "checked_out")] = 1
+    assert registry.render().splitlines()[2:] == [
+        'connections{database="db",state="idle"} 2',
+        'connections{database="db",state="checked_out"} 1',
+    ]
+
+
+def test_snowglobe_metrics_request():
+    metrics = SnowGlobeMetrics()
+    with metrics.request("query"):
+        pass
+    assert metrics.requests.value("query") == 1
+    assert metrics.request_seconds.count("query") == 1
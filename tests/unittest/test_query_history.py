@@ -0,0 +1,51 @@
+from yellowbox_snowglobe.query_history import QueryHistory, QueryRecord
+
+
+def test_history_evicts_oldest():
+    history = QueryHistory(max_queries=2)
+    records = [QueryRecord(str(i)) for i in range(3)]
+    for record in records:
+        history.add(record)
+    assert history.recent() == [records[2], records[1]]
+    assert history.get("0") is None
+    assert history.get("2") is records[2]
+
+
+def test_slow_queries_outlive_history():
+    history = QueryHistory(max_queries=2)
+    slow = QueryRecord("slow")
+    history.add(slow)
+    history.add_slow(slow)
+    history.add(QueryRecord("a"))
+    history.add(QueryRecord("b"))
+    assert history.get("slow") is slow
+    assert history.recent(slow=True) == [slow]
+    assert [record.query_id for record in history.recent(1)] == ["b"]
+
+
+def test_record_json():
+    record = QueryRecord("q", "select 1", ["select 1"], start_time=1)
+    record.handlers.append("select")
+    record.phases["execute"] = 0.5
+    record.row_count = 1
+    record.finish()
+    record.end_time = 2
+    assert record.to_json() == {
+        "id": "q",
+        "status": "SUCCESS",
+        "sqlText": "select 1",
+        "statements": ["select 1"],
+        "handlers": ["select"],
+        "phases": {"execute": 500},
+        "startTime": 1000,
+        "endTime": 2000,
+        "totalDuration": 1000,
+        "rowCount": 1,
+    }
+
+
+def test_record_failure():
+    record = QueryRecord("q")
+    record.fail("oops")
+    assert record.to_json()["errorMessage"] == "oops"
+    assert record.status == "FAILED_WITH_ERROR"
@@ -0,0 +1,84 @@
+from yellowbox_snowglobe.result_cache import CachedResult, ResultCache, plan_tables, written_tables
+
+DESCRIPTION = (("x", 23, None, None, None, None, None),)
+
+
+def entry(*tables, rows=((1,),)):
+    return CachedResult(DESCRIPTION, rows, frozenset(tables))
+
+
+def test_key():
+    assert ResultCache.key("db", "public", "select x from t", {"1": 1}) == (
+        "db",
+        "public",
+        "select x from t",
+        (("1", 1),),
+    )
+    assert ResultCache.key("db", "public", "select x from t") == ("db", "public", "select x from t", ())
+    assert ResultCache.key("db", "public", "select random()") is None
+    assert ResultCache.key("db", "public", "select current_timestamp") is None
+    assert ResultCache.key("db", "public", "select nextval('s')") is None
+    assert ResultCache.key("db", "public", "select x from t for update") is None
+    assert ResultCache.key("db", "public", "select x from t", [{"1": 1}, {"1": 2}]) is None
+
+
+def test_written_tables():
+    assert written_tables("insert into t values (1)", "public") == {("public", "t")}
+    assert written_tables("UPDATE s.T set x = 1", "public") == {("s", "t")}
+    assert written_tables("delete from db.s.t", "public") == {("s", "t")}
+    assert written_tables("copy into t from @stage", "other") == {("other", "t")}
+    assert written_tables("set search_path to s", "public") == set()
+    assert written_tables('insert into "T" values (1)', "public") is None
+    assert written_tables("create or replace view v as select 1", "public") is None
+
+
+def test_plan_tables():
+    plan = [
+        {
+            "Plan": {
+                "Node Type": "Hash Join",
+                "Plans": [
+                    {"Node Type": "Seq Scan", "Relation Name": "a", "Schema": "public"},
+                    {"Node Type": "Hash", "Plans": [{"Node Type": "Seq Scan", "Relation Name": "B", "Schema": "s"}]},
+                ],
+            }
+        }
+    ]
+    assert plan_tables(plan) == {("public", "a"), ("s", "b")}
+    assert plan_tables([{"Plan": {"Node Type": "Result"}}]) == set()
+    assert plan_tables([{"Plan": {"Relation Name": "t", "Schema": "pg_temp_3"}}]) is None
+
+
+def test_invalidate_tables():
+    cache = ResultCache()
+    cache.put(("db", "public", "a", ()), entry(("public", "a")), cache.generation("db"))
+    cache.put(("db", "public", "b", ()), entry(("public", "b")), cache.generation("db"))
+    cache.put(("other", "public", "a", ()), entry(("public", "a")), cache.generation("other"))
+    cache.invalidate("db", [("public", "a")])
+    assert cache.get(("db", "public", "a", ())) is None
+    assert cache.get(("db", "public", "b", ())) is not None
+    assert cache.get(("other", "public", "a", ())) is not None
+    cache.invalidate("db")
+    assert cache.get(("db", "public", "b", ())) is None
+    assert len(cache) == 1
+
+
+def test_put_after_invalidation():
+    # a result read while its database was changed might be stale
+    cache = ResultCache()
+    generation = cache.generation("db")
+    cache.invalidate("db", [("public", "x")])
+    assert not cache.put(("db", "public", "a", ()), entry(("public", "a")), generation)
+    assert cache.get(("db", "public", "a", ())) is None
+
+
+def test_limits():
+    cache = ResultCache(max_entries=2, max_rows=1)
+    assert not cache.put(("db", "public", "big", ()), entry(rows=((1,), (2,))), 0)
+    for name in ("a", "b"):
+        cache.put(("db", "public", name, ()), entry(), 0)
+    cache.get(("db", "public", "a", ()))
+    cache.put(("db", "public", "c", ()), entry(), 0)
+    # the least recently used entry is evicted
+    assert cache.get(("db", "public", "b", ())) is None
+    assert cache.get(("db", "public", "a", ())) is not None
@@ -0,0 +1,32 @@
+import asyncio
+import gzip
+
+from yellowbox_snowglobe.result_chunks import ChunkDestination, ResultChunks
+
+
+def test_pop_chunks():
+    chunks = ResultChunks()
+    destination = ChunkDestination("session", "q", "http://api/")
+    try:
+        assert chunks.add(destination, 0, b"a") == "http://api/chunks/q/0"
+        chunks.add(destination, 1, b"b")
+        assert gzip.decompress(asyncio.run(chunks.pop("q/0"))) == b"a"
+        assert asyncio.run(chunks.pop("q/0")) is None
+        assert len(chunks) == 1
+        asyncio.run(chunks.pop("q/1"))
+        # the session's keys are forgotten once all its chunks are downloaded
+        assert not chunks._keys_by_owner  # noqa: SLF001
+    finally:
+        chunks.close()
+
+
+def test_discard_owner():
+    chunks = ResultChunks()
+    try:
+        chunks.add(ChunkDestination("session", "q", "/"), 0, b"a")
+        chunks.add(ChunkDestination("other", "r", "/"), 0, b"b")
+        chunks.discard_owner("session")
+        assert asyncio.run(chunks.pop("q/0")) is None
+        assert len(chunks) == 1
+    finally:
+        chunks.close()
@@ -0,0 +1,144 @@
+import gzip
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import create_engine, text
+
+from yellowbox_snowglobe.case_mode import Upper
+from yellowbox_snowglobe.result_chunks import ChunkDestination
+from yellowbox_snowglobe.session import QueryResult
+
+
+def column(name, type_code, precision=None, scale=None, display_size=None):
+    return (name, type_code, display_size, None, precision, scale, None)
+
+
+def test_rowtype_from_description(api):
+    result = QueryResult(
+        (
+            column("i", 23),
+            column("n", 1700, 10, 2),
+            column("t", 1043, display_size=20),
+            column("f", 701),
+            column("b", 16),
+            column("ts", 1114, scale=0),
+            column("tz", 1184),
+            column("d", 1082),
+            column("tm", 1083),
+            column("bin", 17),
+            column("j", 3802),
+            column("a", 1007),
+            column("u", 2950),
+        ),
+        [],
+    )
+    columns, _ = api.result_rowtype(result, ())
+    assert [(c["name"], c["type"], c["length"], c["precision"], c["scale"]) for c in columns] == [
+        ("i", "NUMBER", 0, 0, 0),
+        ("n", "NUMBER", 0, 10, 2),
+        ("t", "TEXT", 20, 0, 0),
+        ("f", "FLOAT", 0, 0, 0),
+        ("b", "BOOLEAN", 0, 0, 0),
+        ("ts", "TIMESTAMP_NTZ", 0, 0, 6),
+        ("tz", "TIMESTAMP_TZ", 0, 0, 6),
+        ("d", "DATE", 0, 0, 0),
+        ("tm", "TIME", 0, 0, 6),
+        ("bin", "BINARY", 0, 0, 0),
+        ("j", "VARIANT", 0, 0, 0),
+        ("a", "ARRAY", 0, 0, 0),
+        ("u", "OBJECT", 0, 0, 0),
+    ]
+    assert all(c["nullable"] for c in columns)
+
+
+def test_rowtype_unconstrained_numeric(api):
+    # a numeric column without a typmod reports the scale of its values
+    def scale(rows, stream=None) -> int:
+        columns, _ = api.result_rowtype(QueryResult((column("n", 1700),), rows, stream), ())
+        return columns[0]["scale"]
+
+    assert scale([(Decimal("1.5"),), (Decimal("2.25"),), (None,)]) == 2  # noqa: PLR2004
+    assert scale([(Decimal(1),), (None,)]) == 0
+    with create_engine("sqlite://").connect() as connection:
+        # the rows that were not fetched yet might have a fraction
+        assert scale([(Decimal(1),)], count_to(connection, 2)) == 1
+
+
+def test_rowtype_case_mode(api):
+    api.case_mode = Upper()
+    columns, _ = api.result_rowtype(QueryResult((column("x", 23),), []), ())
+    assert columns[0]["name"] == "X"
+
+
+def test_json_result(api):
+    result = QueryResult(
+        (column("n", 1700), column("b", 16), column("ts", 1114), column("t", 25)),
+        [(Decimal("1.5"), True, datetime(2020, 1, 1), "a"), (None, None, None, None)],
+    )
+    data = api.sql_alchemy_result_to_snowglobe_result(result, ())
+    assert data["rowset"] == [["1.5", "1", "1577836800.000000", "a"], [None, None, None, None]]
+    assert data["rowtype"][0]["scale"] == 1
+    assert data["total"] == len(result.rows)
+    assert "chunks" not in data
+
+
+def count_to(connection, n: int):
+    # a result streamed from a (sqlite) cursor, with the numbers from 1 to n
+    return connection.execute(
+        text(f"WITH RECURSIVE r(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM r WHERE i < {n}) SELECT i FROM r"),
+        execution_options={"stream_results": True},
+    )
+
+
+def test_streamed_result_chunks(api):
+    api.result_chunk_rows = 3
+    with create_engine("sqlite://").connect() as connection:
+        result = QueryResult((column("i", 20),), [], count_to(connection, 10))
+        data = api.sql_alchemy_result_to_snowglobe_result(result, (), chunk_destination=ChunkDestination("o", "q", "/"))
+    assert data["total"] == data["returned"] == 10  # noqa: PLR2004
+    assert data["rowset"] == [[1], [2], [3]]
+    assert [chunk["rowCount"] for chunk in data["chunks"]] == [3, 3, 1]
+    assert result.stream is None
+
+
+def test_streamed_result_inline(api):
+    with create_engine("sqlite://").connect() as connection:
+        result = QueryResult((column("i", 20),), [], count_to(connection, 5))
+        data = api.sql_alchemy_result_to_snowglobe_result(result, ())
+    assert data["rowset"] == [[1], [2], [3], [4], [5]]
+    assert "chunks" not in data
+
+
+def test_query_result_batches():
+    with create_engine("sqlite://").connect() as connection:
+        result = QueryResult((column("i", 20),), [(0,)], count_to(connection, 4))
+        assert [[row[0] for row in batch] for batch in result.batches(3)] == [[0], [1, 2, 3], [4]]
+        assert list(result.batches(3)) == [[(0,)]]  # the stream can only be consumed once
+
+        materialized = QueryResult((column("i", 20),), [(0,)], count_to(connection, 2)).materialize()
+        assert [tuple(row) for row in materialized.rows] == [(0,), (1,), (2,)]
+        assert materialized.stream is None
+
+
+def test_encode_response(api):
+    api.gzip_threshold = 100
+    small = api.encode_response({"data": "x"}, gzip_allowed=True)
+    assert "Content-Encoding" not in small.headers
+    assert json.loads(small.body) == {"data": "x"}
+
+    content = {"data": "x" * 100}
+    large = api.encode_response(content, gzip_allowed=True)
+    assert large.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(large.body)) == content
+    assert "Content-Encoding" not in api.encode_response(content, gzip_allowed=False).headers
+
+    api.gzip_threshold = None
+    assert "Content-Encoding" not in api.encode_response(content, gzip_allowed=True).headers
+
+
+def test_metrics_render(api):
+    api.encode_response({"data": None}, gzip_allowed=False)
+    metrics = api.metrics.render()
+    assert 'snowglobe_phase_duration_seconds_count{phase="encode"} 1' in metrics
+    assert "snowglobe_sessions 0" in metrics
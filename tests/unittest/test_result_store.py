@@ -0,0 +1,99 @@
+from pytest import raises
+
+from yellowbox_snowglobe.result_store import ResultStore, StoredResult
+from yellowbox_snowglobe.session import FAILED_WITH_ERROR, RUNNING, SUCCESS, QueryResult
+
+DESCRIPTION = (("a", 20, None, None, None, None, None), ("b", 25, None, None, None, None, None))
+
+
+def make_result(row_count: int) -> QueryResult:
+    return QueryResult(DESCRIPTION, [(i, f"row {i}") for i in range(row_count)])
+
+
+def test_stored_result_round_trip():
+    result = make_result(100)
+    stored = StoredResult.from_result(result)
+    assert stored.nbytes == len(stored.payload)
+    assert stored.to_result() == result
+
+
+def test_stored_result_empty():
+    stored = StoredResult.from_result(make_result(0))
+    assert stored.to_result() == make_result(0)
+    no_columns = StoredResult.from_result(QueryResult((), [(), ()]))
+    assert no_columns.to_result().rows == [(), ()]
+
+
+def test_retrieve_repeatedly():
+    store = ResultStore()
+    query = store.start("q")
+    assert query.status == RUNNING
+    with raises(KeyError):
+        store.result("q")
+    store.finish("q", make_result(3))
+    assert store.get("q").status == SUCCESS
+    assert store.result("q") == make_result(3)
+    assert store.result("q") == make_result(3)
+
+
+def test_failed_query():
+    store = ResultStore()
+    store.start("q")
+    store.fail("q", "oops")
+    query = store.get("q")
+    assert query.status == FAILED_WITH_ERROR
+    assert query.error_message == "oops"
+
+
+def test_ttl():
+    store = ResultStore(ttl=0)
+    store.start("q")
+    assert store.get("q") is not None  # running queries never expire
+    store.finish("q", make_result(3))
+    assert store.get("q") is None
+    assert len(store) == 0
+    assert store.nbytes == 0
+
+
+def test_budget_evicts_least_recently_used():
+    result_size = StoredResult.from_result(make_result(1000)).nbytes
+    store = ResultStore(max_bytes=result_size * 2)
+    for query_id in ("a", "b"):
+        store.start(query_id)
+        store.finish(query_id, make_result(1000))
+    store.get("a")  # "b" is now the least recently used
+    store.start("c")
+    store.finish("c", make_result(1000))
+    assert store.get("b") is None
+    assert store.result("a") == make_result(1000)
+    assert store.result("c") == make_result(1000)
+    assert store.nbytes == result_size * 2
+
+
+def test_budget_keeps_newest():
+    store = ResultStore(max_bytes=1)
+    store.start("q")
+    store.finish("q", make_result(1000))
+    assert store.result("q") == make_result(1000)
+
+
+def test_spill(tmp_path):
+    store = ResultStore(max_bytes=1, spill_directory=tmp_path / "spill")
+    for query_id in ("a", "b"):
+        store.start(query_id)
+        store.finish(query_id, make_result(1000))
+    assert store.nbytes == StoredResult.from_result(make_result(1000)).nbytes
+    assert (tmp_path / "spill" / "a.result").is_file()
+    assert store.result("a") == make_result(1000)
+    store.close()
+    assert not (tmp_path / "spill" / "a.result").exists()
+    assert len(store) == 0
+
+
+def test_non_row_results():
+    store = ResultStore()
+    store.start("q")
+    store.finish("q", None)
+    assert store.result("q") is None
+    store.finish("unknown", make_result(1))
+    assert store.get("unknown") is None
@@ -0,0 +1,71 @@
+import asyncio
+
+from yellowbox_snowglobe.api import MIN_SESSION_REAP_INTERVAL, SESSION_REAP_INTERVAL
+from yellowbox_snowglobe.session import SnowGlobeSession, is_select_into
+
+
+def add_session(api, db=None) -> SnowGlobeSession:
+    session = SnowGlobeSession(api, db, "public")
+    api.sessions[session.token] = session
+    return session
+
+
+def test_session_connects_lazily(api):
+    # the api has no postgresql service, so the session would fail if it connected
+    session = add_session(api, "db")
+    assert session.db == "db"
+    assert not session.connected
+    assert session.do_query("!commit") is None
+    assert session.do_query("!rollback") is None
+    session.switch_db("other")
+    assert session.db == "other"
+    assert not session.connected
+
+
+def test_reap_idle_sessions(api):
+    api.session_idle_timeout = 10
+    idle = add_session(api)
+    idle.last_used -= 20
+    active = add_session(api)
+    assert asyncio.run(api.reap_idle_sessions()) == 1
+    assert list(api.sessions.values()) == [active]
+    assert api.metrics.reaped_sessions.value() == 1
+
+
+def test_reap_skips_running_sessions(api):
+    api.session_idle_timeout = 0
+
+    async def reap_while_running(session: SnowGlobeSession) -> int:
+        async with session.lock:
+            return await api.reap_idle_sessions()
+
+    running = add_session(api)
+    assert asyncio.run(reap_while_running(running)) == 0
+    assert running.token in api.sessions
+
+
+def test_session_reap_interval(api):
+    api.session_idle_timeout = 10
+    assert api.session_reap_interval() == 10  # noqa: PLR2004
+    api.session_idle_timeout = 1_000
+    assert api.session_reap_interval() == SESSION_REAP_INTERVAL
+    api.session_idle_timeout = None
+    assert api.session_reap_interval() == SESSION_REAP_INTERVAL
+    # a zero timeout must not make the reaper busy loop
+    api.session_idle_timeout = 0
+    assert api.session_reap_interval() == MIN_SESSION_REAP_INTERVAL
+
+
+def test_reap_disabled(api):
+    api.session_idle_timeout = None
+    session = add_session(api)
+    session.last_used -= 1_000_000
+    assert asyncio.run(api.reap_idle_sessions()) == 0
+    assert session.token in api.sessions
+
+
+def test_is_select_into():
+    assert is_select_into("select x into bar from baz")
+    assert is_select_into("SELECT *\nINTO TEMP bar FROM baz")
+    assert not is_select_into("select x from bar")
+    assert not is_select_into("select 'copy into' as x, \"into\" from bar")
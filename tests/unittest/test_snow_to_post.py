@@ -2,7 +2,17 @@ from typing import List
 
 from pytest import mark
 
-from yellowbox_snowglobe.snow_to_post import TextLiteral, snow_to_post, split_literals, split_sql_to_statements
+from yellowbox_snowglobe.snow_to_post import (
+    Comment,
+    QuotedIdentifier,
+    TextLiteral,
+    replace_array_construct,
+    snow_to_post,
+    split_literals,
+    split_sql_to_statements,
+    tokenize,
+    transpile,
+)
 
 
 @mark.parametrize(
@@ -28,6 +38,9 @@ from yellowbox_snowglobe.snow_to_post import TextLiteral, snow_to_post, split_li
         ("select data:a::int from foo", "select cast(data->>'a' as integer) from foo"),
         ("select t.data:a::int from foo", "select cast(t.data->>'a' as integer) from foo"),
         ("select data:a::string from foo", "select data->>'a' from foo"),
+        ("select ARRAY_CONSTRUCT('a', 'b)') from foo", "select Array['a', 'b)'] from foo"),
+        ('select "d..foo" from foo -- d..foo', 'select "d..foo" from foo -- d..foo'),
+        ("select 1 from d..foo // d..foo", "select 1 from d.public.foo -- d..foo"),
     ],
 )
 def test_snow_to_post(snow: str, post: str):
@@ -52,6 +65,22 @@ def test_split_literals(joined: str, split: List[str]):
     assert list(split_literals(joined)) == split
 
 
+@mark.parametrize(
+    ("query", "tokens"),
+    [
+        ('a"b;c""d"e', ["a", QuotedIdentifier('"b;c""d"'), "e"]),
+        ("a$$b'c$$d", ["a", TextLiteral("$$b'c$$"), "d"]),
+        ("a -- b'c\nd", ["a ", Comment("-- b'c"), "\nd"]),
+        ("a // b\nd", ["a ", Comment("-- b"), "\nd"]),
+        ("put file:///tmp/a.csv @s", ["put file:///tmp/a.csv @s"]),
+        ("a /* b\n'c */d", ["a ", Comment("/* b\n'c */"), "d"]),
+        ("a /* b", ["a ", Comment("/* b")]),
+    ],
+)
+def test_tokenize(query: str, tokens: List[str]):
+    assert list(tokenize(query)) == tokens
+
+
 @mark.parametrize(
     ("joined", "split"),
     [
@@ -65,3 +94,33 @@ def test_split_literals(joined: str, split: List[str]):
 )
 def test_split_statements(joined: str, split: List[str]):
     assert list(split_sql_to_statements(joined)) == split
+
+
+@mark.parametrize(
+    ("snow", "post"),
+    [
+        ("ARRAY_CONSTRUCT(1, 2)", "Array[1, 2]"),
+        ("array_construct(f(1), 2)", "Array[f(1), 2]"),
+        ("ARRAY_CONSTRUCT(ARRAY_CONSTRUCT(ARRAY_CONSTRUCT(1)))", "Array[Array[Array[1]]]"),
+        ("ARRAY_CONSTRUCT(')', \"(\")", "Array[')', \"(\"]"),
+        ("ARRAY_CONSTRUCT(1, ARRAY_CONSTRUCT(2)", "ARRAY_CONSTRUCT(1, Array[2]"),
+        ("'ARRAY_CONSTRUCT(1)'", "'ARRAY_CONSTRUCT(1)'"),
+        ("MY_ARRAY_CONSTRUCT(1)", "MY_ARRAY_CONSTRUCT(1)"),
+    ],
+)
+def test_replace_array_construct(snow: str, post: str):
+    assert replace_array_construct(snow) == post
+
+
+@mark.parametrize(
+    ("snow", "post"),
+    [
+        ("", []),
+        ("select 1;", ["select 1"]),
+        ("use schema foo", ["SET search_path TO foo", "!set_schema foo"]),
+        ("select 1; select 2", ["select 1", " select 2"]),
+        ("select 1 -- ;\n; select ';'", ["select 1 -- ;\n", " select ';'"]),
+    ],
+)
+def test_transpile(snow: str, post: List[str]):
+    assert transpile(snow) == post
@@ -0,0 +1,188 @@
+import gzip
+from datetime import date, datetime
+from pathlib import Path
+
+from pytest import fixture, mark, raises
+
+from yellowbox_snowglobe.stage import (
+    ChunkReader,
+    CopyInto,
+    FileTransfer,
+    LocalStage,
+    SplitFileWriter,
+    copy_text_row,
+    csv_copy_statement,
+    csv_unload_statement,
+    open_staged_file,
+    unload_csv,
+)
+
+
+@fixture
+def stage(tmp_path):
+    return LocalStage(str(tmp_path))
+
+
+@mark.parametrize(
+    ("reference", "directory", "path"),
+    [
+        ("@s", "db/public/s", ""),
+        ("@S/a/b/", "db/public/s", "a/b"),
+        ("@x.s", "db/x/s", ""),
+        ("@d.x.s/a", "d/x/s", "a"),
+        ("'@s/a b'", "db/public/s", "a b"),
+        ('@"My Stage"', "db/public/My Stage", ""),
+        ("@%t", "db/public/%t", ""),
+        ("@~/a", "~", "a"),
+    ],
+)
+def test_location(stage, reference, directory, path):
+    location = stage.location(reference, "db", "public")
+    assert location.directory == stage.root / directory
+    assert location.path == path
+
+
+def test_location_without_db(stage):
+    assert stage.location("@~", None, "public").directory == stage.root / "~"
+    with raises(Exception, match="No database"):
+        stage.location("@s", None, "public")
+
+
+def test_invalid_location(stage):
+    with raises(ValueError, match="invalid stage reference"):
+        stage.location("s", "db", "public")
+
+
+def test_files(stage):
+    location = stage.location("@s", "db", "public")
+    for name in ("a/1.csv", "a/2.csv.gz", "ab.csv", "b/1.csv"):
+        file = location.directory / name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text("")
+    assert [location.relative_name(f) for f in location.files()] == ["a/1.csv", "a/2.csv.gz", "ab.csv", "b/1.csv"]
+    prefixed = stage.location("@s/a", "db", "public")
+    assert [location.relative_name(f) for f in prefixed.files()] == ["a/1.csv", "a/2.csv.gz", "ab.csv"]
+    assert [location.relative_name(f) for f in location.files(pattern=r".*\.csv")] == ["a/1.csv", "ab.csv", "b/1.csv"]
+    assert [location.relative_name(f) for f in prefixed.files(names=["1.csv", "3.csv"])] == ["a/1.csv"]
+
+
+def test_owned_root_removed():
+    stage = LocalStage()
+    assert stage.root.is_dir()
+    stage.close()
+    assert not stage.root.exists()
+
+
+def test_parse_copy_into():
+    copy = CopyInto.parse(
+        "COPY INTO d.public.t(a, b) FROM '@s/x' FILES = ('a.csv','b.csv') FILE_FORMAT = (TYPE = CSV SKIP_HEADER = 1)"
+        " PURGE = TRUE"
+    )
+    assert copy == CopyInto(
+        "d.public.t",
+        "a, b",
+        "@s/x",
+        {"FILES": "('a.csv','b.csv')", "FILE_FORMAT": "(TYPE = CSV SKIP_HEADER = 1)", "PURGE": "TRUE"},
+    )
+
+
+def test_parse_copy_into_query():
+    copy = CopyInto.parse("copy into @s/out from (select ')' from t) header=true")
+    assert copy == CopyInto("@s/out", None, "(select ')' from t)", {"HEADER": "true"})
+
+
+def test_csv_copy_statement():
+    assert csv_copy_statement("t", {}) == "COPY t FROM STDIN WITH (FORMAT csv)"
+    assert csv_copy_statement("t (a)", {"FIELD_DELIMITER": "\\t", "NULL_IF": "('\\\\N')"}) == (
+        "COPY t (a) FROM STDIN WITH (FORMAT csv, DELIMITER '\t', NULL '\\N')"
+    )
+
+
+def test_copy_text_row():
+    assert copy_text_row([1, "a\tb\\c", None, True]) == b"1\ta\\tb\\\\c\t\\N\tt\n"
+    assert copy_text_row([b"\x01\xff", {"a": [1]}]) == b'\\\\x01ff\t{"a": [1]}\n'
+    assert copy_text_row([date(2020, 1, 2), datetime(2020, 1, 2, 3, 4, 5)]) == b"2020-01-02\t2020-01-02T03:04:05\n"
+
+
+def test_chunk_reader():
+    reader = ChunkReader([b"ab", b"cde", b"f"])
+    assert reader.read(4) == b"abcd"
+    assert reader.read(4) == b"ef"
+    assert reader.read(4) == b""
+
+
+def test_open_staged_file(tmp_path: Path):
+    plain = tmp_path / "a.csv"
+    plain.write_bytes(b"1,2\n")
+    compressed = tmp_path / "a.csv.gz"
+    compressed.write_bytes(gzip.compress(b"1,2\n"))
+    for path in (plain, compressed):
+        with open_staged_file(path) as f:
+            assert f.read() == b"1,2\n"
+
+
+def test_upload_response(tmp_path: Path):
+    data = FileTransfer("UPLOAD", ["/data/a.csv"], tmp_path, options={"OVERWRITE": "TRUE"}).response_data()
+    assert data["command"] == "UPLOAD"
+    assert data["src_locations"] == ["/data/a.csv"]
+    assert data["overwrite"]
+    assert data["autoCompress"]
+    assert data["stageInfo"]["locationType"] == "LOCAL_FS"
+    assert data["stageInfo"]["location"] == f"{tmp_path}/"
+    assert "localLocation" not in data
+
+
+def test_csv_unload_statement():
+    assert csv_unload_statement("select 1", {"FIELD_DELIMITER": "|"}, header=True) == (
+        "COPY (select 1) TO STDOUT WITH (FORMAT csv, DELIMITER '|', HEADER true)"
+    )
+
+
+@mark.parametrize("compression", ["NONE", "GZIP", "BZ2"])
+def test_split_file_writer(tmp_path: Path, compression):
+    writer = SplitFileWriter(lambda i: tmp_path / f"data_{i}", compression, max_file_size=8, header=b"h\n")
+    for i in range(3):
+        writer.write(f"row {i}\n".encode())
+    writer.close()
+    assert writer.files == [tmp_path / "data_0", tmp_path / "data_1", tmp_path / "data_2"]
+    for i, path in enumerate(writer.files):
+        with open_staged_file(path) as f:
+            assert f.read() == f"h\nrow {i}\n".encode()
+    assert writer.input_bytes == 3 * len(b"row 0\n")
+    assert writer.output_bytes == sum(path.stat().st_size for path in writer.files)
+
+
+class CopyToCursor:
+    # writes the given rows to copy_expert's file one at a time, like psycopg2
+    def __init__(self, rows):
+        self.rows = rows
+        self.rowcount = -1
+
+    def copy_expert(self, sql, file):
+        for row in self.rows:
+            file.write(row)
+        self.rowcount = len(self.rows) - 1
+
+
+def test_unload_csv(tmp_path: Path):
+    writer = SplitFileWriter(lambda i: tmp_path / f"data_{i}", max_file_size=4)
+    cursor = CopyToCursor([b"x\n", b"1\n", b"2\n"])
+    assert unload_csv(cursor, "select 1", writer, {}, header=True) == len(cursor.rows) - 1
+    writer.close()
+    assert [path.read_bytes() for path in writer.files] == [b"x\n1\n", b"x\n2\n"]
+
+
+def test_split_file_writer_discard(tmp_path: Path):
+    writer = SplitFileWriter(lambda i: tmp_path / "out" / f"data_{i}", max_file_size=None)
+    writer.write(b"row\n")
+    writer.write(b"row\n")
+    assert writer.files == [tmp_path / "out" / "data_0"]
+    writer.discard()
+    assert not (tmp_path / "out" / "data_0").exists()
+
+
+def test_download_response(tmp_path: Path):
+    data = FileTransfer("DOWNLOAD", ["out/data_0_0_0.csv.gz"], tmp_path, local_location="/data").response_data()
+    assert data["command"] == "DOWNLOAD"
+    assert data["src_locations"] == ["out/data_0_0_0.csv.gz"]
+    assert data["localLocation"] == "/data"
@@ -0,0 +1,58 @@
+import json
+
+from yellowbox_snowglobe import transpile_cache
+from yellowbox_snowglobe.snow_to_post import TRANSPILER_VERSION
+from yellowbox_snowglobe.transpile_cache import TranspileCache, rules_fingerprint
+
+
+def test_hits_and_misses():
+    cache = TranspileCache()
+    assert cache.statements("select * from d..foo;") == ("select * from d.public.foo",)
+    assert cache.statements("select * from d..foo;") == ("select * from d.public.foo",)
+    assert cache.statements("use schema foo") == ("SET search_path TO foo", "!set_schema foo")
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_eviction():
+    cache = TranspileCache(max_size=2)
+    cache.statements("select 1")
+    cache.statements("select 2")
+    cache.statements("select 1")  # 1 is now the most recently used
+    cache.statements("select 3")
+    assert len(cache) == cache.max_size
+    cache.statements("select 1")
+    cache.statements("select 2")
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_disabled():
+    cache = TranspileCache(max_size=0)
+    assert cache.statements("select 1") == ("select 1",)
+    assert cache.statements("select 1") == ("select 1",)
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_persistence(tmp_path):
+    path = tmp_path / "cache.json"
+    cache = TranspileCache(path=path)
+    cache.statements("select * from d..foo")
+    cache.save()
+
+    warm = TranspileCache(path=path)
+    assert warm.statements("select * from d..foo") == ("select * from d.public.foo",)
+    assert (warm.hits, warm.misses) == (1, 0)
+
+
+def test_persistence_stale_rules(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text(json.dumps({"fingerprint": "old", "entries": [["select 1", ["select 2"]]]}))
+    cache = TranspileCache(path=path)
+    assert len(cache) == 0
+    assert cache.statements("select 1") == ("select 1",)
+
+
+def test_fingerprint_includes_transpiler_version(monkeypatch):
+    fingerprint = rules_fingerprint()
+    monkeypatch.setattr(transpile_cache, "TRANSPILER_VERSION", TRANSPILER_VERSION + 1)
+    assert rules_fingerprint() != fingerprint
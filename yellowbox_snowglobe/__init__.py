@@ -1,4 +1,5 @@
 from yellowbox_snowglobe._version import __version__
 from yellowbox_snowglobe.service import SnowGlobeService
+from yellowbox_snowglobe.transpile_cache import TranspileCache
 
-__all__ = ["SnowGlobeService", "__version__"]
+__all__ = ["SnowGlobeService", "TranspileCache", "__version__"]
@@ -1,30 +1,71 @@
 from __future__ import annotations
 
+import asyncio
 import gzip
-import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
-from datetime import datetime, timezone
-from decimal import Decimal
+from functools import partial
+from itertools import accumulate
+from time import monotonic, perf_counter, time
 from traceback import print_exc
-from typing import Any, Callable, Container, Dict, Optional, Sequence
+from typing import Any, Callable, Container, Dict, Iterator, List, Optional, Sequence, Set, Tuple, TypeVar
 from uuid import uuid4
 
-from sqlalchemy.engine import Row
 from starlette.exceptions import HTTPException
 from starlette.requests import Request
 from starlette.responses import JSONResponse, Response
 from yellowbox.extras.postgresql import PostgreSQLService
 from yellowbox.extras.webserver import WebServer, class_http_endpoint
 
+from yellowbox_snowglobe import json_encoding, json_format
+from yellowbox_snowglobe.arrow_format import (
+    ARROW_RESULT_FORMAT,
+    JSON_RESULT_FORMAT,
+    TIMESTAMP_SCALE,
+    decimal_scale,
+    rows_to_arrow_base64,
+    rows_to_arrow_stream,
+)
+from yellowbox_snowglobe.bindings import Parameters, convert_bindings, qmark_to_numeric
 from yellowbox_snowglobe.case_mode import CaseMode
-from yellowbox_snowglobe.session import SnowGlobeSession
-from yellowbox_snowglobe.snow_to_post import snow_to_post, split_sql_to_statements
+from yellowbox_snowglobe.column_catalog import ColumnCatalog
+from yellowbox_snowglobe.engines import DEFAULT_MAX_OVERFLOW, DEFAULT_POOL_SIZE, EngineRegistry, snapshot_database_name
+from yellowbox_snowglobe.json_format import ColumnConverter, rows_to_json_rowset
+from yellowbox_snowglobe.metrics import CONTENT_TYPE, Gauge, Labels, SnowGlobeMetrics
+from yellowbox_snowglobe.query_history import DEFAULT_HISTORY_SIZE, QueryHistory, QueryRecord
+from yellowbox_snowglobe.result_cache import ResultCache
+from yellowbox_snowglobe.result_chunks import CHUNK_COMPRESSION_LEVEL, ChunkDestination, ResultChunks
+from yellowbox_snowglobe.result_store import ResultStore
+from yellowbox_snowglobe.schema_init import initialize_schema
+from yellowbox_snowglobe.session import QUERY_RESPONSE, QueryResult, SnowGlobeSession
+from yellowbox_snowglobe.snow_to_post import split_sql_to_statements
+from yellowbox_snowglobe.stage import TEXT_OID, FileTransfer, LocalStage, description
+from yellowbox_snowglobe.transpile_cache import TranspileCache
 
 
 async def unpack_request_body(request: Request) -> dict:
     body = await request.body()
-    uz = gzip.decompress(body)
-    return json.loads(uz)
+    # the connector always compresses its requests, but other clients might not
+    if body[:2] == GZIP_MAGIC:
+        body = gzip.decompress(body)
+    return json_encoding.loads(body)
+
+
+def unconstrained_numeric_scale(result: QueryResult, index: int) -> int:
+    """
+    Get the scale to report for a numeric column without a typmod, whose values can have any scale. The connector
+    parses the values of a column with a scale of 0 as integers, so it is only reported when none of the rows have a
+    fraction, and all the rows are known (the later rows of a streamed result might have one)
+    """
+    scale = decimal_scale([row[index] for row in result.rows])
+    if result.stream is not None:
+        return max(scale, 1)
+    return scale
+
+
+def accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("Accept-Encoding", "").lower()
 
 
 @dataclass
@@ -34,74 +75,344 @@ class SnowType:
     """
 
     name: str
-    connector_converter: Optional[Callable[[Any], Any]] = None
+    json_converter: Optional[ColumnConverter] = None
     """
-    This converter is used to convert the python value to a value the connector can use (currently only used for bools)
+    This converter is used to convert a column of python values to the values the connector expects in a json rowset
     """
+    scale: Optional[int] = None  # the scale to report in the rowtype, if it doesn't depend on the column
 
 
-PY_TYPE_TO_SNOW_TYPE = {
-    int: SnowType("NUMBER"),
-    Decimal: SnowType("NUMBER", str),
-    str: SnowType("TEXT"),
-    float: SnowType("FLOAT"),
-    bool: SnowType("BOOLEAN", lambda x: str(int(x))),
-    datetime: SnowType("TIMESTAMP_NTZ", lambda x: str(x.replace(tzinfo=timezone.utc).timestamp())),
-}  # todo there are a lot more
+INTEGER = SnowType("NUMBER")
+NUMERIC = SnowType("NUMBER", json_format.convert_number)
+TEXT = SnowType("TEXT")
+FLOAT = SnowType("FLOAT")
+BOOLEAN = SnowType("BOOLEAN", json_format.convert_boolean)
+DATE = SnowType("DATE", json_format.convert_date)
+TIME = SnowType("TIME", json_format.convert_time, TIMESTAMP_SCALE)
+TIMESTAMP_NTZ = SnowType("TIMESTAMP_NTZ", json_format.convert_timestamp_ntz, TIMESTAMP_SCALE)
+TIMESTAMP_TZ = SnowType("TIMESTAMP_TZ", json_format.convert_timestamp_tz, TIMESTAMP_SCALE)
+BINARY = SnowType("BINARY", json_format.convert_binary)
+VARIANT = SnowType("VARIANT", json_format.convert_semi_structured)
+ARRAY = SnowType("ARRAY", json_format.convert_semi_structured)
 
 OBJECT = SnowType("OBJECT")  # this will be the default snow type for when we can't handle the result type
 
+# maps the oid of a postgresql type (as it appears in a cursor description) to the snow type of its values
+PG_TYPE_TO_SNOW_TYPE = {
+    16: BOOLEAN,  # bool
+    17: BINARY,  # bytea
+    18: TEXT,  # char
+    19: TEXT,  # name
+    20: INTEGER,  # int8
+    21: INTEGER,  # int2
+    23: INTEGER,  # int4
+    25: TEXT,  # text
+    26: INTEGER,  # oid
+    114: VARIANT,  # json
+    700: FLOAT,  # float4
+    701: FLOAT,  # float8
+    1042: TEXT,  # bpchar
+    1043: TEXT,  # varchar
+    1082: DATE,  # date
+    1083: TIME,  # time
+    1114: TIMESTAMP_NTZ,  # timestamp
+    # postgresql has no type that keeps a timestamp's own offset, psycopg2 returns timestamptz values in the session's
+    # timezone, which TIMESTAMP_TZ preserves (TIMESTAMP_LTZ would convert them to the connector's timezone)
+    1184: TIMESTAMP_TZ,  # timestamptz
+    1700: NUMERIC,  # numeric
+    3802: VARIANT,  # jsonb
+    # arrays
+    199: ARRAY,  # json[]
+    1000: ARRAY,  # bool[]
+    1005: ARRAY,  # int2[]
+    1007: ARRAY,  # int4[]
+    1009: ARRAY,  # text[]
+    1014: ARRAY,  # bpchar[]
+    1015: ARRAY,  # varchar[]
+    1016: ARRAY,  # int8[]
+    1021: ARRAY,  # float4[]
+    1022: ARRAY,  # float8[]
+    1231: ARRAY,  # numeric[]
+    3807: ARRAY,  # jsonb[]
+}  # todo there are a lot more
+
+# the session parameter the python connector uses to choose the format of query results
+RESULT_FORMAT_PARAMETER = "PYTHON_CONNECTOR_QUERY_RESULT_FORMAT"
+# the number of statements a query is expected to have (0 for any number), a query with more than one statement is
+# run as a multi-statement query
+MULTI_STATEMENT_COUNT_PARAMETER = "MULTI_STATEMENT_COUNT"
+
+DEFAULT_RESULT_CHUNK_ROWS = 100_000
+DEFAULT_SQL_WORKERS = 16
+DEFAULT_GZIP_THRESHOLD = 64 * 1024
+# like in snowflake, sessions expire after 4 hours without requests
+DEFAULT_SESSION_IDLE_TIMEOUT = 4 * 60 * 60
+SESSION_REAP_INTERVAL = 60  # the most seconds between checks for idle sessions
+# the least seconds between checks for idle sessions, so that a (near) zero idle timeout doesn't busy loop
+MIN_SESSION_REAP_INTERVAL = 1
+GZIP_MAGIC = b"\x1f\x8b"
+
+# the session parameters sent to the connector on login
+LOGIN_PARAMETERS = [
+    # the connector would otherwise try to upload large array bindings to a stage, we want them sent in the request
+    {"name": "CLIENT_STAGE_ARRAY_BINDING_THRESHOLD", "value": 0},
+]
+
+T = TypeVar("T")
+
+MULTI_STATEMENT_COLUMNS = description((("multiple statement execution", TEXT_OID),))
+
+# the handlers of statements that EXPLAIN supports
+EXPLAINABLE_HANDLERS = frozenset({"select", "mutating_noresponse"})
+
 
 class SnowGlobeAPI(WebServer):
-    def __init__(self, *args, sql_service: PostgreSQLService, metadata_table_name: str, case_mode: CaseMode, **kwargs):
+    def __init__(  # noqa: PLR0913
+        self,
+        *args,
+        sql_service: PostgreSQLService,
+        metadata_table_name: str,
+        case_mode: CaseMode,
+        result_format: str = JSON_RESULT_FORMAT,
+        result_chunk_rows: Optional[int] = DEFAULT_RESULT_CHUNK_ROWS,
+        transpile_cache: Optional[TranspileCache] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_overflow: int = DEFAULT_MAX_OVERFLOW,
+        sql_workers: int = DEFAULT_SQL_WORKERS,
+        stage_root: Optional[str] = None,
+        result_store: Optional[ResultStore] = None,
+        stream_results: bool = True,
+        gzip_threshold: Optional[int] = DEFAULT_GZIP_THRESHOLD,
+        query_history_size: int = DEFAULT_HISTORY_SIZE,
+        slow_query_threshold: Optional[float] = None,
+        session_idle_timeout: Optional[float] = DEFAULT_SESSION_IDLE_TIMEOUT,
+        max_sessions: Optional[int] = None,
+        result_cache: Optional[ResultCache] = None,
+        **kwargs,
+    ):
         super().__init__("snowglobe", *args, **kwargs)
         self.sql_service = sql_service
+        # sessions check their connections out of a pool shared by all sessions on the same database, new databases are
+        # created from a template with its public schema already initialized
+        self.engines = EngineRegistry(
+            sql_service,
+            pool_size,
+            max_overflow,
+            partial(initialize_schema, schema="public", metadata_table_name=metadata_table_name),
+        )
+        self.initialized_schemas: Set[Tuple[str, str]] = set()  # all the (db, schema) pairs known to be initialized
+        self.column_catalogs: Dict[str, ColumnCatalog] = {}  # the known columns of each database
         self.case_mode = case_mode
+        self.result_format = result_format  # the result format to use when the connector doesn't specify one
 
         self.sessions: Dict[str, SnowGlobeSession] = {}  # stores all the live sessions
+        # sessions without requests for this many seconds are closed, None to keep sessions until they are deleted
+        self.session_idle_timeout = session_idle_timeout
+        # logins are refused while there are this many live sessions, None for no limit
+        self.max_sessions = max_sessions
+        self._reaper: Optional[asyncio.Task] = None  # closes idle sessions, started by the first login
         self.metadata_table_name = metadata_table_name
 
-        self.query_results: Dict[str, Sequence[Row] | None] = {}  # stores all the async query results
+        # reused results of SELECT statements, until the tables they read are changed, None to always run them
+        self.result_cache = result_cache
+        # stores the status and results of all the async queries, within a byte budget and until they expire
+        self.query_results = result_store if result_store is not None else ResultStore()
+        # all blocking SQL work runs in this executor, so that slow queries don't block the other sessions
+        self.sql_executor = ThreadPoolExecutor(max_workers=sql_workers, thread_name_prefix="snowglobe-sql")
+        self._async_tasks: Set[asyncio.Task] = set()  # the running async queries, we must keep a reference to them
+
+        # results with more rows than this are split into chunks, set to None to always send the entire result inline
+        self.result_chunk_rows = result_chunk_rows
+        # whether to fetch the rows of SELECT statements from server-side cursors as they are encoded, rather than all
+        # at once
+        self.stream_results = stream_results
+        # query responses at least this large are gzip-compressed (if the client accepts it), None to never compress
+        self.gzip_threshold = gzip_threshold
+        self.result_chunks = ResultChunks()  # stores all the chunks that have yet to be downloaded
+        # caches the transpiled statements of query texts, saved when the api stops if it has a path
+        self.transpile_cache = transpile_cache if transpile_cache is not None else TranspileCache()
+        # all the stages are directories under this root (a temporary directory if not specified), the connector must be
+        # able to access it to PUT or GET files
+        self.stage = LocalStage(stage_root)
+        self.metrics = SnowGlobeMetrics()  # exposed in the prometheus format by the metrics endpoint
+        # the most recent queries, served by the monitoring endpoints
+        self.query_history = QueryHistory(query_history_size)
+        # queries that take at least this many seconds are added to the slow query log, along with the plans of their
+        # statements (which are planned again, but not executed, to get them), None to disable the slow query log
+        self.slow_query_threshold = slow_query_threshold
+        self._register_gauges()
+
+    def _register_gauges(self) -> None:
+        def pool_connections() -> Dict[Labels, float]:
+            ret: Dict[Labels, float] = {}
+            for db, (checked_out, idle) in self.engines.pool_status().items():
+                ret[(db, "checked_out")] = checked_out
+                ret[(db, "idle")] = idle
+            return ret
+
+        self.metrics.register(
+            Gauge("snowglobe_sessions", "The number of live sessions", lambda: {(): len(self.sessions)})
+        )
+        self.metrics.register(
+            Gauge(
+                "snowglobe_async_queries", "The number of stored async queries", lambda: {(): len(self.query_results)}
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "snowglobe_async_result_bytes",
+                "The number of async result bytes held in memory",
+                lambda: {(): self.query_results.nbytes},
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "snowglobe_pool_connections",
+                "The number of connections in each database's pool",
+                pool_connections,
+                ["database", "state"],
+            )
+        )
+
+    def result_rowtype(
+        self, result: QueryResult, known_columns: Container[str]
+    ) -> Tuple[List[Dict[str, Any]], List[SnowType]]:
+        """
+        Get the column descriptions of a result, along with the snow type of each column
+        """
+        columns: List[Dict[str, Any]] = []
+        types: List[SnowType] = []
+        for i, (name, type_code, display_size, _, precision, scale, null_ok) in enumerate(result.description):
+            t = PG_TYPE_TO_SNOW_TYPE.get(type_code, OBJECT)
+            if t.scale is not None:
+                scale = t.scale
+            elif t is NUMERIC and scale is None:
+                scale = unconstrained_numeric_scale(result, i)
+            columns.append(
+                {
+                    "name": self.case_mode.convert(name, known_columns),
+                    "type": t.name,
+                    "length": display_size or 0,
+                    "precision": precision or 0,
+                    "scale": scale or 0,
+                    # postgresql doesn't report whether result columns are nullable, so we assume they all are
+                    "nullable": null_ok is not False,
+                }
+            )
+            types.append(t)
+        return columns, types
+
+    def encode_response(
+        self, content: Dict[str, Any], *, gzip_allowed: bool, record: Optional[QueryRecord] = None
+    ) -> Response:
+        """
+        Encode the json response to a request, responses above the gzip threshold are compressed if the client allows it
+        """
+        with self._phase(record, "encode"):
+            body = json_encoding.dumps(content)
+            headers = {}
+            if gzip_allowed and self.gzip_threshold is not None and len(body) >= self.gzip_threshold:
+                body = gzip.compress(body, CHUNK_COMPRESSION_LEVEL)
+                headers["Content-Encoding"] = "gzip"
+        return Response(body, media_type="application/json", headers=headers)
 
     def sql_alchemy_result_to_snowglobe_result(
-        self, result: Sequence[Row], known_columns: Container[str]
+        self,
+        result: QueryResult,
+        known_columns: Container[str],
+        result_format: str = JSON_RESULT_FORMAT,
+        chunk_destination: Optional[ChunkDestination] = None,
     ) -> Dict[str, Any]:
-        col_names = result[0]._fields
-        columns = [
-            {
-                "name": self.case_mode.convert(col_name, known_columns),
-                "length": 0,
-                "precision": 0,
-                "scale": 0,
-                "nullable": False,
-            }
-            for col_name in col_names
-        ]
-        rows = [list(row) for row in result]
-        for i, col in enumerate(columns):
-            t = None
-            for row in rows:
-                if row[i] is None:
-                    col["nullable"] = True
-                else:
-                    proposed_type = PY_TYPE_TO_SNOW_TYPE.get(type(row[i]))
-                    if proposed_type is None:
-                        # unrecognized type, call it a variant and be done with it
-                        t = OBJECT
-                    elif t is None:
-                        t = proposed_type
-                    elif t != proposed_type:
-                        # type conflict (I don't know if this can even happen), call it a variant
-                        t = OBJECT
-            if t is None:
-                # if no type was found, we default the column type to variant, AFAICT this will only happen for a result
-                # without rows
-                t = OBJECT
-            col["type"] = t.name
-            if t.connector_converter is not None:
-                for row in rows:
-                    row[i] = t.connector_converter(row[i]) if row[i] is not None else None
-        return {"rowtype": columns, "rowset": rows}
+        """
+        Convert a result to the "data" fields of a query response. If a chunk destination is provided, and the result is
+        larger than a single chunk, all rows beyond the first chunk are stored to be downloaded by the connector.
+        """
+        chunk_rows = self.result_chunk_rows
+        if chunk_destination is None or chunk_rows is None:
+            batches: Iterator[Sequence[Sequence[Any]]] = iter([result.materialize().rows])
+        else:
+            # the rows are encoded one chunk at a time, so streamed results are never entirely held in memory
+            batches = result.batches(chunk_rows)
+        # a result without chunks is materialized before taking its rowtype, since the scale of numeric columns without
+        # a typmod depends on their rows
+        columns, types = self.result_rowtype(result, known_columns)
+        is_arrow = result_format.lower() == ARROW_RESULT_FORMAT
+        col_names = [col["name"] for col in columns]
+        type_names = [t.name for t in types]
+        json_converters = [t.json_converter for t in types]
+
+        def encode_chunk(rows: Sequence[Sequence[Any]]) -> bytes:
+            if is_arrow:
+                return rows_to_arrow_stream(col_names, type_names, rows)
+            # the connector expects json chunks to be the rows without the enclosing brackets
+            return json_encoding.dumps(rows_to_json_rowset(json_converters, rows))[1:-1]
+
+        ret: Dict[str, Any] = {
+            "rowtype": columns,
+            "queryResultFormat": ARROW_RESULT_FORMAT if is_arrow else JSON_RESULT_FORMAT,
+        }
+        inline = next(batches, [])
+        total = len(inline)
+        chunks = []
+        for chunk_index, chunk in enumerate(batches):
+            assert chunk_destination is not None
+            payload = encode_chunk(chunk)
+            chunks.append(
+                {
+                    "url": self.result_chunks.add(chunk_destination, chunk_index, payload),
+                    "rowCount": len(chunk),
+                    "uncompressedSize": len(payload),
+                    # the chunk is compressed in the background, so we don't know its compressed size yet, the
+                    # uncompressed size is an upper bound for it
+                    "compressedSize": len(payload),
+                }
+            )
+            total += len(chunk)
+        if chunks:
+            ret["chunks"] = chunks
+        ret["total"] = ret["returned"] = total
+        if is_arrow:
+            # arrow columns are encoded from the raw python values, so the connector converters are not needed
+            ret["rowsetBase64"] = rows_to_arrow_base64(col_names, type_names, inline)
+        else:
+            ret["rowset"] = rows_to_json_rowset(json_converters, inline)
+        return ret
+
+    def column_catalog(self, db: str) -> ColumnCatalog:
+        """
+        Get the known columns of a database, shared by all the sessions on it
+        """
+        return self.column_catalogs.setdefault(db, ColumnCatalog())
+
+    def _ensure_disconnected(self, db: str) -> None:
+        # postgresql can only copy (or drop) a database that no one is connected to
+        connected = [session.token for session in self.sessions.values() if session.db == db and session.connected]
+        if connected:
+            raise RuntimeError(f"database {db} is in use by sessions {connected}, close their connections first")
+
+    def snapshot(self, db: str, name: str = "default") -> None:
+        """
+        Save a copy of a database's current state, which it can later be restored to. No session may be connected
+        to the database.
+        """
+        self._ensure_disconnected(db)
+        self.engines.clone_database(db, snapshot_database_name(db, name))
+
+    def restore(self, db: str, name: str = "default") -> None:
+        """
+        Restore a database to a snapshot, discarding all the changes made since. No session may be connected to the
+        database.
+        """
+        self._ensure_disconnected(db)
+        self.engines.clone_database(snapshot_database_name(db, name), db)
+        if self.result_cache is not None:
+            self.result_cache.invalidate(db)
+        # the restored database might have different tables and schemas than the ones we know of
+        self.column_catalogs.pop(db, None)
+        self.initialized_schemas.difference_update({key for key in self.initialized_schemas if key[0] == db})
+
+    def drop_snapshot(self, db: str, name: str = "default") -> None:
+        self.engines.drop_database(snapshot_database_name(db, name))
 
     def session_from_request(self, request: Request) -> SnowGlobeSession:
         """
@@ -113,67 +424,440 @@ class SnowGlobeAPI(WebServer):
         if not auth.startswith('Snowflake Token="'):
             raise HTTPException(status_code=401, detail="Invalid Authorization header")
         token = auth[17:-1]
-        if token not in self.sessions:
+        session = self.sessions.get(token)
+        if session is None:
             raise HTTPException(status_code=401, detail="Invalid Authorization header")
-        return self.sessions[token]
+        session.last_used = monotonic()
+        return session
+
+    async def close_session(self, session: SnowGlobeSession) -> None:
+        del self.sessions[session.token]
+        self.result_chunks.discard_owner(session.token)
+        async with session.lock:
+            await self.run_blocking(session.close)
+
+    async def reap_idle_sessions(self) -> int:
+        """
+        Close all the sessions that had no requests for longer than the idle timeout, sessions that are running
+        statements are never closed. Returns the number of sessions closed.
+        """
+        if self.session_idle_timeout is None:
+            return 0
+        deadline = monotonic() - self.session_idle_timeout
+        reaped = 0
+        for session in list(self.sessions.values()):
+            # a session might have been used (or deleted) while we closed the previous one
+            if session.last_used >= deadline or session.lock.locked() or session.token not in self.sessions:
+                continue
+            await self.close_session(session)
+            reaped += 1
+        if reaped:
+            self.metrics.reaped_sessions.inc(amount=reaped)
+        return reaped
+
+    def session_reap_interval(self) -> float:
+        """
+        Get the seconds between checks for idle sessions
+        """
+        timeout = self.session_idle_timeout
+        if timeout is None:
+            return SESSION_REAP_INTERVAL
+        return max(MIN_SESSION_REAP_INTERVAL, min(timeout, SESSION_REAP_INTERVAL))
+
+    async def _reap_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.session_reap_interval())
+            try:
+                await self.reap_idle_sessions()
+            except Exception:
+                print_exc()
+
+    async def run_blocking(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Run a blocking function (usually one that executes SQL) in the SQL executor, so that it doesn't block the
+        event loop
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.sql_executor, partial(func, *args))
 
     @class_http_endpoint(["POST"], "/session/v1/login-request")  # type: ignore[arg-type]
     async def login_request(self, request: Request) -> JSONResponse:
+        self.metrics.requests.inc("login")
         db = request.query_params.get("databaseName")
         schema = request.query_params.get("schemaName", "public")
-        session = SnowGlobeSession(self, db, schema)
+        body = await unpack_request_body(request)
+        if self._reaper is None:
+            # the reaper must run on the server's event loop, so it can only be started by a request
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_periodically())
+        if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+            await self.reap_idle_sessions()
+            if len(self.sessions) >= self.max_sessions:
+                return JSONResponse(
+                    {"success": False, "message": f"too many sessions, at most {self.max_sessions} may be live at once"}
+                )
+        # the session only connects to its database when it first runs a statement
+        session = SnowGlobeSession(self, db, schema, body.get("data", {}).get("SESSION_PARAMETERS"))
         self.sessions[session.token] = session
-        return JSONResponse({"data": {"token": session.token, "masterToken": "SwordFish"}, "success": True})
+        return JSONResponse(
+            {
+                "data": {"token": session.token, "masterToken": "SwordFish", "parameters": LOGIN_PARAMETERS},
+                "success": True,
+            }
+        )
 
     @class_http_endpoint(["POST"], "/session")  # type: ignore[arg-type]
     async def delete_session(self, request: Request) -> JSONResponse | Response:
         if request.query_params.get("delete") == "true":
-            session = self.session_from_request(request)
-            del self.sessions[session.token]
-            session.close()
+            await self.close_session(self.session_from_request(request))
             return JSONResponse({"success": True})
         return Response(status_code=404)
 
+    @contextmanager
+    def _phase(self, record: Optional[QueryRecord], phase: str) -> Iterator[None]:
+        # time a phase of a query request, both in the metrics and in the query's record
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - start
+            self.metrics.phase_seconds.observe(duration, phase)
+            if record is not None:
+                record.phases[phase] = record.phases.get(phase, 0) + duration
+
+    def _statement_results(
+        self,
+        session: SnowGlobeSession,
+        stmts: Sequence[str],
+        parameters: Parameters = None,
+        record: Optional[QueryRecord] = None,
+    ) -> Iterator[QUERY_RESPONSE]:
+        # run statements, yielding the result of each, a result is closed once the next statement runs
+        with self._phase(record, "execute"):
+            for handler, result in session.do_queries(stmts, parameters):
+                if record is not None:
+                    record.handlers.append(handler)
+                yield result
+
+    def _run_statements(
+        self,
+        session: SnowGlobeSession,
+        stmts: Sequence[str],
+        parameters: Parameters = None,
+        record: Optional[QueryRecord] = None,
+    ) -> QUERY_RESPONSE:
+        # run statements, only the last statement's result is returned
+        result = None
+        for result in self._statement_results(session, stmts, parameters, record):  # noqa: B007
+            pass
+        return result
+
+    def _run_child_statements(
+        self,
+        session: SnowGlobeSession,
+        groups: Sequence[Sequence[str]],
+        parameters: Parameters = None,
+        record: Optional[QueryRecord] = None,
+    ) -> List[str]:
+        """
+        Run the statements of a multi-statement query, each group holds the statements a single snowflake statement was
+        transpiled to. The result of each group is stored as a child query, that the connector retrieves by its id.
+        Returns the ids of the child queries.
+        """
+        group_ends = set(accumulate(len(group) for group in groups))
+        stmts = [stmt for group in groups for stmt in group]
+        child_ids = []
+        for index, result in enumerate(self._statement_results(session, stmts, parameters, record), 1):
+            if index not in group_ends:
+                continue
+            if isinstance(result, FileTransfer):
+                raise ValueError("PUT and GET commands are not supported in multi-statement queries")
+            child_id = str(uuid4())
+            self.query_results.start(child_id)
+            # storing the result consumes it, before the next statement runs
+            self.query_results.finish(child_id, result)
+            child_ids.append(child_id)
+        return child_ids
+
+    def _log_if_slow(self, session: SnowGlobeSession, record: QueryRecord, parameters: Parameters = None) -> None:
+        # add a query to the slow query log if it took too long, along with the plans of its statements. This must be
+        # called with the session's lock held, after the query's result was consumed
+        if self.slow_query_threshold is None or record.duration() < self.slow_query_threshold:
+            return
+        plans = []
+        for stmt, handler in zip(record.statements, record.handlers):
+            if handler not in EXPLAINABLE_HANDLERS or isinstance(parameters, list):
+                continue
+            try:
+                plans.append(session.explain(stmt, parameters))
+            except Exception as e:
+                plans.append(f"could not explain statement: {e}")
+        if plans:
+            record.explain = "\n\n".join(plans)
+        self.query_history.add_slow(record)
+
+    def _request_statements(
+        self, session: SnowGlobeSession, body: Dict[str, Any]
+    ) -> Tuple[Sequence[Sequence[str]], Parameters]:
+        """
+        Get the statements of a query request, along with the parameters bound to them. If the request specifies a
+        statement count, the statements are grouped by the snowflake statement they were transpiled from, otherwise
+        they are all in a single group.
+        """
+        sql_text = body["sqlText"]
+        parameters = convert_bindings(body.get("bindings"))
+        if parameters is not None:
+            sql_text = qmark_to_numeric(sql_text)
+        statement_count = session.parameter(MULTI_STATEMENT_COUNT_PARAMETER, None, body.get("parameters"))
+        if statement_count is None:
+            return [self.transpile_cache.statements(sql_text)], parameters
+        snow_statements = [stmt for stmt in split_sql_to_statements(sql_text) if stmt.strip()]
+        # a count of 0 allows any number of statements
+        if int(statement_count) not in (0, len(snow_statements)):
+            raise ValueError(
+                f"Actual statement count {len(snow_statements)} did not match the desired statement count"
+                f" {statement_count}."
+            )
+        return [self.transpile_cache.statements(stmt) for stmt in snow_statements], parameters
+
+    def _query_response_data(  # noqa: PLR0913, PLR0917
+        self,
+        session: SnowGlobeSession,
+        groups: Sequence[Sequence[str]],
+        body: Dict[str, Any],
+        chunk_destination: ChunkDestination,
+        record: QueryRecord,
+        parameters: Parameters = None,
+    ) -> Dict[str, Any]:
+        # run the statements of a synchronous query and convert its result, this blocks
+        child_ids: List[str] = []
+        result: QUERY_RESPONSE
+        if len(groups) > 1:
+            # like snowflake, a multi-statement query's own result is only a summary, the connector retrieves the
+            # result of each statement separately
+            child_ids = self._run_child_statements(session, groups, parameters, record)
+            result = QueryResult(MULTI_STATEMENT_COLUMNS, [("Multiple statements executed successfully.",)])
+        else:
+            result = self._run_statements(session, record.statements, parameters, record)
+        data: Dict[str, Any] = {
+            "finalDatabaseName": session.db,
+            "finalSchemaName": session.schema,
+            "rowtype": [],
+            "rowset": [],
+            "queryId": chunk_destination.query_id,
+        }
+        if isinstance(result, FileTransfer):
+            # the connector performs the transfer by itself, and builds the statement's result locally
+            data.update(result.response_data())
+        elif result is not None:
+            result_format = session.parameter(RESULT_FORMAT_PARAMETER, self.result_format, body.get("parameters"))
+            # streamed results are fetched as they are converted, so this phase includes fetching the rows
+            with self._phase(record, "convert"):
+                data.update(
+                    self.sql_alchemy_result_to_snowglobe_result(
+                        result, session.known_columns, result_format, chunk_destination
+                    )
+                )
+            record.row_count = data["total"]
+        if child_ids:
+            data["resultIds"] = ",".join(child_ids)
+        self._log_if_slow(session, record, parameters)
+        return data
+
     @class_http_endpoint(["POST"], "/queries/v1/query-request")  # type: ignore[arg-type]
-    async def query_request(self, request: Request) -> JSONResponse:
+    async def query_request(self, request: Request) -> Response:
+        with self.metrics.request("query"):
+            return await self._query_request(request)
+
+    async def _query_request(self, request: Request) -> Response:
+        record = QueryRecord(str(uuid4()))
+        self.query_history.add(record)
         try:
             session = self.session_from_request(request)
-            body = await unpack_request_body(request)
-            query = body["sqlText"]
-            if query.endswith(";"):
-                query = query[:-1]
-            post = snow_to_post(query)  # note that this query might well now have multiple statements, but only the
-            # last one counts
-            stmts = list(split_sql_to_statements(post))
+            with self._phase(record, "unpack"):
+                body = await unpack_request_body(request)
+            record.sql_text = body.get("sqlText", "")
+            with self._phase(record, "transpile"):
+                groups, parameters = self._request_statements(session, body)
+            record.statements = stmts = [stmt for group in groups for stmt in group]
             if not stmts:
+                record.fail("no query provided")
                 return JSONResponse({"success": False, "message": "no query provided"})
-            result = None
-            for stmt in stmts:
-                result = session.do_query(stmt)
-            query_id = str(uuid4())
-            data: dict = {
+            query_id = record.query_id
+            if body.get("asyncExec", False):
+                # we return right away, the connector polls the query's status and retrieves its result when it's done
+                self.query_results.start(query_id)
+                task = asyncio.create_task(self._run_async_query(session, groups, record, parameters))
+                self._async_tasks.add(task)
+                task.add_done_callback(self._async_tasks.discard)
+                data: Dict[str, Any] = {
+                    "finalDatabaseName": session.db,
+                    "finalSchemaName": session.schema,
+                    "rowtype": [],
+                    "rowset": [],
+                    "queryId": query_id,
+                }
+                return JSONResponse({"data": data, "success": True})
+            async with session.lock:
+                data = await self.run_blocking(
+                    self._query_response_data,
+                    session,
+                    groups,
+                    body,
+                    ChunkDestination(session.token, query_id, str(request.base_url)),
+                    record,
+                    parameters,
+                )
+            # large responses take a while to encode and compress, so we do it in the executor as well
+            response = await self.run_blocking(
+                partial(self.encode_response, gzip_allowed=accepts_gzip(request), record=record),
+                {"data": data, "success": True},
+            )
+            record.response_bytes = len(response.body)
+            record.finish()
+            return response
+        except Exception as e:
+            self.metrics.failed_queries.inc()
+            record.fail(str(e))
+            print_exc()  # we print exec here because the connector + webservice combo doesn't always do a good job of
+            # telling us what the error is (or that it's happening)
+            return JSONResponse({"success": False, "message": str(e)})
+
+    async def _run_async_query(
+        self,
+        session: SnowGlobeSession,
+        groups: Sequence[Sequence[str]],
+        record: QueryRecord,
+        parameters: Parameters = None,
+    ) -> None:
+        try:
+            async with session.lock:
+                result: QUERY_RESPONSE
+                if len(groups) > 1:
+                    child_ids = await self.run_blocking(self._run_child_statements, session, groups, parameters, record)
+                    query = self.query_results.get(record.query_id)
+                    if query is not None:
+                        query.child_ids = child_ids
+                    result = QueryResult(MULTI_STATEMENT_COLUMNS, [("Multiple statements executed successfully.",)])
+                else:
+                    result = await self.run_blocking(
+                        self._run_statements, session, record.statements, parameters, record
+                    )
+                # storing the result fetches its streamed rows from the session's connection, and compresses them
+                with self._phase(record, "store"):
+                    record.row_count = await self.run_blocking(self.query_results.finish, record.query_id, result)
+                record.finish()
+                await self.run_blocking(self._log_if_slow, session, record, parameters)
+        except Exception as e:
+            self.metrics.failed_queries.inc()
+            record.fail(str(e))
+            print_exc()
+            self.query_results.fail(record.query_id, str(e))
+
+    def _stored_result_data(
+        self,
+        session: SnowGlobeSession,
+        result: QueryResult,
+        result_format: str,
+        chunk_destination: ChunkDestination,
+    ) -> Dict[str, Any]:
+        # convert a stored result, this blocks (loading the known columns might query the database)
+        return self.sql_alchemy_result_to_snowglobe_result(
+            result, session.known_columns, result_format, chunk_destination
+        )
+
+    @class_http_endpoint(["GET"], "/queries/{query_id:str}/result")  # type: ignore[arg-type]
+    async def query_result(self, request: Request) -> Response:
+        # the result of a stored query, the connector retrieves the results of multi-statement queries' children here
+        self.metrics.requests.inc("result")
+        try:
+            session = self.session_from_request(request)
+            query_id = request.path_params["query_id"]
+            try:
+                result = self.query_results.result(query_id)
+            except KeyError:
+                return JSONResponse({"success": False, "message": f"query {query_id} not found"})
+            data: Dict[str, Any] = {
                 "finalDatabaseName": session.db,
                 "finalSchemaName": session.schema,
                 "rowtype": [],
                 "rowset": [],
                 "queryId": query_id,
             }
-            if body.get("asyncExec", False):
-                # we should store the result in the server for when it gets retrieved
-                self.query_results[query_id] = result
-            if not result:
-                return JSONResponse({"data": data, "success": True})
-            data.update(self.sql_alchemy_result_to_snowglobe_result(result, session.known_columns))
-            return JSONResponse({"data": data, "success": True})
+            if isinstance(result, QueryResult):
+                result_format = session.parameter(RESULT_FORMAT_PARAMETER, self.result_format)
+                async with session.lock:
+                    data.update(
+                        await self.run_blocking(
+                            self._stored_result_data,
+                            session,
+                            result,
+                            result_format,
+                            ChunkDestination(session.token, query_id, str(request.base_url)),
+                        )
+                    )
+            query = self.query_results.get(query_id)
+            if query is not None and query.child_ids:
+                data["resultIds"] = ",".join(query.child_ids)
+            return await self.run_blocking(
+                partial(self.encode_response, gzip_allowed=accepts_gzip(request)), {"data": data, "success": True}
+            )
         except Exception as e:
-            print_exc()  # we print exec here because the connector + webservice combo doesn't always do a good job of
-            # telling us what the error is (or that it's happening)
+            print_exc()
             return JSONResponse({"success": False, "message": str(e)})
 
+    @class_http_endpoint(["GET"], "/chunks/{query_id:str}/{chunk_index:int}")  # type: ignore[arg-type]
+    async def result_chunk(self, request: Request) -> Response:
+        self.metrics.requests.inc("chunk")
+        chunk = await self.result_chunks.pop(f"{request.path_params['query_id']}/{request.path_params['chunk_index']}")
+        if chunk is None:
+            return Response(status_code=404)
+        return Response(chunk, headers={"Content-Encoding": "gzip"})
+
+    @class_http_endpoint(["GET"], "/metrics")  # type: ignore[arg-type]
+    async def metrics_endpoint(self, request: Request) -> Response:
+        return Response(self.metrics.render(), media_type=CONTENT_TYPE)
+
+    @class_http_endpoint(["GET"], "/monitoring/queries")  # type: ignore[arg-type]
+    async def query_monitoring_history(self, request: Request) -> JSONResponse:
+        # the most recent queries, newest first, "slow=true" returns only the slow queries
+        slow = request.query_params.get("slow", "").lower() == "true"
+        limit = request.query_params.get("limit")
+        records = self.query_history.recent(int(limit) if limit else None, slow=slow)
+        return JSONResponse({"data": {"queries": [record.to_json() for record in records]}, "success": True})
+
     @class_http_endpoint(["GET"], "/monitoring/queries/{query_id:str}")  # type: ignore[arg-type]
     async def query_monitoring_query(self, request: Request) -> JSONResponse:
         query_id = request.path_params["query_id"]
-        if query_id not in self.query_results:
+        record = self.query_history.get(query_id)
+        if record is not None:
+            return JSONResponse({"data": {"queries": [record.to_json()]}, "success": True})
+        # the query might have been evicted from the history, while its result is still stored
+        async_query = self.query_results.get(query_id)
+        if async_query is None:
             return JSONResponse({"success": False, "message": "query not found"})
-        # note that we always execute synchronously, so we can just return a static success
-        return JSONResponse({"data": {"queries": [{"status": "SUCCESS"}]}, "success": True})
+        end_time = async_query.end_time if async_query.end_time is not None else time()
+        query: Dict[str, Any] = {
+            "id": query_id,
+            "status": async_query.status,
+            # times are in milliseconds, like in snowflake
+            "startTime": int(async_query.start_time * 1000),
+            "totalDuration": int((end_time - async_query.start_time) * 1000),
+        }
+        if async_query.end_time is not None:
+            query["endTime"] = int(async_query.end_time * 1000)
+        if async_query.error_message is not None:
+            query["errorMessage"] = async_query.error_message
+        return JSONResponse({"data": {"queries": [query]}, "success": True})
+
+    def stop(self):
+        super().stop()
+        self.sql_executor.shutdown(wait=True)
+        self._reaper = None  # the reaper was cancelled along with the server's event loop
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+        self.engines.dispose()
+        self.result_chunks.close()
+        self.stage.close()
+        self.query_results.close()
+        if self.transpile_cache.path is not None:
+            self.transpile_cache.save()
@@ -0,0 +1,171 @@
+"""
+Encodes query results as an arrow IPC stream, so that the connector can read them with its arrow result format.
+This requires pyarrow to be installed (use the "arrow" extra), without it only the json result format is available.
+"""
+
+from __future__ import annotations
+
+from base64 import b64encode
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+from json import dumps
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover
+    pa = pc = None
+
+ARROW_RESULT_FORMAT = "arrow"
+JSON_RESULT_FORMAT = "json"
+
+TIMESTAMP_SCALE = 6  # timestamps are sent as microseconds since epoch, which is the most python datetimes can hold
+_MICROS_PER_SECOND = 1_000_000
+# snowflake sends the offset of a TIMESTAMP_TZ as minutes, shifted to be positive
+TIMEZONE_OFFSET_SHIFT = 1440
+_MINUTE = timedelta(minutes=1)
+
+
+def arrow_available() -> bool:
+    return pa is not None
+
+
+def decimal_scale(values: Sequence[Any]) -> int:
+    """
+    The largest scale of a column of decimals
+    """
+    scale = 0
+    for v in values:
+        if v is not None:
+            exponent = v.as_tuple().exponent
+            if isinstance(exponent, int):
+                scale = max(scale, -exponent)
+    return scale
+
+
+def _encode_number(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    if any(isinstance(v, Decimal) for v in values):
+        scale = decimal_scale(values)
+        return pa.array(values, pa.decimal128(38, scale)), {
+            "logicalType": "FIXED",
+            "precision": "38",
+            "scale": str(scale),
+        }
+    return pa.array(values, pa.int64()), {"logicalType": "FIXED", "precision": "38", "scale": "0"}
+
+
+def _encode_float(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    return pa.array(values, pa.float64()), {"logicalType": "REAL"}
+
+
+def _encode_text(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    return pa.array(values, pa.string()), {"logicalType": "TEXT"}
+
+
+def _encode_boolean(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    return pa.array(values, pa.bool_()), {"logicalType": "BOOLEAN"}
+
+
+def _encode_date(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    return pa.array(values, pa.date32()), {"logicalType": "DATE"}
+
+
+def _encode_time(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    return pa.array(values, pa.time64("us")).cast(pa.int64()), {"logicalType": "TIME", "scale": str(TIMESTAMP_SCALE)}
+
+
+def _epoch_micros(values: Sequence[Any]) -> Any:
+    # naive datetimes are taken as utc, and aware ones are converted to it
+    return pa.array(values, pa.timestamp("us")).cast(pa.int64())
+
+
+def _encode_timestamp_ntz(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    return _epoch_micros(values), {"logicalType": "TIMESTAMP_NTZ", "scale": str(TIMESTAMP_SCALE)}
+
+
+def _encode_timestamp_ltz(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    return _epoch_micros(values), {"logicalType": "TIMESTAMP_LTZ", "scale": str(TIMESTAMP_SCALE)}
+
+
+def _encode_timestamp_tz(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    # the connector reads a TIMESTAMP_TZ as a struct of the epoch seconds, the fraction in nanoseconds, and the
+    # offset in minutes
+    micros = _epoch_micros(values)
+    # integer division rounds toward zero, the fraction of negative timestamps must be positive
+    seconds = pc.divide(micros, _MICROS_PER_SECOND)
+    remainder = pc.subtract(micros, pc.multiply(seconds, _MICROS_PER_SECOND))
+    negative = pc.less(remainder, 0)
+    epoch = pc.if_else(negative, pc.subtract(seconds, 1), seconds)
+    remainder = pc.if_else(negative, pc.add(remainder, _MICROS_PER_SECOND), remainder)
+    fraction = pc.multiply(remainder, 1000).cast(pa.int32())
+    offsets = pa.array(
+        [None if v is None else v.utcoffset() // _MINUTE + TIMEZONE_OFFSET_SHIFT for v in values], pa.int32()
+    )
+    array = pa.StructArray.from_arrays(
+        [epoch, fraction, offsets], ["epoch", "fraction", "timezone"], mask=pc.is_null(micros)
+    )
+    return array, {"logicalType": "TIMESTAMP_TZ", "scale": "9"}
+
+
+def _encode_binary(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    # postgresql returns binary values as memoryviews
+    return pa.array([None if v is None else bytes(v) for v in values], pa.binary()), {"logicalType": "BINARY"}
+
+
+def _encode_semi_structured(values: Sequence[Any], logical_type: str) -> Tuple[Any, Dict[str, str]]:
+    # semi-structured values are sent as their json text, same as snowflake does
+    return pa.array([None if v is None else dumps(v, default=str) for v in values], pa.string()), {
+        "logicalType": logical_type
+    }
+
+
+def _encode_object(values: Sequence[Any]) -> Tuple[Any, Dict[str, str]]:
+    return _encode_semi_structured(values, "OBJECT")
+
+
+# maps the name of a SnowType to the function that encodes a column of its values
+ARROW_ENCODERS: Dict[str, Callable[[Sequence[Any]], Tuple[Any, Dict[str, str]]]] = {
+    "NUMBER": _encode_number,
+    "FLOAT": _encode_float,
+    "TEXT": _encode_text,
+    "BOOLEAN": _encode_boolean,
+    "DATE": _encode_date,
+    "TIME": _encode_time,
+    "TIMESTAMP_NTZ": _encode_timestamp_ntz,
+    "TIMESTAMP_LTZ": _encode_timestamp_ltz,
+    "TIMESTAMP_TZ": _encode_timestamp_tz,
+    "BINARY": _encode_binary,
+    "VARIANT": partial(_encode_semi_structured, logical_type="VARIANT"),
+    "ARRAY": partial(_encode_semi_structured, logical_type="ARRAY"),
+    "OBJECT": _encode_object,
+}
+
+
+def rows_to_arrow_stream(
+    column_names: Sequence[str], type_names: Sequence[str], rows: Sequence[Sequence[Any]]
+) -> bytes:
+    """
+    Encode a result as an arrow IPC stream, in the form the connector expects in a downloaded result chunk
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for the arrow result format, install yellowbox-snowglobe[arrow]")
+    arrays: List[Any] = []
+    fields: List[Any] = []
+    for i, name in enumerate(column_names):
+        array, metadata = ARROW_ENCODERS[type_names[i]]([row[i] for row in rows])
+        arrays.append(array)
+        fields.append(pa.field(name, array.type, nullable=True, metadata=metadata))
+    batch = pa.RecordBatch.from_arrays(arrays, schema=pa.schema(fields))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def rows_to_arrow_base64(column_names: Sequence[str], type_names: Sequence[str], rows: Sequence[Sequence[Any]]) -> str:
+    """
+    Encode a result as a base64 arrow IPC stream, in the form the connector expects in a "rowsetBase64" field
+    """
+    return b64encode(rows_to_arrow_stream(column_names, type_names, rows)).decode("ascii")
@@ -0,0 +1,122 @@
+"""
+Converts the bindings the connector sends for the "qmark" and "numeric" paramstyles to sqlalchemy parameters.
+The connector sends each binding as a snowflake type and a string value (or a list of string values, for array
+bindings from executemany), keyed by the binding's 1-based position.
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Mapping, Optional, Union
+
+from yellowbox_snowglobe.snow_to_post import Opaque, tokenize
+
+# a single set of parameters, or a list of them to execute the statement with each of (for array bindings)
+Parameters = Optional[Union[Dict[str, Any], List[Dict[str, Any]]]]
+
+_EPOCH = datetime(1970, 1, 1)
+_UTC_EPOCH = _EPOCH.replace(tzinfo=timezone.utc)
+
+
+def _fixed(value: str) -> Union[int, Decimal]:
+    if "." in value or "e" in value.lower():
+        return Decimal(value)
+    return int(value)
+
+
+def _boolean(value: str) -> bool:
+    return value.lower() in ("true", "1")
+
+
+def _date(value: str) -> date:
+    # milliseconds since epoch
+    return (_EPOCH + timedelta(milliseconds=int(value))).date()
+
+
+def _time(value: str) -> time:
+    # nanoseconds since midnight
+    return (_EPOCH + timedelta(microseconds=int(value) // 1000)).time()
+
+
+def _timestamp_ntz(value: str) -> datetime:
+    # nanoseconds since epoch
+    return _EPOCH + timedelta(microseconds=int(value) // 1000)
+
+
+def _timestamp_ltz(value: str) -> datetime:
+    # nanoseconds since epoch, in utc
+    return _UTC_EPOCH + timedelta(microseconds=int(value) // 1000)
+
+
+def _timestamp_tz(value: str) -> datetime:
+    # nanoseconds since epoch, followed by the utc offset in minutes plus 1440
+    nanoseconds, _, offset = value.partition(" ")
+    tz = timezone(timedelta(minutes=int(offset) - 1440)) if offset else timezone.utc
+    return _timestamp_ltz(nanoseconds).astimezone(tz)
+
+
+# maps the snowflake type of a binding to the function that converts its string value to a python value, types that
+# aren't here are passed as strings
+BINDING_CONVERTERS: Dict[str, Callable[[str], Any]] = {
+    "FIXED": _fixed,
+    "REAL": float,
+    "BOOLEAN": _boolean,
+    "DATE": _date,
+    "TIME": _time,
+    "TIMESTAMP_NTZ": _timestamp_ntz,
+    "TIMESTAMP_LTZ": _timestamp_ltz,
+    "TIMESTAMP_TZ": _timestamp_tz,
+    "TIMESTAMP": _timestamp_ntz,
+    "BINARY": bytes.fromhex,
+}
+
+
+def _convert_value(snowflake_type: str, value: Optional[str]) -> Any:
+    if value is None:
+        return None
+    converter = BINDING_CONVERTERS.get(snowflake_type.upper())
+    if converter is None:
+        return value
+    return converter(value)
+
+
+def convert_bindings(bindings: Optional[Mapping[str, Mapping[str, Any]]]) -> Parameters:
+    """
+    Convert the bindings of a query request to sqlalchemy parameters, named by their position. Array bindings are
+    converted to a list of parameters, one for each row.
+    """
+    if not bindings:
+        return None
+    columns: Dict[str, List[Any]] = {}
+    params: Dict[str, Any] = {}
+    for name, binding in bindings.items():
+        value = binding.get("value")
+        snowflake_type = binding.get("type", "TEXT")
+        if isinstance(value, list):
+            columns[name] = [_convert_value(snowflake_type, v) for v in value]
+        else:
+            params[name] = _convert_value(snowflake_type, value)
+    if not columns:
+        return params
+    row_count = max(len(column) for column in columns.values())
+    return [{**params, **{name: column[i] for name, column in columns.items()}} for i in range(row_count)]
+
+
+def qmark_to_numeric(query: str) -> str:
+    """
+    Replace the "?" placeholders of a query with numeric placeholders (":1", ":2", ...), which sqlalchemy understands
+    """
+    parts = []
+    next_index = 1
+    for token in tokenize(query):
+        if isinstance(token, Opaque):
+            parts.append(token.value)
+            continue
+        pieces = token.split("?")
+        parts.append(pieces[0])
+        for piece in pieces[1:]:
+            parts.append(f":{next_index}")
+            parts.append(piece)
+            next_index += 1
+    return "".join(parts)
@@ -0,0 +1,131 @@
+"""
+Keeps track of the column names in a database, so that case modes can tell whether a result column is a real column.
+A catalog is shared by all the sessions on the same database, and is only updated by DDL statements.
+"""
+
+from __future__ import annotations
+
+import re
+from collections import Counter
+from threading import Lock
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# a part of a name, either a plain identifier or a quoted one
+NAME_PART = r'(?:[a-z_][a-z0-9_$]*|"(?:[^"]|"")+")'
+NAME_PART_PATTERN = re.compile("(?i)" + NAME_PART)
+# matches DDL statements that affect the columns of a single table (or view), capturing its (possibly qualified) name
+DDL_TABLE_PATTERN = re.compile(
+    r"(?i)^\s*(create|alter|drop)\s+(?:or\s+replace\s+)?(?:temp(?:orary)?\s+)?(?:table|(?:materialized\s+)?view)\s+"
+    rf"(?:if\s+(?:not\s+)?exists\s+)?((?:{NAME_PART}\.){{0,2}}{NAME_PART})(?![a-z0-9_$.\"])"
+)
+# matches DDL statements that create objects other than tables and views, these don't affect the columns of any table
+NON_TABLE_DDL_PATTERN = re.compile(
+    r"(?i)^\s*create\s+(?:or\s+replace\s+)?(?:unique\s+)?"
+    r"(?:schema|index|sequence|function|procedure|domain|type|extension|trigger|role|user)\b"
+)
+
+# DDL statements that might affect tables other than the one they name
+MULTI_TABLE_DDL_PATTERN = re.compile(r"(?i)\b(rename\s+to|cascade)\b")
+
+TableKey = Tuple[str, str]  # (schema, table)
+
+
+def ddl_table(query: str, default_schema: str) -> Optional[Tuple[str, TableKey]]:
+    """
+    Get the verb of a DDL statement and the table it affects, or None if the statement might affect any table
+    """
+    match = DDL_TABLE_PATTERN.match(query)
+    if not match or MULTI_TABLE_DDL_PATTERN.search(query):
+        return None
+    verb, name = match.groups()
+    # unquoted names are folded to lowercase by postgresql, quoted names keep their case
+    parts = [
+        part[1:-1].replace('""', '"') if part.startswith('"') else part.lower()
+        for part in NAME_PART_PATTERN.findall(name)
+    ]
+    schema = parts[-2] if len(parts) > 1 else default_schema.lower()
+    return verb.lower(), (schema, parts[-1])
+
+
+class ColumnCatalog:
+    def __init__(self) -> None:
+        self._tables: Dict[TableKey, Tuple[str, ...]] = {}
+        self._column_counts: Counter[str] = Counter()  # how many tables have a column with each name
+        self._loaded = False
+        self._lock = Lock()
+
+    def __contains__(self, column_name: object) -> bool:
+        return isinstance(column_name, str) and self._column_counts[column_name] > 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _set_table(self, key: TableKey, columns: Iterable[str]) -> None:
+        old_columns = self._tables.pop(key, ())
+        self._column_counts.subtract(old_columns)
+        new_columns = tuple(columns)
+        if new_columns:
+            self._tables[key] = new_columns
+            self._column_counts.update(new_columns)
+
+    def refresh(self, connection: Connection) -> None:
+        """
+        Reload the columns of all the tables in the database
+        """
+        result = connection.execute(
+            text(
+                "select table_schema, table_name, column_name from information_schema.columns c"
+                " where c.table_schema <> 'pg_catalog' AND c.table_schema <> 'information_schema'"
+            )
+        )
+        tables: Dict[TableKey, Set[str]] = {}
+        for schema, table, column in result:
+            tables.setdefault((schema, table), set()).add(column)
+        with self._lock:
+            self._tables.clear()
+            self._column_counts.clear()
+            for key, columns in tables.items():
+                self._set_table(key, columns)
+            self._loaded = True
+
+    def refresh_table(self, connection: Connection, key: TableKey) -> None:
+        """
+        Reload the columns of a single table, a table that no longer exists is removed
+        """
+        schema, table = key
+        result = connection.execute(
+            text(
+                "select column_name from information_schema.columns c where c.table_schema = :s AND c.table_name = :t"
+            ),
+            {"s": schema, "t": table},
+        )
+        columns = result.scalars().all()
+        with self._lock:
+            self._set_table(key, columns)
+
+    def drop_table(self, key: TableKey) -> None:
+        with self._lock:
+            self._set_table(key, ())
+
+    def update_after_ddl(self, connection: Connection, query: str, default_schema: str) -> None:
+        """
+        Update the catalog after a DDL statement was executed
+        """
+        if NON_TABLE_DDL_PATTERN.match(query):
+            return
+        if not self._loaded:
+            self.refresh(connection)
+            return
+        affected = ddl_table(query, default_schema)
+        if affected is None:
+            self.refresh(connection)
+            return
+        verb, key = affected
+        if verb == "drop":
+            self.drop_table(key)
+        else:
+            self.refresh_table(connection, key)
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.pool import NullPool, QueuePool
+from yellowbox.extras.postgresql import PostgreSQLService
+
+DEFAULT_POOL_SIZE = 5
+# sessions keep their connection for as long as they are connected, so by default the pools don't limit the number of
+# connected sessions, idle connections beyond the pool size are closed when they are returned
+DEFAULT_MAX_OVERFLOW = -1
+# psycopg2 runs executemany as one round trip per row, in this mode sqlalchemy sends array bindings in pages of
+# statements instead (with psycopg2's execute_batch)
+EXECUTEMANY_MODE = "values_plus_batch"
+
+# new databases are created as copies of this database, so that they come with the snowglobe shims already installed
+TEMPLATE_DATABASE_NAME = "snowglobe_template"
+SNAPSHOT_DATABASE_PREFIX = "snowglobe_snapshot"
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def snapshot_database_name(db_name: str, snapshot_name: str) -> str:
+    # the name of the database that holds a snapshot of another database
+    return f"{SNAPSHOT_DATABASE_PREFIX}_{db_name}_{snapshot_name}"
+
+
+def reset_session_state(dbapi_connection: Any, connection_record: Any) -> None:
+    """
+    Reset the settings of a connection returned to its pool (like the search_path set by "USE SCHEMA"), so that they
+    don't carry over to the next session that checks it out
+    """
+    if dbapi_connection is None:  # the connection was invalidated
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("RESET ALL")
+    finally:
+        cursor.close()
+    dbapi_connection.commit()
+
+
+class EngineRegistry:
+    """
+    Holds a single pooled engine for every database, so that sessions check connections out of a shared pool rather
+    than each opening (and later disposing) their own.
+    If a template initializer is provided, missing databases are created from a template database that the initializer
+    is run on once, rather than being created empty.
+    """
+
+    def __init__(
+        self,
+        sql_service: PostgreSQLService,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_overflow: int = DEFAULT_MAX_OVERFLOW,
+        template_initializer: Optional[Callable[[Connection], None]] = None,
+    ):
+        self.sql_service = sql_service
+        self.pool_size = pool_size  # the number of connections each database's pool keeps open
+        # the number of connections each pool may open beyond its pool size, -1 for no limit
+        self.max_overflow = max_overflow
+        self.template_initializer = template_initializer
+        self.templated_databases: Set[str] = set()  # all the databases we created from the template
+        self._engines: Dict[str, Engine] = {}
+        self._admin_engine: Optional[Engine] = None  # used to create databases, connected to the default database
+        self._template_ready = False
+        self._lock = Lock()
+
+    def engine(self, db_name: str) -> Engine:
+        """
+        Get the engine of a database, creating the database and the engine if needed
+        """
+        engine = self._engines.get(db_name)
+        if engine is not None:
+            return engine
+        with self._lock:
+            engine = self._engines.get(db_name)
+            if engine is None:
+                if self.template_initializer is None:
+                    conn_string = self.sql_service.database(db_name).local_connection_string()
+                else:
+                    self._ensure_database(db_name)
+                    conn_string = self.sql_service.local_connection_string(database=db_name)
+                engine = create_engine(
+                    conn_string,
+                    pool_size=self.pool_size,
+                    max_overflow=self.max_overflow,
+                    executemany_mode=EXECUTEMANY_MODE,
+                )
+                event.listen(engine, "checkin", reset_session_state)
+                self._engines[db_name] = engine
+            return engine
+
+    def _admin(self) -> Engine:
+        if self._admin_engine is None:
+            self._admin_engine = create_engine(
+                self.sql_service.local_connection_string(database=self.sql_service.default_database),
+                isolation_level="AUTOCOMMIT",
+                poolclass=NullPool,
+            )
+        return self._admin_engine
+
+    def _database_exists(self, connection: Connection, db_name: str) -> bool:
+        return bool(
+            connection.execute(
+                text("SELECT EXISTS(SELECT FROM pg_database WHERE datname = :name)"), {"name": db_name}
+            ).scalar()
+        )
+
+    def _ensure_template(self, connection: Connection) -> None:
+        if self._template_ready:
+            return
+        assert self.template_initializer is not None
+        if not self._database_exists(connection, TEMPLATE_DATABASE_NAME):
+            connection.execute(text(f"CREATE DATABASE {quote_identifier(TEMPLATE_DATABASE_NAME)}"))
+            # postgresql won't copy a template that has open connections, so we don't pool them
+            template_engine = create_engine(
+                self.sql_service.local_connection_string(database=TEMPLATE_DATABASE_NAME), poolclass=NullPool
+            )
+            try:
+                with template_engine.begin() as template_connection:
+                    self.template_initializer(template_connection)
+            except Exception:
+                connection.execute(text(f"DROP DATABASE {quote_identifier(TEMPLATE_DATABASE_NAME)}"))
+                raise
+            finally:
+                template_engine.dispose()
+        self._template_ready = True
+
+    def _ensure_database(self, db_name: str) -> None:
+        with self._admin().connect() as connection:
+            if self._database_exists(connection, db_name):
+                return
+            self._ensure_template(connection)
+            connection.execute(
+                text(f"CREATE DATABASE {quote_identifier(db_name)} TEMPLATE {quote_identifier(TEMPLATE_DATABASE_NAME)}")
+            )
+            self.templated_databases.add(db_name)
+
+    def dispose_engine(self, db_name: str) -> None:
+        """
+        Close all the pooled connections of a database, and forget its engine
+        """
+        with self._lock:
+            engine = self._engines.pop(db_name, None)
+        if engine is not None:
+            engine.dispose()
+
+    def clone_database(self, source: str, target: str) -> None:
+        """
+        Replace a database with a copy of another. Postgresql can only copy a database that no one is connected to, so
+        the pools of both databases are disposed, any connection checked out of them will make this fail.
+        """
+        self.dispose_engine(source)
+        self.dispose_engine(target)
+        with self._admin().connect() as connection:
+            connection.execute(text(f"DROP DATABASE IF EXISTS {quote_identifier(target)}"))
+            connection.execute(text(f"CREATE DATABASE {quote_identifier(target)} TEMPLATE {quote_identifier(source)}"))
+
+    def drop_database(self, db_name: str) -> None:
+        self.dispose_engine(db_name)
+        with self._admin().connect() as connection:
+            connection.execute(text(f"DROP DATABASE IF EXISTS {quote_identifier(db_name)}"))
+
+    def pool_status(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Get the number of checked out and idle connections in the pool of each database
+        """
+        with self._lock:
+            engines = list(self._engines.items())
+        return {
+            db_name: (engine.pool.checkedout(), engine.pool.checkedin())
+            for db_name, engine in engines
+            if isinstance(engine.pool, QueuePool)
+        }
+
+    def __len__(self) -> int:
+        return len(self._engines)
+
+    def dispose(self) -> None:
+        """
+        Close all the pooled connections of all the databases
+        """
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+            if self._admin_engine is not None:
+                engines.append(self._admin_engine)
+                self._admin_engine = None
+        for engine in engines:
+            engine.dispose()
@@ -0,0 +1,33 @@
+"""
+Encodes and decodes the json bodies of requests and responses. orjson is used if it is installed, since it is much
+faster than the standard library, especially for large rowsets.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Encode a value as compact json
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            # orjson is stricter than the standard library (for example, it rejects integers beyond 64 bits)
+            pass
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,127 @@
+"""
+Converts query results to the values the connector expects in a json rowset. Values are converted a whole column at a
+time (with pyarrow's compute functions if it is installed, or with precomputed tables), rather than with a python call
+per value, since that is the slowest part of fetching large results.
+"""
+
+from __future__ import annotations
+
+import json
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, List, Optional, Sequence
+
+from yellowbox_snowglobe.arrow_format import TIMESTAMP_SCALE, TIMEZONE_OFFSET_SHIFT
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover
+    pa = pc = None
+
+_MICROS_PER_SECOND = 1_000_000
+_MICROSECOND = timedelta(microseconds=1)
+_MINUTE = timedelta(minutes=1)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NAIVE_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+_BOOLEAN_STRINGS = {True: "1", False: "0", None: None}
+
+ColumnConverter = Callable[[Sequence[Any]], Sequence[Any]]
+
+
+def _format_micros(micros: int) -> str:
+    # snowflake rounds the fraction toward zero and puts the sign in front, so -1.5 seconds is "-1.500000"
+    if micros < 0:
+        return "-%d.%06d" % divmod(-micros, _MICROS_PER_SECOND)
+    return "%d.%06d" % divmod(micros, _MICROS_PER_SECOND)
+
+
+def _format_micros_array(micros: Any) -> List[Optional[str]]:
+    magnitude = pc.abs(micros)
+    seconds = pc.divide(magnitude, _MICROS_PER_SECOND)  # integer division of non-negative values
+    fraction = pc.subtract(magnitude, pc.multiply(seconds, _MICROS_PER_SECOND))
+    text = pc.binary_join_element_wise(
+        seconds.cast(pa.string()), pc.utf8_lpad(fraction.cast(pa.string()), TIMESTAMP_SCALE, "0"), "."
+    )
+    return pc.if_else(pc.less(micros, 0), pc.binary_join_element_wise("-", text, ""), text).to_pylist()
+
+
+def _decimal_seconds(
+    values: Sequence[Any], arrow_type: Callable[[], Any], to_micros: Callable[[Any], int]
+) -> List[Optional[str]]:
+    """
+    Format a column of times or timestamps as decimal seconds, the rowtype of the column must have the same scale,
+    since the connector parses the fraction by it
+    """
+    if pa is not None:
+        return _format_micros_array(pa.array(values, arrow_type()).cast(pa.int64()))
+    return [None if v is None else _format_micros(to_micros(v)) for v in values]
+
+
+def _time_micros(value: Any) -> int:
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * _MICROS_PER_SECOND + value.microsecond
+
+
+def convert_number(values: Sequence[Any]) -> List[Optional[str]]:
+    # decimals are sent as text so they don't lose precision
+    return [None if v is None else str(v) for v in values]
+
+
+def convert_boolean(values: Sequence[Any]) -> List[Optional[str]]:
+    return list(map(_BOOLEAN_STRINGS.__getitem__, values))
+
+
+def convert_date(values: Sequence[Any]) -> List[Optional[str]]:
+    # dates are sent as days since epoch
+    if pa is not None:
+        return pa.array(values, pa.date32()).cast(pa.int32()).cast(pa.string()).to_pylist()
+    return [None if v is None else str(v.toordinal() - _EPOCH_ORDINAL) for v in values]
+
+
+def convert_time(values: Sequence[Any]) -> List[Optional[str]]:
+    return _decimal_seconds(values, lambda: pa.time64("us"), _time_micros)
+
+
+def convert_timestamp_ntz(values: Sequence[Any]) -> List[Optional[str]]:
+    return _decimal_seconds(values, lambda: pa.timestamp("us"), lambda v: (v - _NAIVE_EPOCH) // _MICROSECOND)
+
+
+def convert_timestamp_ltz(values: Sequence[Any]) -> List[Optional[str]]:
+    # pyarrow converts aware datetimes to utc
+    return _decimal_seconds(values, lambda: pa.timestamp("us"), lambda v: (v - _EPOCH) // _MICROSECOND)
+
+
+def convert_timestamp_tz(values: Sequence[Any]) -> List[Optional[str]]:
+    # the epoch seconds, followed by the offset of the value's timezone
+    epochs = convert_timestamp_ltz(values)
+    return [
+        None if v is None else f"{epoch} {v.utcoffset() // _MINUTE + TIMEZONE_OFFSET_SHIFT}"
+        for v, epoch in zip(values, epochs)
+    ]
+
+
+def convert_binary(values: Sequence[Any]) -> List[Optional[str]]:
+    # postgresql returns binary values as memoryviews
+    return [None if v is None else bytes(v).hex().upper() for v in values]
+
+
+def convert_semi_structured(values: Sequence[Any]) -> List[Optional[str]]:
+    # semi-structured values are sent as their json text, same as snowflake does
+    return [None if v is None else json.dumps(v, default=str) for v in values]
+
+
+def rows_to_json_rowset(
+    converters: Sequence[Optional[ColumnConverter]], rows: Sequence[Sequence[Any]]
+) -> List[List[Any]]:
+    """
+    Convert the rows of a result to a json rowset, in the form the connector expects in a "rowset" field. Each column
+    is converted by its converter, columns without a converter are sent as they are.
+    """
+    if not rows or not any(converters):
+        return [list(row) for row in rows]
+    columns: List[Sequence[Any]] = list(zip(*rows))
+    for i, converter in enumerate(converters):
+        if converter is not None:
+            columns[i] = converter(columns[i])
+    return [list(row) for row in zip(*columns)]
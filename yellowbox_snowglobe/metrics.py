@@ -0,0 +1,197 @@
+"""
+A minimal metrics registry, rendered in the prometheus text exposition format. We implement it ourselves rather than
+depend on prometheus_client, since we only need counters, histograms and gauges that are computed when scraped.
+"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, TypeVar
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# in seconds, most phases of a local query take between a fraction of a millisecond and a few seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+Labels = Tuple[str, ...]
+M = TypeVar("M", bound="Metric")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    type_name: str
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = Lock()
+
+    @abstractmethod
+    def samples(self) -> Iterator[Tuple[str, Labels, Sequence[str], float]]:
+        """
+        Yield the metric's samples, as (name suffix, label values, extra label names and values, value)
+        """
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, label_values, extra_labels, value in self.samples():
+            names = self.label_names + tuple(extra_labels[::2])
+            values = label_values + tuple(extra_labels[1::2])
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[Tuple[str, Labels, Sequence[str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield "_total", labels, (), value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # for every set of labels, the (non-cumulative) count of each bucket (the last is +Inf), and the sum
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._sums[labels] = self._sums.get(labels, 0) + value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """
+        Observe the duration of a block, in seconds
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *labels)
+
+    def count(self, *labels: str) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def samples(self) -> Iterator[Tuple[str, Labels, Sequence[str], float]]:
+        with self._lock:
+            entries = [(labels, list(counts), self._sums[labels]) for labels, counts in self._counts.items()]
+        for labels, counts, total in entries:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                yield "_bucket", labels, ("le", _format_value(bound)), cumulative
+            yield "_sum", labels, (), total
+            yield "_count", labels, (), cumulative
+
+
+class Gauge(Metric):
+    """
+    A gauge whose values are computed when the metrics are rendered, the function returns the value for every set of
+    labels
+    """
+
+    type_name = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, func: Callable[[], Dict[Labels, float]], label_names: Sequence[str] = ()
+    ):
+        super().__init__(name, documentation, label_names)
+        self.func = func
+
+    def samples(self) -> Iterator[Tuple[str, Labels, Sequence[str], float]]:
+        for labels, value in self.func().items():
+            yield "", labels, (), value
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(line + "\n" for metric in self.metrics for line in metric.render())
+
+
+class SnowGlobeMetrics(MetricsRegistry):
+    """
+    The metrics the api records, the gauges of its state are registered by the api itself
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.requests = self.register(Counter("snowglobe_requests", "The number of requests handled", ["endpoint"]))
+        self.failed_queries = self.register(Counter("snowglobe_failed_queries", "The number of queries that failed"))
+        self.reaped_sessions = self.register(
+            Counter("snowglobe_reaped_sessions", "The number of sessions closed for being idle")
+        )
+        self.result_cache_lookups = self.register(
+            Counter("snowglobe_result_cache_lookups", "The number of lookups in the result cache", ["result"])
+        )
+        self.request_seconds = self.register(
+            Histogram("snowglobe_request_duration_seconds", "The duration of handling requests", ["endpoint"])
+        )
+        # the phases of a query request: unpack (decompressing and parsing the body), transpile, execute (every
+        # statement), convert (fetching and converting the result) and encode (serializing and compressing the response)
+        self.phase_seconds = self.register(
+            Histogram("snowglobe_phase_duration_seconds", "The duration of each phase of query requests", ["phase"])
+        )
+        self.statement_seconds = self.register(
+            Histogram("snowglobe_statement_duration_seconds", "The duration of statements, by handler", ["handler"])
+        )
+
+    @contextmanager
+    def request(self, endpoint: str) -> Iterator[None]:
+        self.requests.inc(endpoint)
+        with self.request_seconds.time(endpoint):
+            yield
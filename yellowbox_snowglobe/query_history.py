@@ -0,0 +1,117 @@
+"""
+Keeps a bounded history of the queries the api handled, along with where their time was spent, so that expensive
+queries can be found after the fact.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass, field
+from threading import Lock
+from time import time
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+from yellowbox_snowglobe.session import FAILED_WITH_ERROR, RUNNING, SUCCESS
+
+DEFAULT_HISTORY_SIZE = 1000
+
+
+@dataclass(eq=False)
+class QueryRecord:
+    """
+    Everything we know about a single query request, records are compared by identity
+    """
+
+    query_id: str
+    sql_text: str = ""  # the original, snowflake-dialect text
+    statements: Sequence[str] = ()  # the transpiled statements
+    handlers: List[str] = field(default_factory=list)  # the handler of every statement that was executed
+    phases: Dict[str, float] = field(default_factory=dict)  # the seconds spent in each phase of the request
+    row_count: Optional[int] = None
+    response_bytes: Optional[int] = None
+    explain: Optional[str] = None  # the plans of the statements, only for slow queries
+    status: str = RUNNING
+    start_time: float = field(default_factory=time)  # seconds since epoch
+    end_time: Optional[float] = None
+    error_message: Optional[str] = None
+
+    def finish(self) -> None:
+        self.end_time = time()
+        self.status = SUCCESS
+
+    def fail(self, error_message: str) -> None:
+        self.error_message = error_message
+        self.end_time = time()
+        self.status = FAILED_WITH_ERROR
+
+    def duration(self) -> float:
+        end_time = self.end_time if self.end_time is not None else time()
+        return end_time - self.start_time
+
+    def to_json(self) -> Dict[str, Any]:
+        # times are in milliseconds, like in snowflake
+        ret: Dict[str, Any] = {
+            "id": self.query_id,
+            "status": self.status,
+            "sqlText": self.sql_text,
+            "statements": list(self.statements),
+            "handlers": self.handlers,
+            "phases": {phase: seconds * 1000 for phase, seconds in self.phases.items()},
+            "startTime": int(self.start_time * 1000),
+            "totalDuration": int(self.duration() * 1000),
+        }
+        if self.end_time is not None:
+            ret["endTime"] = int(self.end_time * 1000)
+        if self.error_message is not None:
+            ret["errorMessage"] = self.error_message
+        if self.row_count is not None:
+            ret["rowCount"] = self.row_count
+        if self.response_bytes is not None:
+            ret["responseBytes"] = self.response_bytes
+        if self.explain is not None:
+            ret["explain"] = self.explain
+        return ret
+
+
+class QueryHistory:
+    """
+    A ring buffer of the most recent queries, and a separate one of the most recent slow queries
+    """
+
+    def __init__(self, max_queries: int = DEFAULT_HISTORY_SIZE):
+        self._queries: Deque[QueryRecord] = deque(maxlen=max_queries)
+        self._slow_queries: Deque[QueryRecord] = deque(maxlen=max_queries)
+        self._by_id: Dict[str, QueryRecord] = {}
+        self._lock = Lock()
+
+    def add(self, record: QueryRecord) -> None:
+        with self._lock:
+            if self._queries.maxlen is not None and len(self._queries) == self._queries.maxlen:
+                evicted = self._queries[0]
+                if evicted not in self._slow_queries:
+                    self._by_id.pop(evicted.query_id, None)
+            self._queries.append(record)
+            self._by_id[record.query_id] = record
+
+    def add_slow(self, record: QueryRecord) -> None:
+        with self._lock:
+            if self._slow_queries.maxlen is not None and len(self._slow_queries) == self._slow_queries.maxlen:
+                evicted = self._slow_queries[0]
+                if evicted not in self._queries:
+                    self._by_id.pop(evicted.query_id, None)
+            self._slow_queries.append(record)
+
+    def get(self, query_id: str) -> Optional[QueryRecord]:
+        return self._by_id.get(query_id)
+
+    def recent(self, limit: Optional[int] = None, *, slow: bool = False) -> List[QueryRecord]:
+        """
+        Get the most recent queries (or slow queries), newest first
+        """
+        with self._lock:
+            records = list(self._slow_queries if slow else self._queries)
+        records.reverse()
+        return records[:limit] if limit is not None else records
+
+    def __len__(self) -> int:
+        return len(self._queries)
@@ -0,0 +1,150 @@
+"""
+Caches the results of SELECT statements, like snowflake's result cache, so that repeated reads of tables that did not
+change don't run again. A cached result is discarded when a transaction that changed any of the tables it was read from
+is committed.
+"""
+
+from __future__ import annotations
+
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, FrozenSet, Hashable, Iterable, Optional, Sequence, Set, Tuple
+
+from yellowbox_snowglobe.bindings import Parameters
+from yellowbox_snowglobe.column_catalog import TableKey
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_ROWS = 10_000  # larger results are not cached
+
+# statements whose results might change without any table changing, or that change something themselves
+UNCACHEABLE_PATTERN = re.compile(
+    r"(?i)\b(random|now|current_\w+|localtime|localtimestamp|clock_timestamp|statement_timestamp|timeofday"
+    r"|nextval|setval|currval|lastval|gen_random_uuid|uuid_generate_\w+|txid_\w+|pg_\w+"
+    r"|insert|update|delete|for\s+(update|share))\b"
+)
+# matches DML statements that change a single table, capturing its (possibly qualified) name
+DML_TABLE_PATTERN = re.compile(
+    r"(?i)^\s*(?:insert\s+(?:overwrite\s+)?into|update|delete\s+from|copy\s+into)\s+"
+    r"((?:[a-z_][a-z0-9_$]*\.){0,2}[a-z_][a-z0-9_$]*)(?![a-z0-9_$.\"])"
+)
+SET_PATTERN = re.compile(r"(?i)^\s*set\s")
+
+CacheKey = Tuple[str, str, str, Hashable]  # (database, schema, statement, parameters)
+
+
+def written_tables(query: str, default_schema: str) -> Optional[FrozenSet[TableKey]]:
+    """
+    Get the tables a statement changes, or None if it might change any table. DDL statements might change the results
+    of queries on any table (for example, by replacing a view), so they are considered to change all of them.
+    """
+    if SET_PATTERN.match(query):
+        return frozenset()
+    match = DML_TABLE_PATTERN.match(query)
+    if not match:
+        return None
+    parts = match.group(1).lower().split(".")
+    schema = parts[-2] if len(parts) > 1 else default_schema.lower()
+    return frozenset({(schema, parts[-1])})
+
+
+def plan_tables(plan: Any) -> Optional[FrozenSet[TableKey]]:
+    """
+    Get the tables a query reads, from its plan as returned by EXPLAIN (VERBOSE, FORMAT JSON). Views are expanded in
+    plans, so these are the tables the views read. Returns None if the query reads temporary tables, which are only
+    visible to their own session.
+    """
+    tables: Set[TableKey] = set()
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, list):
+            nodes.extend(node)
+        elif isinstance(node, dict):
+            if "Relation Name" in node:
+                schema = node.get("Schema", "")
+                if schema.startswith("pg_temp"):
+                    return None
+                tables.add((schema.lower(), node["Relation Name"].lower()))
+            nodes.extend(value for value in node.values() if isinstance(value, (list, dict)))
+    return frozenset(tables)
+
+
+@dataclass
+class CachedResult:
+    description: Sequence[Tuple[Any, ...]]
+    rows: Sequence[Sequence[Any]]
+    tables: FrozenSet[TableKey]  # the tables the result was read from
+
+
+class ResultCache:
+    """
+    A bounded LRU cache of query results, shared by all the sessions
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_rows: int = DEFAULT_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries: OrderedDict[CacheKey, CachedResult] = OrderedDict()
+        # incremented whenever a database's results are invalidated, results read while their database was invalidated
+        # might be stale, so they are not stored
+        self._generations: Dict[str, int] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def key(db: str, schema: str, query: str, parameters: Parameters = None) -> Optional[CacheKey]:
+        """
+        Get the key of a statement's result, or None if its result can't be cached
+        """
+        if isinstance(parameters, list) or UNCACHEABLE_PATTERN.search(query):
+            return None
+        bound: Hashable = tuple(sorted(parameters.items())) if parameters else ()
+        try:
+            hash(bound)
+        except TypeError:
+            return None
+        return db, schema, query, bound
+
+    def get(self, key: CacheKey) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def generation(self, db: str) -> int:
+        return self._generations.get(db, 0)
+
+    def put(self, key: CacheKey, entry: CachedResult, generation: int) -> bool:
+        """
+        Store a result, unless its database was invalidated since the given generation, returns whether it was stored
+        """
+        if len(entry.rows) > self.max_rows:
+            return False
+        with self._lock:
+            if self._generations.get(key[0], 0) != generation:
+                return False
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, db: str, tables: Optional[Iterable[TableKey]] = None) -> None:
+        """
+        Discard the results read from any of the tables of a database, or all its results if tables is None
+        """
+        changed = None if tables is None else frozenset(tables)
+        with self._lock:
+            self._generations[db] = self._generations.get(db, 0) + 1
+            stale = [
+                key
+                for key, entry in self._entries.items()
+                if key[0] == db and (changed is None or not changed.isdisjoint(entry.tables))
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,85 @@
+"""
+Large results are split into chunks, like snowflake does. The first chunk is sent inline with the query response, and
+the rest are stored here until the connector downloads them from the chunk endpoint.
+"""
+
+from __future__ import annotations
+
+import gzip
+from asyncio import wrap_future
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+# chunks are only ever sent over a local network, so we prefer fast compression over small chunks
+CHUNK_COMPRESSION_LEVEL = 1
+
+
+@dataclass
+class ChunkDestination:
+    """
+    Where the chunks of a single query's result are to be stored
+    """
+
+    owner: str  # the token of the session that made the query, its chunks are discarded when it is closed
+    query_id: str
+    base_url: str  # the base url of the api, as seen by the connector
+
+    def key(self, index: int) -> str:
+        return f"{self.query_id}/{index}"
+
+    def url(self, index: int) -> str:
+        return f"{self.base_url}chunks/{self.key(index)}"
+
+
+class ResultChunks:
+    def __init__(self, compression_workers: int = 2):
+        self._executor = ThreadPoolExecutor(compression_workers, thread_name_prefix="snowglobe_chunk_compression")
+        # all pending chunks (and the sessions that created them), by key, each chunk is gzip-compressed in the
+        # background as soon as it is added
+        self._chunks: Dict[str, Tuple[str, Future[bytes]]] = {}
+        self._keys_by_owner: Dict[str, Set[str]] = {}  # the keys of the pending chunks created by each session
+
+    def add(self, destination: ChunkDestination, index: int, payload: bytes) -> str:
+        """
+        Store a chunk to be compressed in the background, returns the url it can be downloaded from
+        """
+        key = destination.key(index)
+        self._chunks[key] = (
+            destination.owner,
+            self._executor.submit(gzip.compress, payload, CHUNK_COMPRESSION_LEVEL),
+        )
+        self._keys_by_owner.setdefault(destination.owner, set()).add(key)
+        return destination.url(index)
+
+    async def pop(self, key: str) -> Optional[bytes]:
+        """
+        Remove a chunk from the store and return its compressed payload, waiting for compression to finish if needed
+        """
+        chunk = self._chunks.pop(key, None)
+        if chunk is None:
+            return None
+        owner, future = chunk
+        owner_keys = self._keys_by_owner.get(owner)
+        if owner_keys is not None:
+            owner_keys.discard(key)
+            if not owner_keys:
+                del self._keys_by_owner[owner]
+        return await wrap_future(future)
+
+    def discard_owner(self, owner: str) -> None:
+        """
+        Remove all the chunks of a session, whether they were downloaded or not
+        """
+        for key in self._keys_by_owner.pop(owner, ()):
+            chunk = self._chunks.pop(key, None)
+            if chunk is not None:
+                chunk[1].cancel()
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def close(self) -> None:
+        self._chunks.clear()
+        self._keys_by_owner.clear()
+        self._executor.shutdown(wait=False)
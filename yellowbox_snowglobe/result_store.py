@@ -0,0 +1,216 @@
+"""
+Stores the results of async queries until the connector retrieves them (with RESULT_SCAN). Results are kept in a compact
+columnar form, within a byte budget and for a limited time.
+"""
+
+from __future__ import annotations
+
+import pickle
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from yellowbox_snowglobe.session import QUERY_RESPONSE, RUNNING, AsyncQuery, QueryResult
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = 60 * 60  # seconds
+# stored results are compressed once and decompressed on every retrieval, so we prefer fast compression
+RESULT_COMPRESSION_LEVEL = 1
+# the number of rows fetched at a time from streamed results
+STORE_BATCH_ROWS = 10_000
+
+
+@dataclass
+class StoredResult:
+    """
+    A query result, stored as its compressed columns
+    """
+
+    description: Sequence[Tuple[Any, ...]]
+    row_count: int
+    payload: Optional[bytes]  # the compressed, pickled columns, None if the result was spilled to disk
+    spill_path: Optional[Path] = None
+
+    @classmethod
+    def from_result(cls, result: QueryResult) -> StoredResult:
+        columns: List[List[Any]] = [[] for _ in result.description]
+        row_count = 0
+        for batch in result.batches(STORE_BATCH_ROWS):
+            for i, column in enumerate(columns):
+                column.extend(row[i] for row in batch)
+            row_count += len(batch)
+        payload = zlib.compress(pickle.dumps(columns, protocol=pickle.HIGHEST_PROTOCOL), RESULT_COMPRESSION_LEVEL)
+        return cls(result.description, row_count, payload)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The number of bytes the result holds in memory
+        """
+        return len(self.payload) if self.payload is not None else 0
+
+    def spill(self, path: Path) -> None:
+        """
+        Move the result's payload to a file
+        """
+        assert self.payload is not None
+        path.write_bytes(self.payload)
+        self.spill_path = path
+        self.payload = None
+
+    def discard(self) -> None:
+        if self.spill_path is not None:
+            self.spill_path.unlink(missing_ok=True)
+            self.spill_path = None
+
+    def read_payload(self) -> bytes:
+        if self.payload is not None:
+            return self.payload
+        assert self.spill_path is not None
+        return self.spill_path.read_bytes()
+
+    def to_result(self, payload: Optional[bytes] = None) -> QueryResult:
+        """
+        Rebuild the result from its payload (read from the result if not provided)
+        """
+        if payload is None:
+            payload = self.read_payload()
+        columns = pickle.loads(zlib.decompress(payload))  # noqa: S301 we only load payloads we created
+        rows = list(zip(*columns)) if columns else [()] * self.row_count
+        return QueryResult(self.description, rows)
+
+
+class ResultStore:
+    """
+    Holds the status and result of every async query. Finished queries expire after a TTL, and when the results held in
+    memory exceed a byte budget, the least recently used ones are spilled to disk (if a spill directory is provided) or
+    discarded. Results can be retrieved any number of times until they expire.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: float = DEFAULT_TTL,
+        spill_directory: Union[str, Path, None] = None,
+    ):
+        """
+        Args:
+            max_bytes: the maximum number of (compressed) result bytes to hold in memory, the most recent result is
+                always held, even if it alone exceeds the budget
+            ttl: the number of seconds a finished query's result is kept for
+            spill_directory: if provided, results beyond the budget are moved to files in this directory rather than
+                discarded
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_directory = Path(spill_directory) if spill_directory is not None else None
+        self.nbytes = 0  # the number of result bytes held in memory
+        self._queries: OrderedDict[str, AsyncQuery] = OrderedDict()  # ordered from least to most recently used
+        self._results: Dict[str, Union[StoredResult, QUERY_RESPONSE]] = {}
+        self._lock = Lock()
+
+    def _remove(self, query_id: str) -> None:
+        del self._queries[query_id]
+        result = self._results.pop(query_id, None)
+        if isinstance(result, StoredResult):
+            self.nbytes -= result.nbytes
+            result.discard()
+
+    def _expire(self) -> None:
+        expiry = time() - self.ttl
+        expired = [
+            query_id
+            for query_id, query in self._queries.items()
+            if query.end_time is not None and query.end_time <= expiry
+        ]
+        for query_id in expired:
+            self._remove(query_id)
+
+    def _enforce_budget(self, keep: str) -> None:
+        for query_id in list(self._queries):
+            if self.nbytes <= self.max_bytes:
+                return
+            result = self._results.get(query_id)
+            if query_id == keep or not isinstance(result, StoredResult) or result.payload is None:
+                continue
+            if self.spill_directory is None:
+                self._remove(query_id)
+            else:
+                self.nbytes -= result.nbytes
+                self.spill_directory.mkdir(parents=True, exist_ok=True)
+                result.spill(self.spill_directory / f"{query_id}.result")
+
+    def start(self, query_id: str) -> AsyncQuery:
+        """
+        Register a new running query
+        """
+        with self._lock:
+            self._expire()
+            self._queries[query_id] = query = AsyncQuery()
+            return query
+
+    def get(self, query_id: str) -> Optional[AsyncQuery]:
+        """
+        Get the status of a query, or None if it is unknown (or expired)
+        """
+        with self._lock:
+            self._expire()
+            query = self._queries.get(query_id)
+            if query is not None:
+                self._queries.move_to_end(query_id)
+            return query
+
+    def finish(self, query_id: str, result: QUERY_RESPONSE) -> Optional[int]:
+        """
+        Store the result of a query and mark it as successful, this compresses the result so it might take a while.
+        Returns the number of rows stored, if the result has rows.
+        """
+        stored = StoredResult.from_result(result) if isinstance(result, QueryResult) else result
+        row_count = stored.row_count if isinstance(stored, StoredResult) else None
+        with self._lock:
+            query = self._queries.get(query_id)
+            if query is None:
+                if isinstance(stored, StoredResult):
+                    stored.discard()
+                return row_count
+            self._results[query_id] = stored
+            if isinstance(stored, StoredResult):
+                self.nbytes += stored.nbytes
+            query.finish()
+            self._queries.move_to_end(query_id)
+            self._enforce_budget(keep=query_id)
+        return row_count
+
+    def fail(self, query_id: str, error_message: str) -> None:
+        with self._lock:
+            query = self._queries.get(query_id)
+            if query is not None:
+                query.fail(error_message)
+
+    def result(self, query_id: str) -> QUERY_RESPONSE:
+        """
+        Get the result of a successful query
+        """
+        with self._lock:
+            query = self._queries.get(query_id)
+            if query is None or query.status == RUNNING:
+                raise KeyError(query_id)
+            self._queries.move_to_end(query_id)
+            stored = self._results.get(query_id)
+            if not isinstance(stored, StoredResult):
+                return stored
+            # we read the payload while holding the lock, so that the result can't be discarded while we read it
+            payload = stored.read_payload()
+        return stored.to_result(payload)
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def close(self) -> None:
+        with self._lock:
+            for query_id in list(self._queries):
+                self._remove(query_id)
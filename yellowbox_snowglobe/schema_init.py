@@ -1,4 +1,5 @@
 from sqlalchemy import text
+from sqlalchemy.engine import Connection
 
 # this is a script that should be run first thing in any new schema, it includes some adaptations to snowflake
 SCHEMA_INITIALIZE_SCRIPT = text("""
@@ -8,3 +9,13 @@ create function day(x DATE) returns int as $$select extract(day from $1) $$ lang
 create function parse_json(s text) returns jsonb as $$select s::jsonb $$ language sql immutable;
 CREATE DOMAIN string as TEXT;
 """)
+
+
+def initialize_schema(connection: Connection, schema: str, metadata_table_name: str) -> None:
+    """
+    create all the necessary snowglobe conversions in a schema, along with the metadata table that marks it as
+    initialized
+    """
+    connection.execute(text(f"SET search_path TO {schema};"))
+    connection.execute(SCHEMA_INITIALIZE_SCRIPT)
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {metadata_table_name}()"))
@@ -1,21 +1,71 @@
 from __future__ import annotations
 
-from typing import Any
+from typing import Any, Optional
 
 from yellowbox import AsyncRunMixin, RunMixin, YellowService
 from yellowbox.extras.postgresql import PostgreSQLService
 from yellowbox.utils import docker_host_name
 
-from yellowbox_snowglobe.api import SnowGlobeAPI
+from yellowbox_snowglobe.api import (
+    DEFAULT_GZIP_THRESHOLD,
+    DEFAULT_RESULT_CHUNK_ROWS,
+    DEFAULT_SESSION_IDLE_TIMEOUT,
+    DEFAULT_SQL_WORKERS,
+    SnowGlobeAPI,
+)
+from yellowbox_snowglobe.arrow_format import JSON_RESULT_FORMAT
 from yellowbox_snowglobe.case_mode import CaseMode, IgnoreAll
+from yellowbox_snowglobe.engines import DEFAULT_MAX_OVERFLOW, DEFAULT_POOL_SIZE
+from yellowbox_snowglobe.query_history import DEFAULT_HISTORY_SIZE
+from yellowbox_snowglobe.result_cache import ResultCache
+from yellowbox_snowglobe.result_store import ResultStore
+from yellowbox_snowglobe.transpile_cache import TranspileCache
 
 
 class SnowGlobeService(YellowService, RunMixin, AsyncRunMixin):
-    def __init__(self, *args, metadata_table_name: str = "__snowglobe_md", case_mode: CaseMode = IgnoreAll(), **kwargs):
+    def __init__(  # noqa: PLR0913
+        self,
+        *args,
+        metadata_table_name: str = "__snowglobe_md",
+        case_mode: CaseMode = IgnoreAll(),
+        result_format: str = JSON_RESULT_FORMAT,
+        result_chunk_rows: Optional[int] = DEFAULT_RESULT_CHUNK_ROWS,
+        transpile_cache: Optional[TranspileCache] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_overflow: int = DEFAULT_MAX_OVERFLOW,
+        sql_workers: int = DEFAULT_SQL_WORKERS,
+        stage_root: Optional[str] = None,
+        result_store: Optional[ResultStore] = None,
+        stream_results: bool = True,
+        gzip_threshold: Optional[int] = DEFAULT_GZIP_THRESHOLD,
+        query_history_size: int = DEFAULT_HISTORY_SIZE,
+        slow_query_threshold: Optional[float] = None,
+        session_idle_timeout: Optional[float] = DEFAULT_SESSION_IDLE_TIMEOUT,
+        max_sessions: Optional[int] = None,
+        result_cache: Optional[ResultCache] = None,
+        **kwargs,
+    ):
         super().__init__()
         self.sql_service = PostgreSQLService(*args, **kwargs)
         self.api = SnowGlobeAPI(
-            sql_service=self.sql_service, metadata_table_name=metadata_table_name, case_mode=case_mode
+            sql_service=self.sql_service,
+            metadata_table_name=metadata_table_name,
+            case_mode=case_mode,
+            result_format=result_format,
+            result_chunk_rows=result_chunk_rows,
+            transpile_cache=transpile_cache,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            sql_workers=sql_workers,
+            stage_root=stage_root,
+            result_store=result_store,
+            stream_results=stream_results,
+            gzip_threshold=gzip_threshold,
+            query_history_size=query_history_size,
+            slow_query_threshold=slow_query_threshold,
+            session_idle_timeout=session_idle_timeout,
+            max_sessions=max_sessions,
+            result_cache=result_cache,
         )
 
     @property
@@ -37,6 +87,22 @@ class SnowGlobeService(YellowService, RunMixin, AsyncRunMixin):
         self.api.stop()
         self.sql_service.stop(*args)
 
+    def snapshot(self, db: str, name: str = "default") -> None:
+        """
+        Save a copy of a database's current state, to be restored with restore(). This copies the database on the
+        server, so it is much faster than re-creating its contents, but no connection may be open to the database.
+        """
+        self.api.snapshot(db, name)
+
+    def restore(self, db: str, name: str = "default") -> None:
+        """
+        Restore a database to a snapshot taken with snapshot(), no connection may be open to the database
+        """
+        self.api.restore(db, name)
+
+    def drop_snapshot(self, db: str, name: str = "default") -> None:
+        self.api.drop_snapshot(db, name)
+
     def is_alive(self) -> bool:
         return self.api.is_alive() and self.sql_service.is_alive()
 
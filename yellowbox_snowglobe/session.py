@@ -1,70 +1,298 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Dict, Optional, Sequence, Set
+import hashlib
+import re
+import shutil
+from asyncio import Lock
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from functools import lru_cache
+from pathlib import Path
+from time import monotonic, time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Connection, Engine, Row, Transaction
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, CursorResult, Engine, Transaction
+from sqlalchemy.sql.elements import TextClause
 
-from yellowbox_snowglobe.schema_init import SCHEMA_INITIALIZE_SCRIPT
+from yellowbox_snowglobe.bindings import Parameters
+from yellowbox_snowglobe.column_catalog import ColumnCatalog, TableKey
+from yellowbox_snowglobe.result_cache import CachedResult, plan_tables, written_tables
+from yellowbox_snowglobe.schema_init import initialize_schema
+from yellowbox_snowglobe.stage import (
+    COMPRESSION_EXTENSIONS,
+    DEFAULT_MAX_FILE_SIZE,
+    INT8_OID,
+    TEXT_OID,
+    CopyInto,
+    FileTransfer,
+    SplitFileWriter,
+    copy_csv,
+    copy_parquet,
+    description,
+    option_flag,
+    parse_options,
+    parse_string_list,
+    split_leading_operand,
+    unload_csv,
+)
 
 if TYPE_CHECKING:
     from yellowbox_snowglobe.api import SnowGlobeAPI
 
-QUERY_RESPONSE = Optional[Sequence[Row]]
+
+@dataclass
+class QueryResult:
+    """
+    The result of a query that returns rows
+    """
+
+    description: Sequence[Tuple[Any, ...]]  # the DBAPI description of each column, this is where column types come from
+    rows: Sequence[Sequence[Any]]
+    # for results streamed from a server-side cursor, the rows that were not fetched yet (after all the rows in `rows`).
+    # The stream reads from the session's connection, so it must be consumed (or closed) while the session's lock is
+    # held, before the session runs its next statement
+    stream: Optional[CursorResult] = field(default=None, compare=False, repr=False)
+
+    def batches(self, size: int) -> Iterator[Sequence[Sequence[Any]]]:
+        """
+        Iterate over all the rows in batches of (at most) a given size, fetching streamed rows as needed
+        """
+        for start in range(0, len(self.rows), size):
+            yield self.rows[start : start + size]
+        if self.stream is not None:
+            stream, self.stream = self.stream, None
+            yield from stream.partitions(size)
+
+    def materialize(self) -> QueryResult:
+        """
+        Fetch all the streamed rows of the result
+        """
+        if self.stream is not None:
+            self.rows = [*self.rows, *self.stream.all()]
+            self.stream = None
+        return self
+
+    def close(self) -> None:
+        """
+        Discard all the rows that were not fetched yet
+        """
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+QUERY_RESPONSE = Optional[Union[QueryResult, FileTransfer]]
+
+# the statuses of asynchronous queries, named as the connector's QueryStatus
+RUNNING = "RUNNING"
+SUCCESS = "SUCCESS"
+FAILED_WITH_ERROR = "FAILED_WITH_ERROR"
+
+
+@dataclass
+class AsyncQuery:
+    """
+    The status of an asynchronous query, executed in the background, its result is held by the api's result store
+    """
+
+    status: str = RUNNING
+    start_time: float = field(default_factory=time)  # seconds since epoch
+    end_time: Optional[float] = None
+    error_message: Optional[str] = None
+    # the ids of the child queries that hold the results of a multi-statement query's statements
+    child_ids: List[str] = field(default_factory=list)
+
+    def finish(self) -> None:
+        self.end_time = time()
+        self.status = SUCCESS
+
+    def fail(self, error_message: str) -> None:
+        self.error_message = error_message
+        self.end_time = time()
+        self.status = FAILED_WITH_ERROR
+
+
+@lru_cache(maxsize=1024)
+def sql_text(statement: str) -> TextClause:
+    """
+    Get the (cached) sqlalchemy clause of a statement. Reusing the clause lets sqlalchemy reuse its compiled form
+    rather than compiling the statement on every execution.
+    """
+    return text(statement)
+
+
+ALTER_SESSION_PATTERN = re.compile(r"(?i)^alter\s+session\s+(?:set\s+(\w+)\s*=\s*(.*?)|unset\s+(\w+))\s*$")
+PUT_PATTERN = re.compile(r"(?is)^put\s+(.*)$")
+GET_PATTERN = re.compile(r"(?is)^get\s+(.*)$")
+CREATE_STAGE_PATTERN = re.compile(
+    r'(?is)^create\s+(or\s+replace\s+)?(temp(?:orary)?\s+)?stage\s+(if\s+not\s+exists\s+)?((?:"[^"]+"|[\w$.])+)'
+)
+DROP_STAGE_PATTERN = re.compile(r'(?is)^drop\s+stage\s+(if\s+exists\s+)?((?:"[^"]+"|[\w$.])+)')
+# string literals and quoted identifiers, which are removed before looking for keywords in a statement
+QUOTED_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+INTO_PATTERN = re.compile(r"(?i)\binto\b")
+# the result columns of statements that work with staged files, named as in snowflake
+COPY_INTO_TABLE_COLUMNS = description(
+    (
+        ("file", TEXT_OID),
+        ("status", TEXT_OID),
+        ("rows_parsed", INT8_OID),
+        ("rows_loaded", INT8_OID),
+        ("error_limit", INT8_OID),
+        ("errors_seen", INT8_OID),
+        ("first_error", TEXT_OID),
+        ("first_error_line", INT8_OID),
+        ("first_error_character", INT8_OID),
+        ("first_error_column_name", TEXT_OID),
+    )
+)
+UNLOAD_COLUMNS = description((("rows_unloaded", INT8_OID), ("input_bytes", INT8_OID), ("output_bytes", INT8_OID)))
+STATUS_COLUMNS = description((("status", TEXT_OID),))
+LIST_COLUMNS = description((("name", TEXT_OID), ("size", INT8_OID), ("md5", TEXT_OID), ("last_modified", TEXT_OID)))
+REMOVE_COLUMNS = description((("name", TEXT_OID), ("result", TEXT_OID)))
+
+
+def is_select_into(query: str) -> bool:
+    """
+    Whether a SELECT statement is a SELECT ... INTO, which creates a table rather than returning rows
+    """
+    return INTO_PATTERN.search(QUOTED_PATTERN.sub("", query)) is not None
+
+
+def handler_name(handler: Optional[Callable[..., Any]]) -> str:
+    # the name of a statement handler, as reported in metrics and in the query history
+    if handler is None:
+        return "unknown"
+    name = handler.__name__
+    return name[len("_do_") :] if name.startswith("_do_") else name
+
+
+def _file_md5(path: Path) -> str:
+    md5 = hashlib.md5()  # noqa: S324
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(block)
+    return md5.hexdigest()
 
 
 class SnowGlobeSession:
     # a session is an individual connection, containing all the data associated with it.
     next_token = 0  # each session is identified by a token the connector must send on every request
 
-    def __init__(self, owner: SnowGlobeAPI, db: Optional[str], schema: str):
+    def __init__(
+        self, owner: SnowGlobeAPI, db: Optional[str], schema: str, parameters: Optional[Mapping[str, Any]] = None
+    ):
         self.owner = owner
 
         self.token = str(self.next_token)
         type(self).next_token += 1
         self.schema = schema
-        # all these fields are set and replaced together when we switch the DB
+        # a session's statements must run one at a time, in order, this lock must be held while running them (the
+        # statements themselves run in the api's sql executor)
+        self.lock = Lock()
+        # all these fields are set and replaced together when we switch the DB, the connection is only checked out of
+        # the database's pool when the session first uses it
         self.db: Optional[str] = None
         self.engine: Optional[Engine] = None
         self._connection: Optional[Connection] = None
         self._transaction: Optional[Transaction] = None
+        # the monotonic time of the last request made with this session, idle sessions are closed by the api
+        self.last_used = monotonic()
 
-        self.known_columns: Set[str] = set()  # stores all the columns we know about, updates when a create or alter
-        # is called
+        # the (db, schema) pairs this session initialized, these are only known to be initialized once committed
+        self._uncommitted_schemas: Set[Tuple[str, str]] = set()
+        # the tables this session's transaction changed, None if it might have changed any table, cached results of
+        # queries on them are discarded once the transaction is committed
+        self._written_tables: Optional[Set[TableKey]] = set()
+        # the directories of the temporary stages this session created, removed when the session closes
+        self._temporary_stages: List[Path] = []
+        # session parameters, either sent by the connector on login or set with "ALTER SESSION", keys are uppercase
+        self.parameters: Dict[str, Any] = {k.upper(): v for k, v in (parameters or {}).items()}
         if db:
             self.switch_db(db, schema)
 
     @property
-    def connection(self) -> Connection:
-        if not self._connection:
+    def connected(self) -> bool:
+        return self._connection is not None
+
+    def _connect(self) -> Connection:
+        if self.db is None:
             raise Exception("No connection exists, make sure to use a database first")
+        self.engine = self.owner.engines.engine(self.db)
+        self._connection = connection = self.engine.connect()
+        self._transaction = connection.begin()
+        self._initialize_schema()
+        return connection
+
+    @property
+    def connection(self) -> Connection:
+        if self._connection is None:
+            return self._connect()
         return self._connection
 
+    @property
+    def known_columns(self) -> ColumnCatalog:
+        """
+        All the columns we know about in the current database, shared with all the sessions on it
+        """
+        if self.db is None:
+            return ColumnCatalog()
+        catalog = self.owner.column_catalog(self.db)
+        if not catalog.loaded:
+            catalog.refresh(self.connection)
+        return catalog
+
     @property
     def transaction(self) -> Transaction:
-        if not self._transaction:
-            raise Exception("No connection exists, make sure to use a database first")
+        if self._transaction is None:
+            self._connect()
+        assert self._transaction is not None
         return self._transaction
 
+    def _disconnect(self) -> None:
+        # returns the connection to its database's pool, rolling back any uncommitted work
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = self._transaction = None
+        self._uncommitted_schemas.clear()
+        self._written_tables = set()
+
     def switch_db(self, db_name: str, schema_name: str = "public"):
         if self.db == db_name:
             return
-        if self.engine:
-            self.engine.dispose()
+        self._disconnect()
         self.db = db_name
-        conn_string = self.owner.sql_service.database(db_name).local_connection_string()
-        self.engine = create_engine(conn_string)
         self.schema = schema_name
-        self._connection = self.engine.connect()
-        self._transaction = self._connection.begin()
-        self._initialize_schema()
 
     def _initialize_schema(self):
         """
         create all the necessary snowglobe conversions in the current schema
         """
+        assert self.db is not None
+        key = (self.db, self.schema)
+        if key in self.owner.initialized_schemas or key in self._uncommitted_schemas:
+            return
+        if self.schema == "public" and self.db in self.owner.engines.templated_databases:
+            # the database was copied from the template, which has its public schema initialized
+            self.owner.initialized_schemas.add(key)
+            return
         with self.connection.begin_nested():
-            # right now, the only indicator of initialization is the presence of the metadata table
+            # the only indicator of initialization in the database itself is the presence of the metadata table
             exists = self.connection.execute(
                 text(
                     f"SELECT EXISTS(SELECT FROM information_schema.tables"
@@ -73,12 +301,28 @@ class SnowGlobeSession:
                 )
             ).scalar()
             if exists:
+                self.owner.initialized_schemas.add(key)
                 return
-            self.connection.execute(text(f"SET search_path TO {self.schema};"))
-            self.connection.execute(SCHEMA_INITIALIZE_SCRIPT)
-            self.connection.execute(text(f"CREATE TABLE IF NOT EXISTS {self.owner.metadata_table_name}()"))
+            initialize_schema(self.connection, self.schema, self.owner.metadata_table_name)
+            self._uncommitted_schemas.add(key)
 
-    def do_query(self, query: str) -> QUERY_RESPONSE:
+    def parameter(
+        self, name: str, default: Any = None, statement_parameters: Optional[Mapping[str, Any]] = None
+    ) -> Any:
+        """
+        Get the value of a session parameter, parameters sent with a specific statement take precedence
+        """
+        name = name.upper()
+        if statement_parameters:
+            for k, v in statement_parameters.items():
+                if k.upper() == name:
+                    return v
+        return self.parameters.get(name, default)
+
+    def handler(self, query: str) -> Optional[Callable[..., QUERY_RESPONSE]]:
+        """
+        Get the handler of a statement, or None if the statement is unknown
+        """
         # queries are always normalized to be without a semicolon
         query_lower = query.lower()
         prefix_search_root: Any = self.FUNC_BY_PREFIX
@@ -89,63 +333,389 @@ class SnowGlobeSession:
                 break
             prefix_search_root = prefix_search_root.get(word) or prefix_search_root.get(None)
             if not prefix_search_root:
-                print(f"Unknown query: {query}")
                 return None
-        return prefix_search_root(self, query)
+        return prefix_search_root
+
+    def _run_handler(
+        self, handler: Optional[Callable[..., QUERY_RESPONSE]], query: str, parameters: Parameters = None
+    ) -> QUERY_RESPONSE:
+        if handler is None:
+            print(f"Unknown query: {query}")
+            return None
+        with self.owner.metrics.statement_seconds.time(handler_name(handler)):
+            return handler(self, query, parameters)
+
+    def do_query(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        return self._run_handler(self.handler(query), query, parameters)
+
+    def do_queries(self, queries: Sequence[str], parameters: Parameters = None) -> Iterator[Tuple[str, QUERY_RESPONSE]]:
+        """
+        Run statements in order, yielding the name of each statement's handler along with its result. Runs of
+        consecutive statements that have no results (DML and DDL) are sent to postgresql as a single batch, rather than
+        one at a time (unless there are parameters, which are bound to every statement).
+        Each statement only runs once the previous one's result was consumed, and that result is closed before it runs.
+        """
+        handlers = [self.handler(query) for query in queries]
+        previous: QUERY_RESPONSE = None
+        i = 0
+        while i < len(queries):
+            if isinstance(previous, QueryResult):
+                # a streamed result must be closed before its connection runs another statement
+                previous.close()
+            end = i + 1
+            if parameters is None and handlers[i] in self.BATCHABLE_HANDLERS:
+                while end < len(queries) and handlers[end] in self.BATCHABLE_HANDLERS:
+                    end += 1
+            if end - i > 1:
+                self.do_batch(queries[i:end], handlers[i:end])
+                for handler in handlers[i:end]:
+                    yield handler_name(handler), None
+                previous = None
+            else:
+                previous = self._run_handler(handlers[i], queries[i], parameters)
+                yield handler_name(handlers[i]), previous
+            i = end
+
+    def do_batch(self, queries: Sequence[str], handlers: Sequence[Optional[Callable[..., QUERY_RESPONSE]]]) -> None:
+        """
+        Execute statements that have no results as a single multi-statement query, over postgresql's simple query
+        protocol, so that they cost a single round trip
+        """
+        with self.owner.metrics.statement_seconds.time("batch"), self._driver_cursor() as cursor:
+            cursor.execute(";\n".join(queries))
+        for query in queries:
+            self._record_write(query)
+        ddl_queries = [query for query, handler in zip(queries, handlers) if handler_name(handler) == "ddl"]
+        if ddl_queries:
+            # the statements might have changed the columns of tables, so we need to update the known columns
+            assert self.db is not None
+            catalog = self.owner.column_catalog(self.db)
+            for query in ddl_queries:
+                catalog.update_after_ddl(self.connection, query, self.schema)
+
+    def explain(self, query: str, parameters: Parameters = None) -> str:
+        """
+        Get the plan of a statement with EXPLAIN, which plans the statement without executing it (in a savepoint, so
+        that a failure doesn't abort the transaction)
+        """
+        savepoint = self.connection.begin_nested()
+        try:
+            rows = self.connection.execute(sql_text(f"EXPLAIN (VERBOSE) {query}"), parameters).all()
+        finally:
+            savepoint.rollback()
+        return "\n".join(row[0] for row in rows)
+
+    def _record_write(self, query: str) -> None:
+        if self._written_tables is None:
+            return
+        tables = written_tables(query, self.schema)
+        if tables is None:
+            self._written_tables = None
+        else:
+            self._written_tables.update(tables)
+
+    def _invalidate_written_tables(self) -> None:
+        cache = self.owner.result_cache
+        if cache is None or self.db is None or self._written_tables == set():
+            return
+        cache.invalidate(self.db, self._written_tables)
+
+    def _read_tables(self, query: str, parameters: Parameters = None) -> Optional[FrozenSet[TableKey]]:
+        # the tables a query reads, from its plan (in a savepoint, so that a failure doesn't abort the transaction)
+        try:
+            with self.connection.begin_nested():
+                plan = self.connection.execute(sql_text(f"EXPLAIN (VERBOSE, FORMAT JSON) {query}"), parameters).scalar()
+        except Exception:
+            return None
+        return plan_tables(plan)
 
     # region handlers
-    def _do_ignore(self, query: str) -> QUERY_RESPONSE:
+    def _do_ignore(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
         return None
 
     def _restart_transaction(self) -> None:
         self._transaction = self.connection.begin()
 
-    def _do_commit(self, query: str) -> QUERY_RESPONSE:
-        if self.transaction.is_active:
-            self.transaction.commit()
-        self._restart_transaction()
+    def _do_commit(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        # a session that never connected has nothing to commit
+        if self._transaction is not None:
+            if self._transaction.is_active:
+                self._transaction.commit()
+                self.owner.initialized_schemas.update(self._uncommitted_schemas)
+                self._invalidate_written_tables()
+            self._restart_transaction()
+        self._uncommitted_schemas.clear()
+        self._written_tables = set()
         return None
 
-    def _do_rollback(self, query: str) -> QUERY_RESPONSE:
-        if self.transaction.is_active:
-            self.transaction.rollback()
-        self._restart_transaction()
+    def _do_rollback(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        if self._transaction is not None:
+            if self._transaction.is_active:
+                self._transaction.rollback()
+            self._restart_transaction()
+        self._uncommitted_schemas.clear()
+        self._written_tables = set()
         return None
 
-    def _do_use_database(self, query: str) -> QUERY_RESPONSE:
+    def _do_use_database(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
         _, _, db_name = query.rpartition(" ")
         self.switch_db(db_name)
         return None
 
-    def _do_set_schema(self, query: str) -> QUERY_RESPONSE:
+    def _do_set_schema(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
         _, _, schema_name = query.rpartition(" ")
         # todo assert the schema exists
         self.schema = schema_name
         self._initialize_schema()
         return None
 
-    def _do_retrieve(self, query: str) -> QUERY_RESPONSE:
+    def _do_alter_session(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        match = ALTER_SESSION_PATTERN.match(query)
+        if not match:
+            raise ValueError(f"unsupported alter session statement: {query}")
+        set_name, value, unset_name = match.groups()
+        if unset_name:
+            self.parameters.pop(unset_name.upper(), None)
+        else:
+            self.parameters[set_name.upper()] = value.strip("'")
+        return None
+
+    def _do_retrieve(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
         _, _, query_id = query.rpartition(" ")
-        res = self.owner.query_results.pop(query_id, None)
+        res = self.owner.query_results.get(query_id)
         if res is None:
-            return None  # todo some better handling here?
-        return res
+            raise Exception(f"the result of query {query_id} is not available, it might have expired")
+        if res.status == RUNNING:
+            raise Exception(f"query {query_id} is still running")
+        if res.status == FAILED_WITH_ERROR:
+            raise Exception(res.error_message)
+        # results are kept until they expire, so they can be retrieved repeatedly
+        return self.owner.query_results.result(query_id)
 
-    def _do_select(self, query: str) -> QUERY_RESPONSE:
-        result = self.connection.execute(text(query)).all()
+    def _do_select(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        if is_select_into(query):
+            # it returns no rows, so it can't be declared as a server-side cursor (or cached)
+            return self._do_ddl(query, parameters)
+        cache = self.owner.result_cache
+        key = None
+        # the session's own uncommitted changes are not visible to other sessions, so its results can't be shared
+        if cache is not None and self.db is not None and self._written_tables == set():
+            key = cache.key(self.db, self.schema, query, parameters)
+        if key is None:
+            return self._select(query, parameters)
+        assert cache is not None
+        cached = cache.get(key)
+        self.owner.metrics.result_cache_lookups.inc("hit" if cached is not None else "miss")
+        if cached is not None:
+            return QueryResult(cached.description, cached.rows)
+        generation = cache.generation(key[0])
+        result = self._select(query, parameters, prefetch=cache.max_rows + 1)
+        if result.stream is None:
+            tables = self._read_tables(query, parameters)
+            if tables is not None:
+                cache.put(key, CachedResult(result.description, result.rows, tables), generation)
         return result
 
-    def _do_mutating_noresponse(self, query: str) -> QUERY_RESPONSE:
-        self.connection.execute(text(query))
-        # we need to update the known columns here
-        result = self.connection.execute(
-            text(
-                "select column_name from information_schema.columns c where c.table_schema <> 'pg_catalog'"
-                "AND c.table_schema <> 'information_schema';"
+    def _select(self, query: str, parameters: Parameters = None, prefetch: int = 0) -> QueryResult:
+        """
+        Execute a query, when streaming, up to prefetch rows are fetched right away (if that is all the rows, the
+        result is not streamed)
+        """
+        if self.owner.stream_results:
+            # the rows are fetched from a server-side cursor as they are consumed, rather than all at once
+            result = self.connection.execute(sql_text(query), parameters, execution_options={"stream_results": True})
+            description = tuple(tuple(column) for column in result.cursor.description)
+            if not prefetch:
+                return QueryResult(description, [], result)
+            rows = result.fetchmany(prefetch)
+            if len(rows) < prefetch:
+                result.close()
+                return QueryResult(description, rows)
+            return QueryResult(description, rows, result)
+        result = self.connection.execute(sql_text(query), parameters)
+        description = tuple(tuple(column) for column in result.cursor.description)
+        return QueryResult(description, result.all())
+
+    def _do_mutating_noresponse(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        # array bindings are sent in pages of statements rather than one row at a time (see EXECUTEMANY_MODE)
+        self.connection.execute(sql_text(query), parameters)
+        self._record_write(query)
+        return None
+
+    def _do_ddl(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        self.connection.execute(sql_text(query), parameters)
+        self._record_write(query)
+        # the statement might have changed the columns of a table, so we need to update the known columns
+        assert self.db is not None
+        self.owner.column_catalog(self.db).update_after_ddl(self.connection, query, self.schema)
+        return None
+
+    def _do_create_stage(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        match = CREATE_STAGE_PATTERN.match(query)
+        if not match:
+            raise ValueError(f"unsupported create stage statement: {query}")
+        replace, temporary, if_not_exists, name = match.groups()
+        directory = self.owner.stage.stage_directory(name, self.db, self.schema)
+        if directory.exists():
+            if replace:
+                shutil.rmtree(directory)
+            elif not if_not_exists:
+                raise Exception(f"Stage {name} already exists")
+        directory.mkdir(parents=True, exist_ok=True)
+        if temporary:
+            self._temporary_stages.append(directory)
+        return QueryResult(STATUS_COLUMNS, [(f"Stage area {name.upper()} successfully created.",)])
+
+    def _do_drop_stage(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        match = DROP_STAGE_PATTERN.match(query)
+        if not match:
+            raise ValueError(f"unsupported drop stage statement: {query}")
+        if_exists, name = match.groups()
+        directory = self.owner.stage.stage_directory(name, self.db, self.schema)
+        if not directory.exists():
+            if if_exists:
+                return None
+            raise Exception(f"Stage {name} does not exist")
+        shutil.rmtree(directory)
+        return QueryResult(STATUS_COLUMNS, [(f"{name.upper()} successfully dropped.",)])
+
+    def _do_put(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        match = PUT_PATTERN.match(query)
+        if not match:
+            raise ValueError(f"unsupported put statement: {query}")
+        source, rest = split_leading_operand(match.group(1))
+        stage_reference, rest = split_leading_operand(rest)
+        if not source.lower().startswith("file://"):
+            raise ValueError(f"PUT source must be a file:// url: {source}")
+        location = self.owner.stage.location(stage_reference, self.db, self.schema)
+        # the connector copies the files into the stage by itself
+        return FileTransfer("UPLOAD", [source[len("file://") :]], location.full_path, options=parse_options(rest))
+
+    def _driver_cursor(self) -> Any:
+        # a (psycopg2) cursor of the raw driver connection, which is in the same transaction as the session's
+        # connection, we use it to stream data through postgresql's COPY
+        driver_connection = self.connection.connection.driver_connection
+        assert driver_connection is not None
+        return driver_connection.cursor()
+
+    def _do_copy_into(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        copy = CopyInto.parse(query)
+        if copy.target.startswith("@"):
+            return self._unload(copy)
+        self._record_write(query)
+        location = self.owner.stage.location(copy.source, self.db, self.schema)
+        names = parse_string_list(copy.options["FILES"]) if "FILES" in copy.options else None
+        files = location.files(copy.options.get("PATTERN"), names)
+        if not files:
+            return QueryResult(STATUS_COLUMNS, [("Copy executed with 0 files processed.",)])
+        file_format = parse_options(copy.options.get("FILE_FORMAT", "").strip()[1:-1])
+        format_type = file_format.get("TYPE", "CSV").upper()
+        if format_type not in ("CSV", "PARQUET"):
+            raise Exception(f"unsupported file format type: {format_type}")
+        rows = []
+        # a failed load only rolls back the statement itself, like in snowflake
+        with self.connection.begin_nested(), self._driver_cursor() as cursor:
+            for file in files:
+                if format_type == "PARQUET":
+                    loaded = copy_parquet(
+                        cursor, copy.target, copy.columns, file, copy.options.get("MATCH_BY_COLUMN_NAME", "NONE")
+                    )
+                else:
+                    target = copy.target if copy.columns is None else f"{copy.target} ({copy.columns})"
+                    loaded = copy_csv(cursor, target, file, file_format)
+                rows.append((location.relative_name(file), "LOADED", loaded, loaded, 1, 0, None, None, None, None))
+        if copy.options.get("PURGE", "").upper() == "TRUE":
+            for file in files:
+                file.unlink()
+        return QueryResult(COPY_INTO_TABLE_COLUMNS, rows)
+
+    def _unload(self, copy: CopyInto) -> QUERY_RESPONSE:
+        # COPY INTO @stage, writes the result of a query (or the contents of a table) into files in the stage
+        location = self.owner.stage.location(copy.target, self.db, self.schema)
+        file_format = parse_options(copy.options.get("FILE_FORMAT", "").strip()[1:-1])
+        format_type = file_format.get("TYPE", "CSV").upper()
+        if format_type != "CSV":
+            raise Exception(f"unsupported unload file format type: {format_type}")
+        compression = file_format.get("COMPRESSION", "AUTO").upper()
+        if compression == "AUTO":
+            compression = "GZIP"
+        extension = ".csv" + COMPRESSION_EXTENSIONS.get(compression, "")
+        # like in snowflake, the last part of the path is the prefix of the files' names, unless it ends with a slash
+        if copy.target.endswith("/") or not location.path:
+            directory, prefix = location.full_path, "data"
+        else:
+            directory, prefix = location.full_path.parent, location.full_path.name
+        if option_flag(copy.options, "SINGLE", default=False):
+            existing = [directory / prefix] if (directory / prefix).is_file() else []
+            writer = SplitFileWriter(lambda _: directory / prefix, compression, max_file_size=None)
+        else:
+            existing = sorted(directory.glob(f"{prefix}_*")) if directory.is_dir() else []
+            writer = SplitFileWriter(
+                lambda i: directory / f"{prefix}_0_0_{i}{extension}",
+                compression,
+                int(copy.options.get("MAX_FILE_SIZE", DEFAULT_MAX_FILE_SIZE)),
             )
+        if existing:
+            if not option_flag(copy.options, "OVERWRITE", default=False):
+                raise Exception(
+                    f"Files already existing at the unload destination: {copy.target}."
+                    " Use overwrite option to force unloading."
+                )
+            for file in existing:
+                file.unlink()
+        query = copy.source[1:-1] if copy.source.startswith("(") else f"SELECT * FROM {copy.source}"
+        try:
+            # a failed query only rolls back the statement itself, like in snowflake
+            with self.connection.begin_nested(), self._driver_cursor() as cursor:
+                rows = unload_csv(
+                    cursor, query, writer, file_format, header=option_flag(copy.options, "HEADER", default=False)
+                )
+            writer.close()
+        except BaseException:
+            writer.discard()
+            raise
+        return QueryResult(UNLOAD_COLUMNS, [(rows, writer.input_bytes, writer.output_bytes)])
+
+    def _do_get(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        match = GET_PATTERN.match(query)
+        if not match:
+            raise ValueError(f"unsupported get statement: {query}")
+        stage_reference, rest = split_leading_operand(match.group(1))
+        destination, rest = split_leading_operand(rest)
+        if not destination.lower().startswith("file://"):
+            raise ValueError(f"GET destination must be a file:// url: {destination}")
+        options = parse_options(rest)
+        location = self.owner.stage.location(stage_reference, self.db, self.schema)
+        # the connector copies the files out of the stage by itself, their locations are relative to the stage
+        return FileTransfer(
+            "DOWNLOAD",
+            [location.relative_name(file) for file in location.files(options.get("PATTERN"))],
+            location.directory,
+            local_location=destination[len("file://") :],
+            options=options,
         )
-        self.known_columns = set(result.scalars().fetchall())
-        return None
+
+    def _do_list_stage(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        _, _, rest = query.strip().partition(" ")
+        stage_reference, rest = split_leading_operand(rest)
+        location = self.owner.stage.location(stage_reference, self.db, self.schema)
+        rows = []
+        for file in location.files(parse_options(rest).get("PATTERN")):
+            stat = file.stat()
+            rows.append(
+                (location.relative_name(file), stat.st_size, _file_md5(file), formatdate(stat.st_mtime, usegmt=True))
+            )
+        return QueryResult(LIST_COLUMNS, rows)
+
+    def _do_remove_stage(self, query: str, parameters: Parameters = None) -> QUERY_RESPONSE:
+        _, _, rest = query.strip().partition(" ")
+        stage_reference, rest = split_leading_operand(rest)
+        location = self.owner.stage.location(stage_reference, self.db, self.schema)
+        rows = []
+        for file in location.files(parse_options(rest).get("PATTERN")):
+            file.unlink()
+            rows.append((location.relative_name(file), "removed"))
+        return QueryResult(REMOVE_COLUMNS, rows)
 
     # endregion
 
@@ -162,23 +732,48 @@ class SnowGlobeSession:
         "insert": _do_mutating_noresponse,
         "create": {
             "database": _do_ignore,
-            None: _do_mutating_noresponse,
+            "stage": _do_create_stage,
+            "temp": {"stage": _do_create_stage, None: _do_ddl},
+            "temporary": {"stage": _do_create_stage, None: _do_ddl},
+            "or": {
+                "replace": {
+                    "stage": _do_create_stage,
+                    "temp": {"stage": _do_create_stage, None: _do_ddl},
+                    "temporary": {"stage": _do_create_stage, None: _do_ddl},
+                    None: _do_ddl,
+                },
+            },
+            None: _do_ddl,
         },
         "drop": {
-            "table": _do_mutating_noresponse,
+            "table": _do_ddl,
+            "stage": _do_drop_stage,
+        },
+        "put": _do_put,
+        "get": _do_get,
+        "copy": {
+            "into": _do_copy_into,
         },
+        "list": _do_list_stage,
+        "ls": _do_list_stage,
+        "remove": _do_remove_stage,
+        "rm": _do_remove_stage,
         "set": _do_mutating_noresponse,
         "delete": _do_mutating_noresponse,
         "update": _do_mutating_noresponse,
         "alter": {
-            "table": _do_mutating_noresponse,
+            "table": _do_ddl,
+            "session": _do_alter_session,
         },
     }
+    # the handlers of statements that are plain sql without results, so they can be sent to postgresql in batches
+    BATCHABLE_HANDLERS = frozenset({_do_ddl, _do_mutating_noresponse})
 
     def close(self):
-        if self.engine:
-            self.connection.close()
-            self.engine.dispose()
+        self._disconnect()
+        for directory in self._temporary_stages:
+            shutil.rmtree(directory, ignore_errors=True)
+        self._temporary_stages.clear()
 
 
 # todo data types
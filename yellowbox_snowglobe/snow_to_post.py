@@ -1,6 +1,7 @@
 import re
 from dataclasses import dataclass
-from typing import Iterable, Iterator, Pattern, Union
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Pattern, Sequence, Tuple, Union
 
 """
 This is a miniature transpiler that converts a snowflake-dialect query to a postgresql query.
@@ -8,104 +9,165 @@ Note that anything that can handled outside of this (like making a function call
 Is handled in the "schema_init" script instead.
 """
 
+# the version of the transpiler's code (the lexer, the splitter and the rewrites), persisted transpilations are only
+# valid for the version they were made with, so this must be bumped whenever a change affects the output
+TRANSPILER_VERSION = 1
+
 
 @dataclass
-class TextLiteral:
+class Opaque:
+    """
+    A token the transpiler passes through as is, rules are never applied to it and it is never split
+    """
+
     value: str
 
 
-def split_literals(query: str) -> Iterator[Union[str, TextLiteral]]:
-    # splits test literals out of a query
-    while query:
-        next_str_ind = query.find("'")
-        if next_str_ind == -1:
-            yield query
-            return
-        search_start = next_str_ind + 1
-        while True:
-            terminator_ind = query.find("'", search_start)
-            if terminator_ind == -1:
-                # unterminated string literal, we treat everything after the starter as a literal and let the caller
-                # deal with it
-                terminator_ind = len(query)
-            if len(query) <= (terminator_ind + 1) or query[terminator_ind + 1] != "'":
-                break
+class TextLiteral(Opaque):
+    pass
+
+
+class QuotedIdentifier(Opaque):
+    pass
+
+
+class Comment(Opaque):
+    pass
+
+
+# code is returned as plain strings, everything else as an opaque token
+Token = Union[str, Opaque]
+
+# a "//" preceded by a colon or a slash is part of a url (like "file:///"), not a comment
+_TOKEN_START_PATTERN = re.compile(r"'|\"|--|(?<![:/])//|/\*|\$\$")
+_LINE_END_PATTERN = re.compile(r"[\r\n]")
+
+
+def _quote_end(query: str, start: int, quote: str) -> int:
+    # find the end (exclusive) of a quoted token beginning at start, where a doubled quote is an escaped quote
+    search_start = start + 1
+    while True:
+        terminator_ind = query.find(quote, search_start)
+        if terminator_ind == -1:
+            # unterminated token, we treat everything after the starter as part of it and let the caller deal with it
+            return len(query)
+        if query.startswith(quote, terminator_ind + 1):
             search_start = terminator_ind + 2
-        yield query[:next_str_ind]
-        yield TextLiteral(query[next_str_ind : terminator_ind + 1])
-        query = query[terminator_ind + 1 :]
+            continue
+        return terminator_ind + 1
+
+
+def tokenize(query: str) -> Iterator[Token]:
+    """
+    Split a query to tokens in a single pass. String literals (including $$-quoted ones), quoted identifiers and
+    comments are returned as opaque tokens, all the code between them as strings.
+    """
+    pos = 0
+    while pos < len(query):
+        found = _TOKEN_START_PATTERN.search(query, pos)
+        if not found:
+            yield query[pos:]
+            return
+        start = found.start()
+        if start > pos:
+            yield query[pos:start]
+        starter = found.group()
+        if starter == "'":
+            pos = _quote_end(query, start, starter)
+            yield TextLiteral(query[start:pos])
+        elif starter == '"':
+            pos = _quote_end(query, start, starter)
+            yield QuotedIdentifier(query[start:pos])
+        elif starter == "$$":
+            end = query.find("$$", start + 2)
+            pos = len(query) if end == -1 else end + 2
+            yield TextLiteral(query[start:pos])
+        elif starter == "/*":
+            end = query.find("*/", start + 2)
+            pos = len(query) if end == -1 else end + 2
+            yield Comment(query[start:pos])
+        else:
+            line_end = _LINE_END_PATTERN.search(query, start)
+            pos = len(query) if line_end is None else line_end.start()
+            # snowflake also accepts "//" line comments, postgresql only knows "--"
+            yield Comment("--" + query[start + 2 : pos])
+
+
+def split_literals(query: str) -> Iterator[Token]:
+    # kept for compatibility, splits the opaque tokens out of a query
+    return tokenize(query)
 
 
 def split_sql_to_statements(query: str) -> Iterator[str]:
-    # splits a compound query to multiple statements, splitting on non-literal ";"
+    # splits a compound query to multiple statements, splitting on ";" in code
     buffer = []
-    for part in split_literals(query):
-        if isinstance(part, TextLiteral):
-            buffer.append(part.value)
+    for token in tokenize(query):
+        if isinstance(token, Opaque):
+            buffer.append(token.value)
             continue
-        while True:
-            sep_index = part.find(";")
-            if sep_index == -1:
-                buffer.append(part)
-                break
-            buffer.append(part[:sep_index])
+        *complete, rest = token.split(";")
+        for part in complete:
+            buffer.append(part)
             yield "".join(buffer)
             buffer.clear()
-            part = part[sep_index + 1 :]
+        buffer.append(rest)
     last_bit = "".join(buffer)
     if last_bit:
         yield last_bit
 
 
-def find_matching_paren(text: str, start_pos: int) -> int:
+_ARRAY_CONSTRUCT_OR_PAREN_PATTERN = re.compile(r"(?i)\bARRAY_CONSTRUCT\(|[()]")
+
+
+def replace_array_construct_tokens(tokens: Iterable[Token]) -> List[Token]:
     """
-    Find the position of the closing parenthesis ')' corresponding to the opening parenthesis '(' at start_pos.
-    Handle nested parentheses by counting open/closed parentheses.
+    Replaces all occurrences of ARRAY_CONSTRUCT(...) with Array[...] in a token stream. Parentheses are matched across
+    the entire stream (ignoring those in opaque tokens), so nested and multi-token constructs are handled.
     """
-    if start_pos >= len(text) or text[start_pos] != "(":
-        return -1
-    depth = 1
-    pos = start_pos + 1
-    while pos < len(text) and depth > 0:
-        if text[pos] == "(":
-            depth += 1
-        elif text[pos] == ")":
-            depth -= 1
-        pos += 1
-    return pos - 1 if depth == 0 else -1
+    ret: List[Union[List[str], Opaque]] = []
+    # for every open parenthesis: if it belongs to an ARRAY_CONSTRUCT, where its replacement is and the original text
+    open_parens: List[Optional[Tuple[List[str], int, str]]] = []
+    for token in tokens:
+        if isinstance(token, Opaque):
+            ret.append(token)
+            continue
+        pieces: List[str] = []
+        last_end = 0
+        for found in _ARRAY_CONSTRUCT_OR_PAREN_PATTERN.finditer(token):
+            symbol = found.group()
+            if symbol == "(":
+                open_parens.append(None)
+                continue
+            if symbol == ")":
+                if not open_parens:
+                    continue  # unbalanced parenthesis, leave it to postgresql to complain about
+                array_construct = open_parens.pop()
+                if array_construct is None:
+                    continue
+                replacement = "]"
+            else:
+                open_parens.append((pieces, len(pieces) + 1, symbol))
+                replacement = "Array["
+            pieces.append(token[last_end : found.start()])
+            pieces.append(replacement)
+            last_end = found.end()
+        pieces.append(token[last_end:])
+        ret.append(pieces)
+    # constructs whose parenthesis was never closed are left as is
+    for array_construct in open_parens:
+        if array_construct is not None:
+            pieces, index, original = array_construct
+            pieces[index] = original
+    return [token if isinstance(token, Opaque) else "".join(token) for token in ret]
 
 
 def replace_array_construct(text: str) -> str:
     """
     Replaces all occurrences of ARRAY_CONSTRUCT(...) with Array[...] while correctly handling nested parentheses.
     """
-    result = []
-    i = 0
-    while i < len(text):
-        # Search for "ARRAY_CONSTRUCT(" (case-insensitive)
-        array_match = re.search(r"(?i)\bARRAY_CONSTRUCT\(", text[i:])
-        if not array_match:
-            result.append(text[i:])
-            break
-
-        array_start = i + array_match.start()
-        paren_start = i + array_match.end() - 1  # Position of the '('
-
-        # Find the corresponding closing parenthesis
-        paren_end = find_matching_paren(text, paren_start)
-        if paren_end == -1:
-            # Parenthesis not closed, leave as is
-            result.append(text[i:])
-            break
-
-        # Add text before ARRAY_CONSTRUCT(
-        result.append(text[i:array_start])
-        # Add Array[ with the content between parentheses
-        content = text[paren_start + 1 : paren_end]
-        result.append(f"Array[{content}]")
-        i = paren_end + 1
-
-    return "".join(result)
+    return "".join(
+        token.value if isinstance(token, Opaque) else token for token in replace_array_construct_tokens(tokenize(text))
+    )
 
 
 """
@@ -129,7 +191,7 @@ NAME_PATTERN = r"[a-z][a-z0-9_]*"
 
 # note that all commands starting with ! are special non-postgres commands for the session to handle specially
 
-# these are special rules that are run before the split_literals, as such they should be used sparingly (you almost
+# these are special rules that are run before the query is tokenized, as such they should be used sparingly (you almost
 # always want to add a "^" to the beginning of the pattern)
 PRE_SPLIT_RULES = [
     # retrieved stored asynchronous result
@@ -197,33 +259,67 @@ RULES = [
 ]
 
 
-def repl_part(part: Union[str, TextLiteral], rules: Iterable[Rule]) -> str:
-    if isinstance(part, TextLiteral):
+_GLOBAL_FLAGS_PATTERN = re.compile(r"^\(\?[aiLmsux]+\)")
+_SCOPED_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.VERBOSE, "x"))
+
+
+@lru_cache(maxsize=None)
+def combined_pattern(patterns: Tuple[Pattern[str], ...]) -> Pattern[str]:
+    """
+    Combine the patterns of a rule set into a single pattern, that matches wherever any of the patterns matches. This
+    lets us find the next match of any rule in a single scan. Note that the patterns' groups are renumbered in the
+    combined pattern, so the patterns must not use backreferences.
+    """
+    alternatives = []
+    for pattern in patterns:
+        flags = "".join(letter for flag, letter in _SCOPED_FLAGS if pattern.flags & flag)
+        body = _GLOBAL_FLAGS_PATTERN.sub("", pattern.pattern, count=1)
+        if pattern.flags & re.VERBOSE:
+            # a comment at the end of a verbose pattern would otherwise swallow the closing parenthesis
+            body += "\n"
+        alternatives.append(f"(?{flags}:{body})")
+    return re.compile("|".join(alternatives))
+
+
+def repl_part(part: Token, rules: Sequence[Rule]) -> str:
+    if isinstance(part, Opaque):
         return part.value
-    # Replace ARRAY_CONSTRUCT() with Array[] before applying the other rules
-    part = replace_array_construct(part)
+    combined = combined_pattern(tuple(rule.pattern for rule in rules))
     ret_parts = []
-    while part:
-        best_match = None
-        best_match_key = (float("inf"), 0)  # matches are ranked by position (shorter is better),
-        # then by length (longer is better, stored as negative)
-        for rule in rules:
-            match = rule.pattern.search(part)
-            if match:
-                match_key = (match.start(), -len(match.group()))
-                if match_key < best_match_key:
-                    best_match = (rule, match)
-                    best_match_key = match_key
-        if best_match:
-            rule, match = best_match
-            ret_parts.append(part[: match.start()])
-            part = match.expand(rule.replacement) + part[match.end() :]
-        else:
+    while True:
+        # matches are ranked by position (shorter is better), then by length (longer is better), then by rule order.
+        # the combined pattern finds the best position in a single scan, then we find the best match in that position
+        found = combined.search(part)
+        if not found:
             ret_parts.append(part)
             break
+        start = found.start()
+        best_match = None
+        for rule in rules:
+            match = rule.pattern.match(part, start)
+            if match and (best_match is None or match.end() > best_match[1].end()):
+                best_match = (rule, match)
+        assert best_match is not None
+        rule, match = best_match
+        ret_parts.append(part[:start])
+        # the replacement is searched again along with the rest of the part, so that rules can build on each other
+        part = match.expand(rule.replacement) + part[match.end() :]
     return "".join(ret_parts)
 
 
 def snow_to_post(query: str) -> str:
     query = repl_part(query, PRE_SPLIT_RULES)
-    return "".join(repl_part(part, RULES) for part in split_literals(query))
+    # Replace ARRAY_CONSTRUCT() with Array[] before applying the other rules
+    tokens = replace_array_construct_tokens(tokenize(query))
+    return "".join(repl_part(token, RULES) for token in tokens)
+
+
+def transpile(query: str) -> List[str]:
+    """
+    Convert a snowflake-dialect query text to the postgresql statements it should run as
+    """
+    if query.endswith(";"):
+        query = query[:-1]
+    post = snow_to_post(query)  # note that this query might well now have multiple statements, but only the
+    # last one counts
+    return list(split_sql_to_statements(post))
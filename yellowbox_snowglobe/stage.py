@@ -0,0 +1,505 @@
+"""
+A stage on the local filesystem. Since the connector copies files to and from a local stage by itself, a stage is just a
+directory the connector can access, and loading a staged file into a table streams it into postgresql's COPY.
+"""
+
+from __future__ import annotations
+
+import bz2
+import gzip
+import json
+import re
+import shutil
+from dataclasses import dataclass, field
+from datetime import date, time
+from io import BufferedIOBase
+from pathlib import Path
+from tempfile import mkdtemp
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, cast
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pq = None
+
+from yellowbox_snowglobe.snow_to_post import Opaque, tokenize
+
+# the size of the blocks staged files are streamed to postgresql in
+COPY_BLOCK_SIZE = 1024 * 1024
+# the number of rows parquet files are read in at a time
+PARQUET_BATCH_ROWS = 10_000
+# the characters escaped in postgresql's COPY text format
+_COPY_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+# the default size limit of unloaded files, like in snowflake
+DEFAULT_MAX_FILE_SIZE = 16 * 1024 * 1024
+# the file extension of each supported unload compression
+COMPRESSION_EXTENSIONS = {"NONE": "", "GZIP": ".gz", "BZ2": ".bz2"}
+
+# the oids of the column types of file-related results, as they appear in a DBAPI description
+TEXT_OID = 25
+INT8_OID = 20
+
+# matches a stage reference: @~ (the user stage), @%table (a table stage), or a named stage, each optionally followed by
+# a path within the stage
+STAGE_REFERENCE_PATTERN = re.compile(
+    r'^@(?P<name>~|%?(?:"[^"]+"|[\w$]+)(?:\.(?:"[^"]+"|[\w$]+)){0,2})(?:/(?P<path>.*))?$', re.IGNORECASE
+)
+# matches a single option, the value is either a quoted string, a parenthesized list, or a single word
+OPTION_PATTERN = re.compile(r"(?is)(\w+)\s*=\s*('(?:[^']|'')*'|\([^)]*\)|[^\s,)]+)")
+QUOTED_STRING_PATTERN = re.compile(r"'((?:[^']|'')*)'")
+
+
+def _unquote_string(value: str) -> str:
+    if len(value) >= 2 and value[0] == value[-1] == "'":  # noqa: PLR2004
+        return value[1:-1].replace("''", "'")
+    return value
+
+
+def _unquote_identifier(part: str) -> str:
+    if part.startswith('"'):
+        return part[1:-1]
+    return part.lower()
+
+
+def parse_options(text: str) -> Dict[str, str]:
+    """
+    Parse the "KEY = value" options of a statement, keys are uppercase and quoted values are unquoted. Parenthesized
+    values (like nested FILE_FORMAT options) are kept as they are.
+    """
+    return {key.upper(): _unquote_string(value) for key, value in OPTION_PATTERN.findall(text)}
+
+
+def parse_string_list(value: str) -> List[str]:
+    """
+    Parse a parenthesized list of quoted strings, like ('a', 'b')
+    """
+    return [v.replace("''", "'") for v in QUOTED_STRING_PATTERN.findall(value)]
+
+
+def option_flag(options: Dict[str, str], key: str, *, default: bool) -> bool:
+    value = options.get(key)
+    if value is None:
+        return default
+    return value.upper() == "TRUE"
+
+
+def split_leading_operand(text: str) -> Tuple[str, str]:
+    """
+    Split the first operand of a statement from its remainder. The operand is either a quoted string, a parenthesized
+    expression, or a single word.
+    """
+    text = text.lstrip()
+    if text.startswith("'"):
+        match = QUOTED_STRING_PATTERN.match(text)
+        if match:
+            return _unquote_string(match.group()), text[match.end() :]
+    if text.startswith("("):
+        depth = 0
+        consumed = 0
+        for token in tokenize(text):
+            if not isinstance(token, Opaque):
+                for i, char in enumerate(token):
+                    if char == "(":
+                        depth += 1
+                    elif char == ")":
+                        depth -= 1
+                        if depth == 0:
+                            end = consumed + i + 1
+                            return text[:end], text[end:]
+            consumed += len(token.value if isinstance(token, Opaque) else token)
+        raise ValueError(f"unbalanced parentheses in: {text}")
+    operand, _, rest = text.partition(" ")
+    return operand, rest
+
+
+COPY_INTO_PATTERN = re.compile(r"(?is)^copy\s+into\s+('(?:[^']|'')*'|[^\s(]+)\s*(.*)$")
+FROM_PATTERN = re.compile(r"(?is)^from\s+(.*)$")
+
+
+@dataclass
+class CopyInto:
+    """
+    A parsed "COPY INTO <target> [(<columns>)] FROM <source> <options>" statement
+    """
+
+    target: str  # a table, or a stage reference
+    columns: Optional[str]  # the column list of the target, without the parentheses
+    source: str  # a stage reference, a table, or a parenthesized query
+    options: Dict[str, str]
+
+    @classmethod
+    def parse(cls, query: str) -> CopyInto:
+        match = COPY_INTO_PATTERN.match(query.strip())
+        if not match:
+            raise ValueError(f"invalid COPY INTO statement: {query}")
+        target, rest = match.groups()
+        columns = None
+        if rest.startswith("("):
+            columns, rest = split_leading_operand(rest)
+            columns = columns[1:-1]
+        from_match = FROM_PATTERN.match(rest.lstrip())
+        if not from_match:
+            raise ValueError(f"COPY INTO statement has no FROM clause: {query}")
+        source, rest = split_leading_operand(from_match.group(1))
+        return cls(_unquote_string(target), columns, source, parse_options(rest))
+
+
+@dataclass
+class StageLocation:
+    """
+    A path within a stage
+    """
+
+    directory: Path  # the directory of the stage itself
+    path: str = ""  # the path within the stage, without leading or trailing slashes
+
+    @property
+    def full_path(self) -> Path:
+        return self.directory / self.path if self.path else self.directory
+
+    def files(self, pattern: Optional[str] = None, names: Optional[Sequence[str]] = None) -> List[Path]:
+        """
+        Get all the files under the location, optionally filtered by a regex that must match their path relative to the
+        stage, or by a list of file names relative to the location
+        """
+        if names is not None:
+            candidates = [self.full_path / name for name in names]
+            return [candidate for candidate in candidates if candidate.is_file()]
+        # like in snowflake, the path is a prefix of the files' names
+        candidates = sorted(
+            p for p in self.directory.rglob("*") if p.is_file() and self.relative_name(p).startswith(self.path)
+        )
+        if pattern is not None:
+            compiled = re.compile(pattern)
+            candidates = [c for c in candidates if compiled.fullmatch(self.relative_name(c))]
+        return candidates
+
+    def relative_name(self, file: Path) -> str:
+        """
+        The name of a file, relative to its stage
+        """
+        return file.relative_to(self.directory).as_posix()
+
+
+class LocalStage:
+    """
+    Holds all the stages of the api as directories under a single root directory
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self._owns_root = root is None  # a root we created ourselves is deleted when closed
+        self.root = Path(root if root is not None else mkdtemp(prefix="snowglobe-stage-"))
+
+    def stage_directory(self, name: str, db: Optional[str], schema: str) -> Path:
+        """
+        Get the directory of a stage by its name (without the "@"), named stages and table stages are qualified by their
+        database and schema
+        """
+        if name == "~":
+            return self.root / "~"
+        table_stage = name.startswith("%")
+        if table_stage:
+            name = name[1:]
+        parts = [_unquote_identifier(part) for part in re.findall(r'"[^"]+"|[^.]+', name)]
+        if len(parts) == 1:
+            parts.insert(0, schema.lower())
+        if len(parts) == 2:  # noqa: PLR2004
+            if db is None:
+                raise Exception("No database selected, make sure to use a database first")
+            parts.insert(0, db.lower())
+        if table_stage:
+            parts[-1] = "%" + parts[-1]
+        return self.root.joinpath(*parts)
+
+    def location(self, reference: str, db: Optional[str], schema: str) -> StageLocation:
+        """
+        Resolve a stage reference (like "@my_stage/path/") to a location
+        """
+        match = STAGE_REFERENCE_PATTERN.match(_unquote_string(reference.strip()))
+        if not match:
+            raise ValueError(f"invalid stage reference: {reference}")
+        path = (match.group("path") or "").strip("/")
+        return StageLocation(self.stage_directory(match.group("name"), db, schema), path)
+
+    def close(self) -> None:
+        if self._owns_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+@dataclass
+class FileTransfer:
+    """
+    A file transfer that the connector performs by itself, the response to PUT and GET
+    """
+
+    command: str  # either "UPLOAD" or "DOWNLOAD"
+    src_locations: List[str]
+    stage_directory: Path  # the directory the connector copies files to (or from)
+    local_location: Optional[str] = None  # the directory files are downloaded to
+    options: Dict[str, str] = field(default_factory=dict)
+
+    def response_data(self) -> Dict[str, Any]:
+        """
+        The "data" fields of the response to the transfer's statement
+        """
+        location = str(self.stage_directory) + "/"
+        ret: Dict[str, Any] = {
+            "command": self.command,
+            "src_locations": self.src_locations,
+            "parallel": int(self.options.get("PARALLEL", 1)),
+            "autoCompress": option_flag(self.options, "AUTO_COMPRESS", default=True),
+            "sourceCompression": self.options.get("SOURCE_COMPRESSION", "auto_detect").lower(),
+            "overwrite": option_flag(self.options, "OVERWRITE", default=False),
+            "stageInfo": {
+                "locationType": "LOCAL_FS",
+                "location": location,
+                "path": location,
+                "region": None,
+                "creds": {},
+            },
+            # files in a local stage are not encrypted
+            "encryptionMaterial": None,
+        }
+        if self.local_location is not None:
+            ret["localLocation"] = self.local_location
+        return ret
+
+
+def open_staged_file(path: Path) -> BufferedIOBase:
+    """
+    Open a staged file for reading, decompressing it if needed
+    """
+    with path.open("rb") as f:
+        magic = f.read(3)
+    if magic[:2] == b"\x1f\x8b":
+        return gzip.open(path, "rb")
+    if magic == b"BZh":
+        return bz2.open(path, "rb")
+    return path.open("rb")
+
+
+def _copy_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _csv_options(file_format: Dict[str, str]) -> List[str]:
+    # the postgresql COPY options equivalent to a snowflake csv file format
+    options = ["FORMAT csv"]
+    delimiter = file_format.get("FIELD_DELIMITER")
+    if delimiter is not None:
+        options.append(f"DELIMITER {_copy_literal(delimiter.encode().decode('unicode_escape'))}")
+    quote = file_format.get("FIELD_OPTIONALLY_ENCLOSED_BY")
+    if quote is not None and quote.upper() != "NONE":
+        options.append(f"QUOTE {_copy_literal(quote)}")
+    null_if = file_format.get("NULL_IF")
+    if null_if is not None:
+        null_values = parse_string_list(null_if)
+        if len(null_values) > 1:
+            raise ValueError("only a single NULL_IF value is supported")
+        if null_values:
+            options.append(f"NULL {_copy_literal(null_values[0].encode().decode('unicode_escape'))}")
+    return options
+
+
+def _copy_text_value(value: Any) -> str:
+    # a value in postgresql's COPY text format
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        text = "t" if value else "f"
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        text = "\\x" + bytes(value).hex()
+    elif isinstance(value, (dict, list)):
+        text = json.dumps(value, default=str)
+    elif isinstance(value, (date, time)):  # includes datetime
+        text = value.isoformat()
+    else:
+        text = str(value)
+    return text.translate(_COPY_TEXT_ESCAPES)
+
+
+def copy_text_row(values: Iterable[Any]) -> bytes:
+    """
+    Encode a row in postgresql's COPY text format
+    """
+    return ("\t".join(_copy_text_value(value) for value in values) + "\n").encode()
+
+
+class ChunkReader:
+    """
+    A readable file over an iterator of byte chunks, to stream generated data into postgresql's COPY
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        ret = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return ret
+
+
+def csv_copy_statement(target: str, file_format: Dict[str, str]) -> str:
+    """
+    Get the postgresql COPY statement that loads a csv file with a snowflake file format into a target
+    """
+    return f"COPY {target} FROM STDIN WITH ({', '.join(_csv_options(file_format))})"
+
+
+def csv_unload_statement(query: str, file_format: Dict[str, str], *, header: bool) -> str:
+    """
+    Get the postgresql COPY statement that writes the result of a query as csv with a snowflake file format
+    """
+    options = _csv_options(file_format)
+    if header:
+        options.append("HEADER true")
+    return f"COPY ({query}) TO STDOUT WITH ({', '.join(options)})"
+
+
+def copy_csv(cursor: Any, target: str, path: Path, file_format: Dict[str, str]) -> int:
+    """
+    Stream a staged csv file into a target with postgresql's COPY, returns the number of rows loaded
+    """
+    skip_header = int(file_format.get("SKIP_HEADER", 0))
+    with open_staged_file(path) as f:
+        for _ in range(skip_header):
+            f.readline()
+        cursor.copy_expert(csv_copy_statement(target, file_format), f, size=COPY_BLOCK_SIZE)
+    return cursor.rowcount
+
+
+def copy_parquet(
+    cursor: Any, table: str, columns: Optional[str], path: Path, match_by_column_name: str = "NONE"
+) -> int:
+    """
+    Stream a staged parquet file into a table with postgresql's COPY, in batches of rows. Columns are matched by
+    position, unless match_by_column_name (the COPY option of the same name) is set.
+    """
+    if pq is None:
+        raise ImportError("pyarrow is required to load parquet files, install snowglobe with the arrow extra")
+    parquet_file = pq.ParquetFile(path)
+    match_by_column_name = match_by_column_name.upper()
+    if columns is None and match_by_column_name != "NONE":
+        names = parquet_file.schema_arrow.names
+        if match_by_column_name == "CASE_INSENSITIVE":
+            names = [name.lower() for name in names]
+        columns = ", ".join('"' + name.replace('"', '""') + '"' for name in names)
+    target = table if columns is None else f"{table} ({columns})"
+    rows = (
+        copy_text_row(row.values())
+        for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_ROWS)
+        for row in batch.to_pylist()
+    )
+    cursor.copy_expert(f"COPY {target} FROM STDIN", ChunkReader(rows), size=COPY_BLOCK_SIZE)
+    return cursor.rowcount
+
+
+class SplitFileWriter:
+    """
+    Writes rows to a sequence of (optionally compressed) files, starting a new file whenever the current one reaches
+    a size limit. A header is written at the start of every file. Files are only created once there's a row to write.
+    """
+
+    def __init__(
+        self,
+        file_path: Callable[[int], Path],
+        compression: str = "NONE",
+        max_file_size: Optional[int] = DEFAULT_MAX_FILE_SIZE,
+        header: bytes = b"",
+    ):
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"unsupported compression: {compression}")
+        self.file_path = file_path  # gets the path of a file by its index
+        self.compression = compression
+        # the size at which a new file is started, None for no limit. Compressors buffer their output, so we measure
+        # the uncompressed size, the compressed files are never larger than it
+        self.max_file_size = max_file_size
+        self.header = header
+        self.files: List[Path] = []
+        self.input_bytes = 0  # the number of bytes written, before compression
+        self.output_bytes = 0  # the total size of all the closed files
+        self._raw: Optional[BinaryIO] = None  # the file currently written to
+        self._current_bytes = 0  # the number of bytes written to the current file, before compression
+        self._writer: Optional[BinaryIO] = None  # the (compressing) writer of the current file
+
+    def _open(self) -> BinaryIO:
+        path = self.file_path(len(self.files))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._raw = raw = path.open("wb")
+        if self.compression == "GZIP":
+            self._writer = cast(BinaryIO, gzip.GzipFile(fileobj=raw, mode="wb"))
+        elif self.compression == "BZ2":
+            self._writer = cast(BinaryIO, bz2.BZ2File(raw, mode="wb"))
+        else:
+            self._writer = raw
+        self.files.append(path)
+        self._writer.write(self.header)
+        self._current_bytes = len(self.header)
+        return self._writer
+
+    def _close_current(self) -> None:
+        if self._writer is None or self._raw is None:
+            return
+        if self._writer is not self._raw:
+            self._writer.close()  # flushes the compressed stream, leaving the raw file open
+        self.output_bytes += self._raw.tell()
+        self._raw.close()
+        self._writer = self._raw = None
+
+    def write(self, row: bytes) -> None:
+        writer = self._writer if self._writer is not None else self._open()
+        writer.write(row)
+        self.input_bytes += len(row)
+        self._current_bytes += len(row)
+        if self.max_file_size is not None and self._current_bytes >= self.max_file_size:
+            self._close_current()
+
+    def close(self) -> None:
+        self._close_current()
+
+    def discard(self) -> None:
+        """
+        Close and delete all the files written so far
+        """
+        self._close_current()
+        for file in self.files:
+            file.unlink()
+        self.files.clear()
+
+
+class _UnloadDestination:
+    # the file psycopg2's copy_expert writes an unloaded result to, it writes each row with a separate call
+    def __init__(self, writer: SplitFileWriter, header: bool):
+        self.writer = writer
+        self.expect_header = header
+
+    def write(self, row: bytes) -> None:
+        if self.expect_header:
+            # postgresql only writes the header once, but every file should start with it
+            self.writer.header = bytes(row)
+            self.expect_header = False
+        else:
+            self.writer.write(bytes(row))
+
+
+def unload_csv(cursor: Any, query: str, writer: SplitFileWriter, file_format: Dict[str, str], *, header: bool) -> int:
+    """
+    Stream the result of a query as csv from postgresql's COPY into split files, returns the number of rows unloaded
+    """
+    cursor.copy_expert(csv_unload_statement(query, file_format, header=header), _UnloadDestination(writer, header))
+    return cursor.rowcount
+
+
+def description(columns: Sequence[Tuple[str, int]]) -> Tuple[Tuple[Any, ...], ...]:
+    """
+    Get the DBAPI description of result columns by their names and type oids
+    """
+    return tuple((name, type_code, None, None, None, None, None) for name, type_code in columns)
@@ -0,0 +1,100 @@
+"""
+Clients tend to send the exact same query text over and over, so we cache the transpiled statements of each query text.
+"""
+
+from __future__ import annotations
+
+import json
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Sequence, Tuple, Union
+
+from yellowbox_snowglobe._version import __version__
+from yellowbox_snowglobe.snow_to_post import PRE_SPLIT_RULES, RULES, TRANSPILER_VERSION, transpile
+
+
+def rules_fingerprint() -> str:
+    """
+    A digest of all the transpilation rules and the transpiler's version, a persisted cache is only valid for the
+    transpiler it was created with
+    """
+    digest = sha256()
+    digest.update(f"{__version__}\0{TRANSPILER_VERSION}\0".encode())
+    for rule in (*PRE_SPLIT_RULES, *RULES):
+        digest.update(rule.pattern.pattern.encode())
+        digest.update(b"\0")
+        digest.update(rule.replacement.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TranspileCache:
+    """
+    A bounded LRU cache from snowflake-dialect query texts to their transpiled postgresql statements
+    """
+
+    def __init__(self, max_size: int = 1024, path: Union[str, Path, None] = None):
+        """
+        Args:
+            max_size: the maximum number of query texts to store, 0 disables the cache entirely
+            path: if provided, the cache will be loaded from this file and can be saved to it with save()
+        """
+        self.max_size = max_size
+        self.path = Path(path) if path is not None else None
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, Tuple[str, ...]] = OrderedDict()
+        self._lock = Lock()
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    def statements(self, query: str) -> Sequence[str]:
+        """
+        Get the postgresql statements of a query text, transpiling it if it is not cached
+        """
+        with self._lock:
+            stmts = self._entries.get(query)
+            if stmts is not None:
+                self.hits += 1
+                self._entries.move_to_end(query)
+                return stmts
+            self.misses += 1
+        stmts = tuple(transpile(query))
+        if self.max_size > 0:
+            with self._lock:
+                self._entries[query] = stmts
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return stmts
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def load(self, path: Optional[Path] = None) -> None:
+        path = path or self.path
+        if path is None:
+            raise ValueError("no path to load the cache from")
+        with path.open() as f:
+            stored = json.load(f)
+        if stored.get("fingerprint") != rules_fingerprint() or self.max_size <= 0:
+            # if the rules changed since the cache was stored, the stored statements might be wrong
+            return
+        with self._lock:
+            for query, stmts in stored["entries"][-self.max_size :]:
+                self._entries[query] = tuple(stmts)
+
+    def save(self, path: Optional[Path] = None) -> None:
+        path = path or self.path
+        if path is None:
+            raise ValueError("no path to save the cache to")
+        with self._lock:
+            entries = list(self._entries.items())
+        with path.open("w") as f:
+            json.dump({"fingerprint": rules_fingerprint(), "entries": entries}, f)